@@ -0,0 +1,415 @@
+'''
+An archive list cache records the name, creation time, and id of every archive in a repository, so
+that looking up archives (e.g. the newest one) doesn't require listing the repository over the
+network on every run.
+
+The cache is kept up to date from the output of borgmatic's own "borg create" and "borg prune"
+calls, or from borgmatic's own simulation of a prune. A cached list that borgmatic hasn't brought up to date during the current run gets
+revalidated against the last modification time of the repository's manifest before it's used, and
+the repository only gets listed again if the manifest has changed since.
+'''
+import collections
+import json
+import re
+import sys
+import threading
+
+from borgmatic import cache, execute
+from borgmatic.borg import placeholders, version
+from borgmatic.borg.environment import make_environment
+
+
+Archive = collections.namedtuple('Archive', ('name', 'time', 'id'))
+
+# Matches the archive lines that "borg prune --list" logs, e.g.:
+#
+#     Keeping archive: host-2018-01-02          Tue, 2018-01-02 03:04:05 [0123...]
+#     Pruning archive (1/2): host-2018-01-01    Mon, 2018-01-01 03:04:05 [4567...]
+#     Would prune:     host-2018-01-01          Mon, 2018-01-01 03:04:05 [4567...]
+PRUNE_LIST_PATTERN = re.compile(
+    r'^(?P<action>Keeping|Pruning|Would prune)(?: archive)?(?: \([^)]*\))?:\s+(?P<name>.+?)\s+'
+    r'\w{3}, (?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \[(?P<id>[0-9a-f]{64})\]$'
+)
+
+# Repositories whose archive lists borgmatic has brought up to date during the current run, mapped
+# to a tuple of the last modification time of the repository's manifest (or None if unknown) and a
+# tuple of Archive instances.
+_archive_lists = {}
+_archive_lists_lock = threading.Lock()
+
+
+def _cache_filename(repository):
+    '''
+    Given a local or remote repository path, return the path of the file caching its archive list.
+    '''
+    return cache.repository_cache_filename('archives', repository, 'json')
+
+
+def _normalize_time(time):
+    '''
+    Given an archive creation time as reported by Borg, either in ISO 8601 format as per its --json
+    output or in the "YYYY-MM-DD HH:MM:SS" format of its logs, return it in ISO 8601 format in the
+    local timezone, to the second.
+    '''
+    return time[:19].replace(' ', 'T')
+
+
+def _sort_archives(archives):
+    '''
+    Given an iterable of Archive instances, return them as a tuple sorted from oldest to newest, as
+    "borg list" does.
+    '''
+    return tuple(sorted(archives, key=lambda archive: (archive.time, archive.name)))
+
+
+def _read_entry(repository):
+    '''
+    Given a local or remote repository path, return a tuple of the last modification time of the
+    repository's manifest (or None if unknown), a tuple of cached Archive instances, and whether the
+    list was brought up to date during the current run. Return None if there's no cached list.
+    '''
+    with _archive_lists_lock:
+        entry = _archive_lists.get(repository)
+
+    if entry is not None:
+        return entry + (True,)
+
+    data = cache.read_json_cache_file(_cache_filename(repository))
+
+    try:
+        return (
+            data['last_modified'],
+            tuple(Archive(name, time, archive_id) for (name, time, archive_id) in data['archives']),
+            False,
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _write_entry(repository, last_modified, archives):
+    '''
+    Given a local or remote repository path, the last modification time of the repository's
+    manifest (or None if unknown), and an iterable of Archive instances, record them as the
+    repository's up to date archive list for the rest of the run and cache them for future runs.
+    '''
+    archives = _sort_archives(archives)
+
+    with _archive_lists_lock:
+        _archive_lists[repository] = (last_modified, archives)
+
+    cache.write_json_cache_file(
+        _cache_filename(repository),
+        {'last_modified': last_modified, 'archives': [list(archive) for archive in archives]},
+    )
+
+
+def forget_archive_list(repository):
+    '''
+    Given a local or remote repository path, forget its cached archive list, both for the rest of
+    the run and for future runs.
+    '''
+    with _archive_lists_lock:
+        _archive_lists.pop(repository, None)
+
+    cache.write_json_cache_file(_cache_filename(repository), None)
+
+
+def _parse_repository_last_modified(output):
+    '''
+    Given the JSON output of a Borg command as bytes, return the last modification time of the
+    repository's manifest from its "repository" section.
+    '''
+    return json.loads(output.decode('utf-8'))['repository']['last_modified']
+
+
+def _parse_list_output(output):
+    '''
+    Given the JSON output of "borg list --json" for a repository as bytes, return a tuple of the last
+    modification time of the repository's manifest and a tuple of Archive instances.
+    '''
+    data = json.loads(output.decode('utf-8'))
+
+    return (
+        data['repository']['last_modified'],
+        tuple(
+            Archive(archive['name'], _normalize_time(archive['start']), archive['id'])
+            for archive in data['archives']
+        ),
+    )
+
+
+def _make_borg_command(subcommand, repository, remote_path=None, flags=()):
+    '''
+    Given a Borg subcommand name, a local or remote repository path, an optional alternate Borg
+    remote executable, and any additional flags, return the command to run the subcommand against
+    the repository as a tuple.
+    '''
+    remote_path_flags = ('--remote-path', remote_path) if remote_path else ()
+
+    return ('borg', subcommand) + flags + (repository,) + remote_path_flags
+
+
+def _run_borg(subcommand, repository, storage_config, remote_path=None, flags=()):
+    '''
+    Given a Borg subcommand name, a local or remote repository path, a storage config dict, an
+    optional alternate Borg remote executable, and any additional flags, run the subcommand against
+    the repository and return its output as bytes.
+    '''
+    return execute.execute_command_and_capture_output(
+        _make_borg_command(subcommand, repository, remote_path, flags),
+        extra_environment=make_environment(storage_config),
+    )
+
+
+def _revalidate_entry(repository, storage_config, remote_path, entry):
+    '''
+    Given a local or remote repository path, a storage config dict, an optional alternate Borg
+    remote executable, and a cached archive list entry as per _read_entry() that isn't up to date,
+    ask Borg for the last modification time of the repository's manifest. If the manifest hasn't
+    changed since the list was recorded, mark the list as up to date for the rest of the run and
+    return True. Otherwise, return False.
+    '''
+    (last_modified, archives, up_to_date) = entry
+
+    if last_modified is None or last_modified != _parse_repository_last_modified(
+        _run_borg('info', repository, storage_config, remote_path, flags=('--json',))
+    ):
+        return False
+
+    _write_entry(repository, last_modified, archives)
+    return True
+
+
+def list_archives(repository, storage_config, remote_path=None):
+    '''
+    Given a local or remote repository path, a storage config dict, and an optional alternate Borg
+    remote executable, return a tuple of Archive instances for the archives in the repository,
+    sorted from oldest to newest.
+
+    Use the cached archive list if borgmatic has brought it up to date during the current run.
+    Otherwise, ask Borg for the last modification time of the repository's manifest, and only list
+    the repository if the manifest has changed since the cached list was recorded.
+
+    With a version of Borg that doesn't support --json output, list the repository every time, and
+    return archives with only their names.
+    '''
+    if not version.supports_json():
+        output = _run_borg('list', repository, storage_config, remote_path, flags=('--short',))
+
+        return tuple(
+            Archive(name, None, None)
+            for name in output.decode(sys.stdout.encoding).strip().split('\n')
+            if name
+        )
+
+    entry = _read_entry(repository)
+
+    if entry is not None:
+        (last_modified, archives, up_to_date) = entry
+
+        if up_to_date or _revalidate_entry(repository, storage_config, remote_path, entry):
+            return archives
+
+    (last_modified, archives) = _parse_list_output(
+        _run_borg('list', repository, storage_config, remote_path, flags=('--json',))
+    )
+    _write_entry(repository, last_modified, archives)
+
+    return _sort_archives(archives)
+
+
+def newest_archive(repository, storage_config, remote_path=None, prefix=None):
+    '''
+    Given a local or remote repository path, a storage config dict, an optional alternate Borg
+    remote executable, and an optional archive name prefix with Borg placeholders, return an Archive
+    instance for the most recently created archive in the repository whose name starts with the
+    prefix, or None if there are no such archives.
+
+    Use the cached archive list if borgmatic has brought it up to date during the current run.
+    Otherwise, ask Borg for just the newest archive with "--last 1". Its output also has the last
+    modification time of the repository's manifest, so the cached list gets revalidated for free.
+
+    With a version of Borg that doesn't support that, list the repository, but only keep the last
+    line of the listing in memory, and return an archive with only its name.
+    '''
+    prefix_flags = ('--prefix', prefix) if prefix else ()
+
+    if not version.supports_archive_filters():
+        tail = collections.deque(maxlen=1)
+
+        execute.execute_command_and_stream_output(
+            _make_borg_command('list', repository, remote_path, flags=('--short',) + prefix_flags),
+            lambda line: tail.append(line) if line.strip() else None,
+            extra_environment=make_environment(storage_config),
+        )
+
+        return Archive(tail[0].decode(sys.stdout.encoding).strip(), None, None) if tail else None
+
+    entry = _read_entry(repository)
+    expanded_prefix = placeholders.expand_placeholders(prefix) if prefix else ''
+
+    if entry is not None and entry[2] and expanded_prefix is not None:
+        matching = [archive for archive in entry[1] if archive.name.startswith(expanded_prefix)]
+
+        return matching[-1] if matching else None
+
+    (last_modified, archives) = _parse_list_output(
+        _run_borg(
+            'list',
+            repository,
+            storage_config,
+            remote_path,
+            flags=('--json', '--last', '1') + prefix_flags,
+        )
+    )
+
+    if entry is not None and entry[0] is not None and entry[0] == last_modified:
+        _write_entry(repository, last_modified, entry[1])
+
+    return archives[-1] if archives else None
+
+
+def revalidate_archive_list(repository, storage_config, remote_path=None):
+    '''
+    Given a local or remote repository path, a storage config dict, and an optional alternate Borg
+    remote executable, bring the repository's cached archive list up to date for the rest of the run
+    if the repository's manifest hasn't changed since the list was recorded.
+
+    Call this right before changing the repository, so that record_created_archive() can then
+    update the list rather than forget it. The list would get revalidated later in the run anyway,
+    so this doesn't cost an extra Borg call in the common case.
+    '''
+    if not version.supports_json():
+        return
+
+    entry = _read_entry(repository)
+
+    if entry is not None and not entry[2]:
+        _revalidate_entry(repository, storage_config, remote_path, entry)
+
+
+def record_created_archive(repository, create_output):
+    '''
+    Given a local or remote repository path and the JSON output of "borg create --json" for an
+    archive just created in it as bytes, add the archive to the repository's cached archive list, if
+    there is one.
+
+    Only a list that's up to date as of right before the create can be updated this way, as
+    otherwise it may lack archives that something else added since. So forget any other list.
+    '''
+    entry = _read_entry(repository)
+    if entry is None:
+        return
+
+    (last_modified, archives, up_to_date) = entry
+    if not up_to_date:
+        forget_archive_list(repository)
+        return
+
+    data = json.loads(create_output.decode('utf-8'))
+    archive = data['archive']
+
+    _write_entry(
+        repository,
+        data['repository']['last_modified'],
+        tuple(cached for cached in archives if cached.id != archive['id'])
+        + (Archive(archive['name'], _normalize_time(archive['start']), archive['id']),),
+    )
+
+
+def record_simulated_prune(repository, storage_config, remote_path, pruned_archives):
+    '''
+    Given a local or remote repository path, a storage config dict, an optional alternate Borg
+    remote executable, and a sequence of the Archive instances that a simulated prune as per
+    retention.simulate_prune() found that "borg prune" just pruned, remove them from the
+    repository's cached archive list. Then ask Borg for the new last modification time of the
+    repository's manifest, so that subsequent runs can revalidate the list without listing the
+    repository again.
+
+    The simulation starts from the cached list, so it's up to date as of right before the prune.
+    If it isn't anymore, forget it.
+    '''
+    entry = _read_entry(repository)
+    if entry is None:
+        return
+
+    (last_modified, archives, up_to_date) = entry
+    if not up_to_date:
+        forget_archive_list(repository)
+        return
+
+    pruned_ids = {archive.id for archive in pruned_archives}
+
+    _write_entry(
+        repository,
+        _parse_repository_last_modified(
+            _run_borg('info', repository, storage_config, remote_path, flags=('--json',))
+        ),
+        tuple(archive for archive in archives if archive.id not in pruned_ids),
+    )
+
+
+def parse_prune_line(line):
+    '''
+    Given a line of output from "borg prune --list" as a string, return a tuple of whether the
+    archive it describes is being kept and an Archive instance for it. Return None if the line
+    doesn't describe an archive.
+    '''
+    match = PRUNE_LIST_PATTERN.match(line.rstrip('\n'))
+    if not match:
+        return None
+
+    return (
+        match.group('action') == 'Keeping',
+        Archive(match.group('name'), _normalize_time(match.group('time')), match.group('id')),
+    )
+
+
+def record_pruned_archives(repository, kept_archives, pruned_archives, prefix=None):
+    '''
+    Given a local or remote repository path, sequences of the Archive instances that "borg prune"
+    kept and pruned, and the archive name prefix that the prune was restricted to (if any), update
+    the repository's cached archive list accordingly, if there is one.
+
+    Without a prefix, the kept archives are all of the archives left in the repository, so they
+    replace the cached list entirely. Borg doesn't report the manifest's last modification time after
+    a prune, so the cached list gets revalidated by listing the repository next time it's needed in
+    a subsequent run, unless borgmatic creates an archive before then.
+
+    With a prefix, the cached list also has archives that the prune didn't consider, so it only
+    gets updated if it's up to date as of right before the prune, and is forgotten otherwise. And if
+    Borg didn't list any archives at all, its output couldn't be parsed, so forget the cached list
+    as well.
+    '''
+    entry = _read_entry(repository)
+    if entry is None:
+        return
+
+    (last_modified, archives, up_to_date) = entry
+
+    if (not kept_archives and not pruned_archives) or (prefix is not None and not up_to_date):
+        forget_archive_list(repository)
+        return
+
+    if prefix is None:
+        _write_entry(repository, None, kept_archives)
+        return
+
+    pruned_ids = {archive.id for archive in pruned_archives}
+    cached_ids = {archive.id for archive in archives}
+
+    _write_entry(
+        repository,
+        None,
+        tuple(archive for archive in archives if archive.id not in pruned_ids)
+        + tuple(archive for archive in kept_archives if archive.id not in cached_ids),
+    )
+
+
+def clear_cache():
+    '''
+    Forget which archive lists borgmatic has brought up to date during the current run, so that they
+    get revalidated the next time they're needed.
+    '''
+    with _archive_lists_lock:
+        _archive_lists.clear()
@@ -1,7 +1,11 @@
+import hashlib
 import os
-import subprocess
+import socket
+import time
 
-from borgmatic.borg import extract
+from borgmatic import cache, duration, execute
+from borgmatic.borg import extract, placeholders
+from borgmatic.borg.environment import make_environment
 from borgmatic.verbosity import VERBOSITY_SOME, VERBOSITY_LOTS
 
 
@@ -30,7 +34,7 @@ def _parse_checks(consistency_config):
     return tuple(check for check in checks if check.lower() not in ('disabled', '')) or DEFAULT_CHECKS
 
 
-def _make_check_flags(checks, check_last=None):
+def _make_check_flags(checks, check_last=None, prefix=None):
     '''
     Given a parsed sequence of checks, transform it into tuple of command-line flags.
 
@@ -42,27 +46,145 @@ def _make_check_flags(checks, check_last=None):
 
         ('--repository-only',)
 
-    Additionally, if a check_last value is given, a "--last" flag will be added.
+    Additionally, if a check_last value is given, a "--last" flag will be added. And if an archive
+    name prefix is given and the archives get checked, a "--prefix" flag will be added.
     '''
     last_flag = ('--last', str(check_last)) if check_last else ()
+    prefix_flags = ('--prefix', prefix) if prefix and 'archives' in checks else ()
     if checks == DEFAULT_CHECKS:
-        return last_flag
+        return last_flag + prefix_flags
 
     return tuple(
         '--{}-only'.format(check) for check in checks
         if check in DEFAULT_CHECKS
-    ) + last_flag
+    ) + last_flag + prefix_flags
 
 
-def check_archives(verbosity, repository, consistency_config, remote_path=None):
+def _parse_frequency(frequency):
     '''
-    Given a verbosity flag, a local or remote repository path, a consistency config dict, and a
-    command to run, check the contained Borg archives for consistency.
+    Given a check frequency like "2 weeks", return its length in seconds as per
+    duration.parse_duration(). Return None if the check should always run, i.e. for a frequency of
+    "always" or no frequency at all. Raise ValueError if it's invalid.
+    '''
+    if frequency is None or str(frequency).lower() == 'always':
+        return None
+
+    return duration.parse_duration(frequency)
+
+
+def _splay_seconds(repository, check_splay):
+    '''
+    Given a local or remote repository path and a check splay duration (or None), return a number
+    of seconds between zero and the splay by which to delay checks of the repository from this host.
+
+    The delay is derived from the hostname and repository rather than chosen at random, so it stays
+    the same from one run to the next, while hosts checking the same repository server get spread
+    out over the splay.
+    '''
+    if not check_splay:
+        return 0
+
+    digest = hashlib.sha256(
+        '{}:{}'.format(socket.gethostname(), repository).encode('utf-8')
+    ).hexdigest()
+
+    return duration.parse_duration(check_splay) * int(digest[:8], 16) / 0x100000000
+
+
+def _check_times_filename(repository):
+    '''
+    Given a local or remote repository path, return the path of the file recording when each
+    consistency check last succeeded for it.
+    '''
+    return cache.repository_cache_filename('checks', repository, 'json')
+
+
+def _read_check_times(repository):
+    '''
+    Given a local or remote repository path, return a dict mapping from the name of each check to
+    the time it last succeeded for the repository, in seconds since the epoch. Checks that haven't
+    succeeded yet are omitted.
+    '''
+    check_times = cache.read_json_cache_file(_check_times_filename(repository))
+    if not isinstance(check_times, dict):
+        return {}
+
+    return {
+        check: check_time
+        for (check, check_time) in check_times.items()
+        if isinstance(check_time, (int, float))
+    }
+
 
-    If there are no consistency checks to run, skip running them.
+def _record_check_times(repository, checks, check_time):
     '''
-    checks = _parse_checks(consistency_config)
+    Given a local or remote repository path, a sequence of checks that just succeeded for it, and
+    the time they started in seconds since the epoch, record that time as their last success.
+    '''
+    check_times = _read_check_times(repository)
+    check_times.update((check, check_time) for check in checks)
+
+    cache.write_json_cache_file(_check_times_filename(repository), check_times)
+
+
+def _due_checks(repository, checks, consistency_config, now):
+    '''
+    Given a local or remote repository path, a parsed sequence of checks, a consistency config dict,
+    and the current time in seconds since the epoch, return a tuple of the checks that are due to
+    run as per their configured "check_frequency".
+
+    A check is due if it has no frequency, if it has never succeeded for the repository, or if at
+    least its frequency plus the repository's splay has passed since it last succeeded. A last
+    success that's in the future, e.g. due to a clock change, doesn't hold a check back either.
+    '''
+    frequencies = {
+        check: _parse_frequency(frequency)
+        for (check, frequency) in (consistency_config.get('check_frequency') or {}).items()
+    }
+    if not any(frequencies.get(check) for check in checks):
+        return checks
+
+    check_times = _read_check_times(repository)
+    splay = _splay_seconds(repository, consistency_config.get('check_splay'))
+
+    def is_due(check):
+        frequency = frequencies.get(check)
+        last_time = check_times.get(check)
+
+        return (
+            frequency is None
+            or last_time is None
+            or last_time > now
+            or now - last_time >= frequency + splay
+        )
+
+    return tuple(check for check in checks if is_due(check))
+
+
+def check_archives(verbosity, repository, storage_config, consistency_config, remote_path=None):
+    '''
+    Given a verbosity flag, a local or remote repository path, a storage config dict, a consistency
+    config dict, and a command to run, check the contained Borg archives for consistency.
+
+    If there are no consistency checks to run, skip running them. Also skip any checks that aren't
+    due yet as per their configured "check_frequency", and record when the checks that do run
+    succeed. See _due_checks() for details.
+
+    Without a "prefix" consistency option, only check archives with a prefix derived from the
+    "archive_name_format" storage option, if set. See placeholders.archive_prefix() for details.
+    '''
+    now = time.time()
+    all_checks = _parse_checks(consistency_config)
+    checks = _due_checks(repository, all_checks, consistency_config, now)
     check_last = consistency_config.get('check_last', None)
+    prefix = placeholders.archive_prefix(storage_config, consistency_config.get('prefix', None))
+
+    if verbosity and len(checks) < len(all_checks):
+        execute.write_output(
+            '{}: Skipping checks that are not due yet: {}\n'.format(
+                repository, ', '.join(check for check in all_checks if check not in checks)
+            ).encode('utf-8')
+        )
 
     if set(checks).intersection(set(DEFAULT_CHECKS)):
         remote_path_flags = ('--remote-path', remote_path) if remote_path else ()
@@ -74,12 +196,22 @@ def check_archives(verbosity, repository, consistency_config, remote_path=None):
         full_command = (
             'borg', 'check',
             repository,
-        ) + _make_check_flags(checks, check_last) + remote_path_flags + verbosity_flags
+        ) + _make_check_flags(checks, check_last, prefix) + remote_path_flags + verbosity_flags
 
         # The check command spews to stdout/stderr even without the verbose flag. Suppress it.
-        stdout = None if verbosity_flags else open(os.devnull, 'w')
+        output_file = None if verbosity_flags else open(os.devnull, 'w')
 
-        subprocess.check_call(full_command, stdout=stdout, stderr=subprocess.STDOUT)
+        execute.execute_command(
+            full_command,
+            output_file=output_file,
+            extra_environment=make_environment(storage_config),
+        )
+        _record_check_times(
+            repository, tuple(check for check in checks if check in DEFAULT_CHECKS), now
+        )
 
     if 'extract' in checks:
-        extract.extract_last_archive_dry_run(verbosity, repository, remote_path)
+        extract.extract_last_archive_dry_run(
+            verbosity, repository, storage_config, remote_path, prefix=prefix
+        )
+        _record_check_times(repository, ('extract',), now)
@@ -1,40 +1,50 @@
-import glob
+import hashlib
 import itertools
-import os
-import subprocess
 import tempfile
+import threading
+import time
 
+from borgmatic import duration, execute, profiling
+from borgmatic.borg import archives, estimate, exclude, expand, scan, source_manifest, stats, version
+from borgmatic.borg.environment import make_environment
 from borgmatic.verbosity import VERBOSITY_SOME, VERBOSITY_LOTS
 
 
-def initialize(storage_config):
-    passphrase = storage_config.get('encryption_passphrase')
+_exclude_files = {}
+_exclude_files_lock = threading.Lock()
 
-    if passphrase:
-        os.environ['BORG_PASSPHRASE'] = passphrase
-
-
-def _expand_directory(directory):
+def _format_dropped_sources(dropped_sources):
     '''
-    Given a directory path, expand any tilde (representing a user's home directory) and any globs
-    therein. Return a list of one or more resulting paths.
+    Given a sequence of (dropped source path, reason) pairs, return a human-readable description of
+    them.
     '''
-    expanded_directory = os.path.expanduser(directory)
-
-    return glob.glob(expanded_directory) or [expanded_directory]
+    return ''.join(
+        'Skipping source {}: {}\n'.format(source, reason) for (source, reason) in dropped_sources
+    )
 
 
 def _write_exclude_file(exclude_patterns=None):
     '''
     Given a sequence of exclude patterns, write them to a named temporary file and return it. Return
     None if no patterns are provided.
+
+    The file is cached by a hash of its contents and kept until borgmatic exits, so that creating
+    archives in several repositories with the same patterns only writes it once.
     '''
     if not exclude_patterns:
         return None
 
-    exclude_file = tempfile.NamedTemporaryFile('w')
-    exclude_file.write('\n'.join(exclude_patterns))
-    exclude_file.flush()
+    contents = '\n'.join(exclude_patterns)
+    content_hash = hashlib.sha256(contents.encode('utf-8', 'surrogateescape')).digest()
+
+    with _exclude_files_lock:
+        exclude_file = _exclude_files.get(content_hash)
+
+        if exclude_file is None:
+            exclude_file = tempfile.NamedTemporaryFile('w')
+            exclude_file.write(contents)
+            exclude_file.flush()
+            _exclude_files[content_hash] = exclude_file
 
     return exclude_file
 
@@ -61,22 +71,89 @@ def _make_exclude_flags(location_config, exclude_patterns_filename=None):
 
 
 def create_archive(
-    verbosity, repository, location_config, storage_config,
+    verbosity, repository, location_config, storage_config, progress=False,
 ):
     '''
-    Given a vebosity flag, a local or remote repository path, a location config dict, and a storage
-    config dict, create a Borg archive.
+    Given a vebosity flag, a local or remote repository path, a location config dict, a storage
+    config dict, and whether to display progress, create a Borg archive.
+
+    If the local Borg version supports --json output, return a borg.stats.Archive_stats instance
+    describing the created archive, and display its statistics for verbose runs. Otherwise, leave
+    displaying statistics to Borg and return None.
+
+    With the "skip_unchanged" location option, first scan the sources and compare them to the
+    manifest recorded for the repository's last archive. If nothing has changed and the last archive
+    isn't older than the "skip_unchanged_max_age" option, skip creating an archive and return None.
+
+    With progress, first scan the sources to estimate their total size and how long creating the
+    archive will take based on the throughput of the repository's last archive. Then display Borg's
+    progress along with an estimate of the time remaining.
     '''
-    sources = tuple(
-        itertools.chain.from_iterable(
-            _expand_directory(directory)
-            for directory in location_config['source_directories']
+    with profiling.phase('expand', repository=repository):
+        (sources, dropped_sources) = expand.deduplicate_directories(
+            expand.expand_directories(location_config['source_directories']),
+            one_file_system=bool(location_config.get('one_file_system')),
         )
-    )
 
-    exclude_patterns_file = _write_exclude_file(location_config.get('exclude_patterns'))
+    with profiling.phase('exclude', repository=repository):
+        (exclude_patterns, unreadable_exclude_filenames) = exclude.read_exclude_patterns(
+            location_config
+        )
+        (exclude_patterns, removed_exclude_patterns) = exclude.compile_exclude_patterns(
+            exclude_patterns
+        )
+        (sources, excluded_sources) = exclude.skip_excluded_directories(
+            sources, exclude_patterns, location_config
+        )
+        dropped_sources += excluded_sources
+        exclude_patterns_file = _write_exclude_file(exclude_patterns)
+
+    if verbosity and dropped_sources:
+        execute.write_output(_format_dropped_sources(dropped_sources).encode('utf-8'))
+
+    if verbosity and removed_exclude_patterns:
+        execute.write_output(
+            'Removed {} duplicate or redundant exclude patterns\n'.format(
+                len(removed_exclude_patterns)
+            ).encode('utf-8')
+        )
+
+    if location_config.get('skip_unchanged') or progress:
+        with profiling.phase('scan', repository=repository):
+            statuses = scan.scan_directories(sources, exclude_patterns, location_config)
+
+    if location_config.get('skip_unchanged'):
+        max_age = location_config.get('skip_unchanged_max_age')
+        max_age_seconds = duration.parse_duration(max_age) if max_age else None
+        manifest = (
+            source_manifest.make_key(sources, exclude_patterns, location_config, storage_config),
+            source_manifest.pack_statuses(statuses),
+            time.time(),
+        )
+
+        if source_manifest.is_unchanged(repository, manifest[0], manifest[1], max_age_seconds):
+            if verbosity:
+                execute.write_output(
+                    '{}: No source files have changed since the last archive; skipping\n'.format(
+                        repository
+                    ).encode('utf-8')
+                )
+            return None
+    else:
+        manifest = None
+
+    if progress:
+        size_estimate = estimate.estimate_size(statuses)
+        execute.write_output(
+            estimate.format_estimate(
+                repository, size_estimate, estimate.read_throughput(repository)
+            ).encode('utf-8')
+        )
+
+    # All readable exclude_from files are merged into the compiled exclude patterns file. Any others
+    # still get passed to Borg, so that it can report them.
     exclude_flags = _make_exclude_flags(
-        location_config,
+        dict(location_config, exclude_from=unreadable_exclude_filenames),
         exclude_patterns_file.name if exclude_patterns_file else None,
     )
     compression = storage_config.get('compression', None)
@@ -86,10 +163,16 @@ def create_archive(
     one_file_system_flags = ('--one-file-system',) if location_config.get('one_file_system') else ()
     remote_path = location_config.get('remote_path')
     remote_path_flags = ('--remote-path', remote_path) if remote_path else ()
+    json_output = version.supports_json()
+    stats_flags = () if json_output else ('--stats',)
     verbosity_flags = {
-        VERBOSITY_SOME: ('--info', '--stats',),
-        VERBOSITY_LOTS: ('--debug', '--list', '--stats'),
+        VERBOSITY_SOME: ('--info',) + stats_flags,
+        VERBOSITY_LOTS: ('--debug', '--list') + stats_flags,
     }.get(verbosity, ())
+    json_flags = ('--json',) if json_output else ()
+    # Borg's JSON log messages let borgmatic turn its progress into estimates of the time remaining.
+    # Older versions of Borg display their own progress instead.
+    progress_flags = ('--progress',) + (('--log-json',) if json_output else ()) if progress else ()
     default_archive_name_format = '{hostname}-{now:%Y-%m-%dT%H:%M:%S.%f}'
     archive_name_format = storage_config.get('archive_name_format', default_archive_name_format)
 
@@ -100,6 +183,30 @@ def create_archive(
             archive_name_format=archive_name_format,
         ),
     ) + sources + exclude_flags + compression_flags + one_file_system_flags + \
-        remote_path_flags + umask_flags + verbosity_flags
-
-    subprocess.check_call(full_command)
+        remote_path_flags + umask_flags + verbosity_flags + progress_flags + json_flags
+    environment = make_environment(storage_config)
+
+    if json_output:
+        archives.revalidate_archive_list(repository, storage_config, remote_path)
+        output = execute.execute_command_and_capture_output(
+            full_command,
+            extra_environment=environment,
+            handle_stderr_line=estimate.make_progress_handler(size_estimate, execute.write_output)
+            if progress
+            else None,
+        )
+        archive_stats = stats.parse_create_output(output)
+        archives.record_created_archive(repository, output)
+        estimate.write_throughput(repository, archive_stats)
+        if verbosity_flags:
+            execute.write_output(stats.format_archive_stats(archive_stats).encode('utf-8'))
+    else:
+        execute.execute_command(full_command, extra_environment=environment)
+        archive_stats = None
+
+    # Only record the manifest once the archive has been created successfully, so that a failed run
+    # doesn't cause the next one to be skipped.
+    if manifest:
+        source_manifest.write_manifest(repository, *manifest)
+
+    return archive_stats
@@ -0,0 +1,20 @@
+OPTION_TO_ENVIRONMENT_VARIABLE = {
+    'encryption_passphrase': 'BORG_PASSPHRASE',
+}
+
+
+def make_environment(storage_config):
+    '''
+    Given a storage config dict, return a dict of the environment variables to set when running
+    Borg with that configuration. For instance, an "encryption_passphrase" option becomes a
+    BORG_PASSPHRASE variable.
+
+    This environment is passed to each Borg process individually rather than set in borgmatic's own
+    process environment, so that several configuration files can run concurrently without clobbering
+    each other's settings.
+    '''
+    return {
+        variable_name: storage_config[option_name]
+        for option_name, variable_name in OPTION_TO_ENVIRONMENT_VARIABLE.items()
+        if storage_config.get(option_name)
+    }
@@ -0,0 +1,176 @@
+import collections
+import json
+import stat
+import time
+
+from borgmatic import cache
+from borgmatic.borg import stats
+
+
+# Display Borg's progress at most this often.
+PROGRESS_INTERVAL_SECONDS = 5
+
+
+Size_estimate = collections.namedtuple('Size_estimate', ('file_count', 'total_size'))
+
+
+def estimate_size(statuses):
+    '''
+    Given a sequence of scan.File_status instances for the paths that Borg would back up, return a
+    Size_estimate of the number of regular files among them and their total size in bytes.
+    '''
+    file_count = 0
+    total_size = 0
+
+    for status in statuses:
+        if stat.S_ISREG(status.mode):
+            file_count += 1
+            total_size += status.size
+
+    return Size_estimate(file_count, total_size)
+
+
+def _throughput_filename(repository):
+    '''
+    Given a local or remote repository path, return the path of the file recording the throughput
+    of its last archive.
+    '''
+    return cache.repository_cache_filename('throughput', repository, 'json')
+
+
+def read_throughput(repository):
+    '''
+    Given a local or remote repository path, return the throughput in original bytes per second of
+    the last archive that borgmatic created in it, or None if it's unknown.
+    '''
+    throughput = cache.read_json_cache_file(_throughput_filename(repository))
+
+    if isinstance(throughput, (int, float)) and not isinstance(throughput, bool) and throughput > 0:
+        return throughput
+
+    return None
+
+
+def write_throughput(repository, archive_stats):
+    '''
+    Given a local or remote repository path and a stats.Archive_stats instance for an archive just
+    created in it, record the archive's throughput for estimating how long the next one will take.
+    '''
+    if archive_stats.throughput:
+        cache.write_json_cache_file(_throughput_filename(repository), archive_stats.throughput)
+
+
+def format_duration(seconds):
+    '''
+    Given a number of seconds, return it as a human-readable string like "1h 05m" or "3m 20s".
+    '''
+    seconds = int(round(seconds))
+
+    if seconds >= 60 * 60:
+        return '{}h {:02d}m'.format(seconds // (60 * 60), seconds % (60 * 60) // 60)
+    if seconds >= 60:
+        return '{}m {:02d}s'.format(seconds // 60, seconds % 60)
+
+    return '{}s'.format(seconds)
+
+
+def format_estimate(repository, size_estimate, throughput):
+    '''
+    Given a local or remote repository path, a Size_estimate of the sources to back up to it, and
+    the throughput of its last archive in bytes per second or None, return a human-readable
+    description of the estimate and how long creating the archive will take.
+    '''
+    description = '{}: {} files, {} to back up'.format(
+        repository, size_estimate.file_count, stats.format_size(size_estimate.total_size)
+    )
+
+    if not throughput:
+        return '{}; no previous throughput to estimate the duration from\n'.format(description)
+
+    return '{}; estimated {} at {}/s\n'.format(
+        description,
+        format_duration(size_estimate.total_size / throughput),
+        stats.format_size(throughput),
+    )
+
+
+def format_progress(size_estimate, original_size, file_count, elapsed_seconds):
+    '''
+    Given a Size_estimate of the sources being backed up, the original size in bytes and the number
+    of files that Borg has processed so far, and the number of seconds since it started, return a
+    human-readable progress line with an estimate of the time remaining.
+    '''
+    if not size_estimate.total_size:
+        return '{} files, {} processed\n'.format(file_count, stats.format_size(original_size))
+
+    # Borg's original size can exceed the estimate if files grow during the backup.
+    fraction = min(original_size / size_estimate.total_size, 1)
+    remaining = (
+        ', {} remaining'.format(format_duration(elapsed_seconds * (1 - fraction) / fraction))
+        if fraction
+        else ''
+    )
+
+    return '{:.0%}: {} of {} files, {} of {}{}\n'.format(
+        fraction,
+        file_count,
+        size_estimate.file_count,
+        stats.format_size(original_size),
+        stats.format_size(size_estimate.total_size),
+        remaining,
+    )
+
+
+def make_progress_handler(size_estimate, write_output, interval=PROGRESS_INTERVAL_SECONDS):
+    '''
+    Given a Size_estimate of the sources being backed up, a function to write output bytes to, and
+    the minimum number of seconds between progress lines, return a function that handles lines of
+    stderr from "borg create --progress --log-json".
+
+    Borg's archive progress messages become progress lines with an estimate of the time remaining,
+    written at most once per interval. Borg's other messages get written as plain text, and lines
+    that aren't JSON get written as is.
+    '''
+    start_time = time.monotonic()
+    last_progress_time = [None]
+
+    def handle_line(line):
+        try:
+            message = json.loads(line.decode('utf-8'))
+        except ValueError:
+            write_output(line)
+            return
+
+        if not isinstance(message, dict):
+            write_output(line)
+            return
+
+        if message.get('type') == 'archive_progress':
+            now = time.monotonic()
+
+            if message.get('finished') or (
+                last_progress_time[0] is not None and now - last_progress_time[0] < interval
+            ):
+                return
+
+            last_progress_time[0] = now
+            write_output(
+                format_progress(
+                    size_estimate,
+                    message.get('original_size', 0),
+                    message.get('nfiles', 0),
+                    now - start_time,
+                ).encode('utf-8')
+            )
+            return
+
+        if message.get('type') == 'file_status':
+            write_output(
+                '{} {}\n'.format(message.get('status'), message.get('path')).encode('utf-8')
+            )
+            return
+
+        if message.get('message'):
+            write_output('{}\n'.format(message['message']).encode('utf-8'))
+
+    return handle_line
@@ -0,0 +1,352 @@
+import fnmatch
+import glob
+import hashlib
+import os
+import re
+import threading
+
+
+# Borg's default style for exclude patterns without a style prefix.
+DEFAULT_PATTERN_STYLE = 'fm'
+
+CACHEDIR_TAG_FILENAME = 'CACHEDIR.TAG'
+CACHEDIR_TAG_SIGNATURE = b'Signature: 8a477f597d28d172789f06886806bc55'
+
+# Order in which to write out compiled exclude patterns by style, from cheapest for Borg to test
+# against each path to costliest. Borg looks up "pf:" patterns in a dict, and "pp:" patterns are a
+# string prefix check, while the other styles are regular expressions.
+PATTERN_STYLE_ORDER = ('pf', 'pp', 'fm', 'sh', 're')
+
+_compiled_patterns = {}
+_compiled_patterns_lock = threading.Lock()
+
+
+def _split_style(pattern):
+    '''
+    Given a Borg exclude pattern, return a tuple of its style (e.g. "fm" or "pp") and the pattern
+    without any style prefix.
+    '''
+    if len(pattern) > 2 and pattern[2] == ':' and pattern[:2].isalnum():
+        return (pattern[:2], pattern[3:])
+
+    return (DEFAULT_PATTERN_STYLE, pattern)
+
+
+def _compile_fnmatch(pattern):
+    '''
+    Given a Borg "fm:" pattern without its prefix, return a function that takes a normalized path
+    and returns whether the pattern matches it or one of its parent directories, as Borg does.
+    '''
+    if pattern.endswith(os.sep):
+        pattern = os.path.normpath(pattern).rstrip(os.sep) + os.sep + '*' + os.sep
+    else:
+        pattern = os.path.normpath(pattern) + os.sep + '*'
+
+    regex = re.compile(fnmatch.translate(pattern.lstrip(os.sep)))
+
+    return lambda path: regex.match(path + os.sep) is not None
+
+
+def _compile_path_prefix(pattern):
+    '''
+    Given a Borg "pp:" pattern without its prefix, return a function that takes a normalized path
+    and returns whether it's the pattern's path or within it.
+    '''
+    prefix = os.path.normpath(pattern).rstrip(os.sep).lstrip(os.sep) + os.sep
+
+    return lambda path: (path + os.sep).startswith(prefix)
+
+
+def _compile_path_full(pattern):
+    '''
+    Given a Borg "pf:" pattern without its prefix, return a function that takes a normalized path
+    and returns whether it's exactly the pattern's path.
+    '''
+    full_path = os.path.normpath(pattern).lstrip(os.sep)
+
+    return lambda path: path == full_path
+
+
+def _compile_regex(pattern):
+    '''
+    Given a Borg "re:" pattern without its prefix, return a function that takes a normalized path
+    and returns whether the regular expression matches anywhere within it.
+    '''
+    regex = re.compile(pattern)
+
+    return lambda path: regex.search(path) is not None
+
+
+# Pattern styles that can be evaluated here exactly as Borg does, mapped to functions that compile a
+# pattern of that style into a matching function. Other styles, like Borg's "sh:" shell-style
+# patterns, are left entirely to Borg.
+PATTERN_STYLE_COMPILERS = {
+    'fm': _compile_fnmatch,
+    'pp': _compile_path_prefix,
+    'pf': _compile_path_full,
+    're': _compile_regex,
+}
+
+
+def compile_pattern(pattern):
+    '''
+    Given a Borg exclude pattern, return a function that takes a normalized path and returns whether
+    the pattern matches it. Return None if the pattern's style isn't supported here, or if the
+    pattern is invalid.
+    '''
+    (style, pattern) = _split_style(pattern)
+    compiler = PATTERN_STYLE_COMPILERS.get(style)
+
+    if compiler is None or not pattern:
+        return None
+
+    try:
+        return compiler(pattern)
+    except re.error:
+        return None
+
+
+def normalize_path(path):
+    '''
+    Given a source path, return it in the form that Borg matches exclude patterns against: normalized
+    and without a leading separator.
+    '''
+    return os.path.normpath(path).lstrip(os.sep)
+
+
+def read_exclude_patterns(location_config):
+    '''
+    Given a location config dict, read all exclude patterns from its "exclude_patterns" option and
+    from the files in its "exclude_from" option, skipping blank lines and comments in those files as
+    Borg does.
+
+    Return a tuple of the list of patterns and a tuple of any "exclude_from" filenames that couldn't
+    be read, so that they can be left for Borg to report.
+    '''
+    patterns = list(location_config.get('exclude_patterns') or ())
+    unreadable_filenames = []
+
+    for exclude_filename in location_config.get('exclude_from') or ():
+        try:
+            with open(exclude_filename) as exclude_file:
+                patterns.extend(
+                    line.strip()
+                    for line in exclude_file
+                    if line.strip() and not line.strip().startswith('#')
+                )
+        except (OSError, UnicodeDecodeError):
+            unreadable_filenames.append(exclude_filename)
+
+    return (patterns, tuple(unreadable_filenames))
+
+
+def _canonicalize_pattern(pattern):
+    '''
+    Given a Borg exclude pattern, return a tuple of its style and its body in a canonical form, so
+    that patterns Borg treats identically compare equal. An "fm:" pattern without wildcards matches
+    exactly the same paths as the cheaper "pp:" pattern for the same path, so it becomes one.
+    '''
+    (style, body) = _split_style(pattern)
+    normalized_body = os.path.normpath(body).strip(os.sep)
+
+    # Borg's matching of patterns for the root directory is unusual, so leave them be.
+    if not normalized_body or normalized_body == os.curdir:
+        return (style, body)
+
+    if style == 'fm' and not glob.has_magic(body) and not body.endswith(os.sep):
+        style = 'pp'
+
+    if style in ('pp', 'pf'):
+        return (style, os.sep + normalized_body)
+
+    if style in ('fm', 'sh'):
+        normalized_body = os.sep + os.path.normpath(body).lstrip(os.sep)
+
+        return (style, normalized_body + os.sep if body.endswith(os.sep) else normalized_body)
+
+    return (style, body)
+
+
+def _literal_directory(style, body):
+    '''
+    Given a canonical pattern style and body, return the directory path that all paths matching the
+    pattern must be within or equal to, or None if there isn't one. For instance, "/home/*/.cache"
+    only matches paths within "/home".
+    '''
+    if style in ('pp', 'pf'):
+        return body
+
+    if style not in ('fm', 'sh'):
+        return None
+
+    magic_match = re.search(r'[*?[]', body)
+    literal_prefix = body if magic_match is None else body[: magic_match.start()]
+    directory = literal_prefix[: literal_prefix.rfind(os.sep)].rstrip(os.sep)
+
+    return directory or None
+
+
+def _is_within_prefix(directory, prefixes, include_self):
+    '''
+    Given a directory path, a set of "pp:" pattern paths, and whether the directory itself counts,
+    return whether the directory is within one of the prefixes.
+    '''
+    if include_self and directory in prefixes:
+        return True
+
+    parent = os.path.dirname(directory)
+
+    while parent != directory:
+        if parent in prefixes:
+            return True
+
+        (directory, parent) = (parent, os.path.dirname(parent))
+
+    return False
+
+
+def _compile_exclude_patterns(patterns):
+    '''
+    Given a sequence of Borg exclude patterns, return a tuple of the compiled patterns and a tuple of
+    the patterns that were removed. See compile_exclude_patterns() for details.
+    '''
+    canonical_patterns = []
+    seen = set()
+    removed = []
+
+    for pattern in patterns:
+        canonical_pattern = _canonicalize_pattern(pattern)
+
+        if canonical_pattern in seen:
+            removed.append(pattern)
+            continue
+
+        seen.add(canonical_pattern)
+        canonical_patterns.append((pattern, canonical_pattern))
+
+    prefixes = {body for (style, body) in seen if style == 'pp'}
+    compiled = []
+
+    for (pattern, (style, body)) in canonical_patterns:
+        directory = _literal_directory(style, body)
+
+        # A "pp:" pattern doesn't make itself redundant, but it does make anything else for the same
+        # path redundant.
+        if directory is not None and _is_within_prefix(
+            directory, prefixes, include_self=style != 'pp'
+        ):
+            removed.append(pattern)
+            continue
+
+        compiled.append((style, body))
+
+    compiled.sort(
+        key=lambda canonical_pattern: PATTERN_STYLE_ORDER.index(canonical_pattern[0])
+        if canonical_pattern[0] in PATTERN_STYLE_ORDER
+        else len(PATTERN_STYLE_ORDER)
+    )
+
+    return (
+        tuple('{}:{}'.format(style, body) for (style, body) in compiled),
+        tuple(removed),
+    )
+
+
+def compile_exclude_patterns(patterns):
+    '''
+    Given a sequence of Borg exclude patterns, merged from all exclude sources, compile them into
+    an equivalent but cheaper sequence of patterns for Borg to test each path against: Drop
+    duplicates, including patterns that only differ in ways Borg ignores, and drop patterns that
+    can only match paths within a path prefix pattern's path. Turn wildcard-free "fm:" patterns into
+    "pp:" patterns, and order the patterns from cheapest to costliest to match. As these are all
+    exclude patterns, their order doesn't affect which paths are excluded.
+
+    Return a tuple of the compiled patterns, each with an explicit style prefix, and a tuple of the
+    patterns that were removed. The result is cached by a hash of the given patterns, so compiling
+    the same patterns for several repositories only happens once per borgmatic run.
+    '''
+    content_hash = hashlib.sha256('\n'.join(patterns).encode('utf-8', 'surrogateescape')).digest()
+
+    with _compiled_patterns_lock:
+        compiled = _compiled_patterns.get(content_hash)
+
+        if compiled is None:
+            compiled = _compiled_patterns[content_hash] = _compile_exclude_patterns(patterns)
+
+    return compiled
+
+
+def is_cache_directory(directory):
+    '''
+    Given a directory path, return whether it contains a valid CACHEDIR.TAG file.
+    '''
+    try:
+        with open(os.path.join(directory, CACHEDIR_TAG_FILENAME), 'rb') as tag_file:
+            return tag_file.read(len(CACHEDIR_TAG_SIGNATURE)) == CACHEDIR_TAG_SIGNATURE
+    except OSError:
+        return False
+
+
+def _exclusion_reason(directory, matchers, location_config):
+    '''
+    Given a source path, a sequence of (exclude pattern, matching function) pairs, and a location
+    config dict, return a description of why Borg would exclude the entire path, or None if it
+    wouldn't.
+    '''
+    normalized_path = normalize_path(directory)
+
+    for (pattern, matches) in matchers:
+        if matches(normalized_path):
+            return 'Excluded by pattern {}'.format(pattern)
+
+    # Borg stores a symlink itself rather than checking the directory it points to for tags.
+    if os.path.islink(directory) or not os.path.isdir(directory):
+        return None
+
+    if_present = location_config.get('exclude_if_present')
+    if if_present and os.path.lexists(os.path.join(directory, if_present)):
+        return 'Contains {}'.format(if_present)
+
+    if location_config.get('exclude_caches') and is_cache_directory(directory):
+        return 'Contains {}'.format(CACHEDIR_TAG_FILENAME)
+
+    return None
+
+
+def skip_excluded_directories(directories, exclude_patterns, location_config):
+    '''
+    Given a sequence of source paths, a sequence of Borg exclude patterns, and a location config
+    dict, drop each path that Borg would exclude in its entirety: Paths matched by one of the
+    exclude patterns, and directories containing the "exclude_if_present" file or, with
+    "exclude_caches", a CACHEDIR.TAG file. That way, Borg never has to open them.
+
+    Return a tuple of the remaining paths in their original order, and a tuple of (dropped path,
+    reason) pairs for the dropped paths. If every path would be dropped, keep them all and leave the
+    exclusion to Borg, so that its behavior doesn't change.
+    '''
+    matchers = tuple(
+        (pattern, matches)
+        for pattern in exclude_patterns
+        for matches in (compile_pattern(pattern),)
+        if matches is not None
+    )
+    if not matchers and not location_config.get('exclude_if_present') and not location_config.get(
+        'exclude_caches'
+    ):
+        return (tuple(directories), ())
+
+    remaining = []
+    dropped = []
+
+    for directory in directories:
+        reason = _exclusion_reason(directory, matchers, location_config)
+
+        if reason is None:
+            remaining.append(directory)
+        else:
+            dropped.append((directory, reason))
+
+    if not remaining:
+        return (tuple(directories), ())
+
+    return (tuple(remaining), tuple(dropped))
@@ -0,0 +1,253 @@
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import glob
+import os
+import threading
+
+from borgmatic import cache
+
+
+# Expand at most this many source directory patterns at once. Expansion mostly waits on the
+# filesystem, so this can exceed the number of CPUs.
+MAX_EXPAND_JOBS = 8
+
+_expansions = {}
+_expansions_lock = threading.Lock()
+
+
+def _is_hidden(name):
+    return name.startswith('.')
+
+
+def _scandir(directory):
+    '''
+    Given a directory path, return a list of its os.DirEntry instances. Return an empty list if the
+    directory can't be listed, for instance if it doesn't exist.
+    '''
+    try:
+        return list(os.scandir(directory or os.curdir))
+    except OSError:
+        return []
+
+
+def _walk(directory):
+    '''
+    Given a directory path, yield a (path, is directory) tuple for each file and directory below it
+    recursively, skipping hidden ones. Don't follow symlinks to directories, and don't count them as
+    directories, so that symlink loops can't cause infinite recursion.
+    '''
+    for entry in _scandir(directory):
+        if _is_hidden(entry.name):
+            continue
+
+        path = os.path.join(directory, entry.name)
+        is_directory = entry.is_dir(follow_symlinks=False)
+        yield (path, is_directory)
+
+        if is_directory:
+            for descendant in _walk(path):
+                yield descendant
+
+
+def _expand_component(paths, component, last):
+    '''
+    Given a list of existing paths matched so far, the next component of a glob pattern, and whether
+    it's the last component of the pattern, return the list of paths matching the pattern up to and
+    including the component.
+    '''
+    if component == '**':
+        return [
+            matched
+            for path in paths
+            for matched in (
+                (os.path.join(path, ''),) if last else (path,)
+            ) + tuple(
+                descendant
+                for (descendant, is_directory) in _walk(path)
+                if last or is_directory
+            )
+        ]
+
+    if not glob.has_magic(component):
+        return [
+            os.path.join(path, component)
+            for path in paths
+            if os.path.lexists(os.path.join(path, component))
+        ]
+
+    return [
+        os.path.join(path, entry.name)
+        for path in paths
+        for entry in _scandir(path)
+        if (not _is_hidden(entry.name) or _is_hidden(component))
+        and fnmatch.fnmatch(entry.name, component)
+        and (last or entry.is_dir())
+    ]
+
+
+def _expand_pattern(pattern):
+    '''
+    Given a path pattern that may contain globs, including "**" to match any number of
+    directories, return a sorted list of the existing paths that it matches. List each directory
+    with a single os.scandir() call whose cached file types make separate stat() calls unnecessary.
+
+    Match the same paths as glob.glob(pattern, recursive=True), except that "**" never matches
+    anything within a symlinked directory, so that symlink loops can't cause infinite recursion.
+    The symlink itself still matches, but components after "**" aren't matched within it.
+    '''
+    directories_only = pattern.endswith(os.sep)
+    components = pattern.rstrip(os.sep).split(os.sep)
+
+    if pattern.startswith(os.sep):
+        paths = [os.sep]
+        components = components[1:]
+    else:
+        paths = ['']
+
+    components = [component for component in components if component]
+
+    for index, component in enumerate(components):
+        paths = _expand_component(paths, component, last=index == len(components) - 1)
+
+    if directories_only:
+        paths = [os.path.join(path, '') for path in paths if os.path.isdir(path)]
+
+    return sorted(set(paths))
+
+
+def expand_directory(directory):
+    '''
+    Given a directory path, expand any tilde (representing a user's home directory) and any globs
+    therein. Return a list of one or more resulting paths.
+    '''
+    expanded_directory = os.path.expanduser(directory)
+
+    if not glob.has_magic(expanded_directory):
+        return [expanded_directory]
+
+    return _expand_pattern(expanded_directory) or [expanded_directory]
+
+
+def _expand_directories(directories):
+    '''
+    Given a tuple of directory paths, expand each of them as per expand_directory(), running
+    independent expansions concurrently. Return a tuple of all resulting paths, in the order of the
+    given directories.
+    '''
+    patterns = [directory for directory in directories if glob.has_magic(directory)]
+
+    if len(patterns) <= 1:
+        return tuple(path for directory in directories for path in expand_directory(directory))
+
+    with ThreadPoolExecutor(max_workers=min(len(patterns), MAX_EXPAND_JOBS)) as executor:
+        expansions = list(executor.map(expand_directory, directories))
+
+    return tuple(path for expansion in expansions for path in expansion)
+
+
+def expand_directories(directories):
+    '''
+    Given a sequence of directory paths, expand any tildes and globs therein as per
+    expand_directory(), running independent expansions concurrently. Return a tuple of all
+    resulting paths, in the order of the given directories.
+
+    Expansion of a particular sequence of directories only happens once per borgmatic run, so for
+    instance creating archives in several repositories from the same configuration only has to walk
+    the filesystem once.
+    '''
+    key = tuple(directories)
+
+    return cache.compute_once(_expansions, _expansions_lock, key, lambda: _expand_directories(key))
+
+
+def _device(path):
+    '''
+    Given a path, return the ID of the device containing it, or None if it can't be determined.
+    '''
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+def _canonical_path(path):
+    '''
+    Given a path, return it as an absolute path with any symlinks in its parent directories
+    resolved. A symlink at the path itself is left alone, because Borg backs up such a source as the
+    symlink rather than as whatever it points to.
+    '''
+    path = os.path.abspath(path)
+
+    return os.path.join(os.path.realpath(os.path.dirname(path)), os.path.basename(path))
+
+
+def _covering_directory(real_path, real_directories, one_file_system):
+    '''
+    Given a canonical path, a dict mapping from canonical paths of directories to back up to their
+    original paths, and whether Borg stays on one file system, return the canonical path of the
+    directory that already backs up the given path, or None if there isn't one.
+    '''
+    if real_path in real_directories:
+        return real_path
+
+    parent = os.path.dirname(real_path)
+
+    while True:
+        if parent in real_directories:
+            # Borg doesn't descend into other file systems beneath a directory when staying on one
+            # file system, so a nested source on another file system isn't covered by its parent.
+            if one_file_system and _device(real_path) != _device(parent):
+                return None
+
+            return parent
+
+        grandparent = os.path.dirname(parent)
+        if grandparent == parent:
+            return None
+
+        parent = grandparent
+
+
+def deduplicate_directories(directories, one_file_system=False):
+    '''
+    Given a sequence of expanded directory paths and whether Borg stays on one file system, drop each
+    path that resolves to the same real path as another path, or that is nested within another
+    path and would therefore be backed up twice. Compare canonical paths as per _canonical_path(),
+    but keep each remaining path as given, so that paths within archives don't change.
+
+    A source that is itself a symlink only gets backed up as the symlink, so it never covers the
+    directory it points to or anything within it.
+
+    Return a tuple of the remaining paths in their original order, and a tuple of (dropped path,
+    reason) pairs for the dropped paths.
+    '''
+    real_paths = [_canonical_path(directory) for directory in directories]
+    real_directories = {}
+    dropped = {}
+
+    # Consider shallower paths first, so that a directory is kept before anything nested within it.
+    for index in sorted(
+        range(len(real_paths)), key=lambda index: (real_paths[index].rstrip(os.sep).count(os.sep), index)
+    ):
+        covering = _covering_directory(real_paths[index], real_directories, one_file_system)
+
+        if covering is None:
+            real_directories[real_paths[index]] = directories[index]
+        else:
+            dropped[index] = real_directories[covering]
+
+    return (
+        tuple(directory for index, directory in enumerate(directories) if index not in dropped),
+        tuple(
+            (directories[index], 'Already backed up as part of {}'.format(dropped[index]))
+            for index in sorted(dropped)
+        ),
+    )
+
+
+def clear_cache():
+    '''
+    Forget all cached expansions, so that subsequent expansions walk the filesystem again.
+    '''
+    with _expansions_lock:
+        _expansions.clear()
@@ -1,32 +1,29 @@
-import sys
-import subprocess
-
+from borgmatic import execute
+from borgmatic.borg import archives
+from borgmatic.borg.environment import make_environment
 from borgmatic.verbosity import VERBOSITY_SOME, VERBOSITY_LOTS
 
 
-def extract_last_archive_dry_run(verbosity, repository, remote_path=None):
+def extract_last_archive_dry_run(
+    verbosity, repository, storage_config, remote_path=None, prefix=None
+):
     '''
-    Perform an extraction dry-run of just the most recent archive. If there are no archives, skip
-    the dry-run.
+    Perform an extraction dry-run of just the most recent archive, or of the most recent archive
+    whose name starts with the given prefix. If there are no such archives, skip the dry-run.
     '''
+    environment = make_environment(storage_config)
     remote_path_flags = ('--remote-path', remote_path) if remote_path else ()
     verbosity_flags = {
         VERBOSITY_SOME: ('--info',),
         VERBOSITY_LOTS: ('--debug',),
     }.get(verbosity, ())
 
-    full_list_command = (
-        'borg', 'list',
-        '--short',
-        repository,
-    ) + remote_path_flags + verbosity_flags
-
-    list_output = subprocess.check_output(full_list_command).decode(sys.stdout.encoding)
-
-    last_archive_name = list_output.strip().split('\n')[-1]
-    if not last_archive_name:
+    last_archive = archives.newest_archive(repository, storage_config, remote_path, prefix)
+    if last_archive is None:
         return
 
+    last_archive_name = last_archive.name
+
     list_flag = ('--list',) if verbosity == VERBOSITY_LOTS else ()
     full_extract_command = (
         'borg', 'extract',
@@ -37,4 +34,4 @@ def extract_last_archive_dry_run(verbosity, repository, remote_path=None):
         ),
     ) + remote_path_flags + verbosity_flags + list_flag
 
-    subprocess.check_call(full_extract_command)
+    execute.execute_command(full_extract_command, extra_environment=environment)
@@ -0,0 +1,117 @@
+import os
+import pwd
+import re
+import socket
+import string
+
+
+# Borg placeholders whose values stay the same from one borgmatic run to the next, mapped to
+# functions returning their values as Borg expands them.
+STABLE_PLACEHOLDERS = {
+    'hostname': lambda: socket.gethostname(),
+    'fqdn': lambda: socket.getfqdn(),
+    'user': lambda: pwd.getpwuid(os.getuid()).pw_name,
+}
+
+
+def _parse(text):
+    '''
+    Given text with Borg placeholders, return a list of (literal text, placeholder name, format spec,
+    conversion) tuples as per string.Formatter.parse(), or None if the text is malformed.
+    '''
+    try:
+        return list(string.Formatter().parse(text))
+    except ValueError:
+        return None
+
+
+def _expand_stable_prefix(parsed):
+    '''
+    Given parsed text as per _parse(), return a tuple of the text up to its first placeholder that
+    isn't stable, with stable placeholders expanded, whether that's the whole text, and the length
+    of the returned text up to the end of its last expanded placeholder.
+    '''
+    expanded = []
+    placeholders_end = 0
+
+    for (literal_text, name, format_spec, conversion) in parsed:
+        expanded.append(literal_text)
+
+        if name is None:
+            continue
+
+        if name not in STABLE_PLACEHOLDERS or format_spec or conversion:
+            return (''.join(expanded), False, placeholders_end)
+
+        expanded.append(STABLE_PLACEHOLDERS[name]())
+        placeholders_end = len(''.join(expanded))
+
+    return (''.join(expanded), True, placeholders_end)
+
+
+def expand_placeholders(text):
+    '''
+    Given text with Borg placeholders, like a retention prefix of "{hostname}-", return it with its
+    placeholders expanded as Borg would. Return None if it has placeholders that change from one run
+    to the next, like "{now}", or if it's malformed.
+    '''
+    parsed = _parse(text)
+    if parsed is None:
+        return None
+
+    (expanded, complete, placeholders_end) = _expand_stable_prefix(parsed)
+
+    return expanded if complete else None
+
+
+def derive_prefix(archive_name_format):
+    '''
+    Given an archive name format with Borg placeholders, return a literal prefix that the names of
+    all archives created with it start with, and that's unlikely to match the names of archives
+    created with other formats. For instance, "{hostname}-{now}" becomes "myhost-". Return None if
+    there's no such prefix.
+
+    The prefix only extends through stable placeholders like "{hostname}", and when the format
+    continues after it, it's cut back to the last non-alphanumeric separator in the literal text
+    following them. If there's no such separator, there's no safe prefix: "{hostname}{now}" on host
+    "web-1" must not result in a prefix of "web-1" or "web-" that would also match the archives of
+    "web-10" or "web-2".
+    '''
+    parsed = _parse(archive_name_format)
+    if parsed is None:
+        return None
+
+    (prefix, complete, placeholders_end) = _expand_stable_prefix(parsed)
+
+    if not complete:
+        separator_match = re.search(r'[^a-zA-Z0-9][a-zA-Z0-9]*$', prefix[placeholders_end:])
+        if not separator_match:
+            return None
+
+        prefix = prefix[: placeholders_end + separator_match.start() + 1]
+
+    # Borg expands placeholders in prefixes too, so a literal brace can't be passed on as is.
+    if '{' in prefix or '}' in prefix:
+        return None
+
+    return prefix or None
+
+
+def archive_prefix(storage_config, configured_prefix=None):
+    '''
+    Given a storage config dict and an explicitly configured archive name prefix (or None), return
+    the prefix to restrict archive operations like pruning and checking to, or None to consider all
+    archives.
+
+    A configured prefix takes precedence, and an empty one means all archives. Otherwise, if an
+    archive name format is configured, derive the prefix from it, so that hosts sharing a repository
+    each only consider their own archives.
+    '''
+    if configured_prefix is not None:
+        return configured_prefix or None
+
+    archive_name_format = storage_config.get('archive_name_format')
+    if not archive_name_format:
+        return None
+
+    return derive_prefix(archive_name_format)
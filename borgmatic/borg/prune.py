@@ -1,5 +1,6 @@
-import subprocess
-
+from borgmatic import execute
+from borgmatic.borg import archives, placeholders, retention, version
+from borgmatic.borg.environment import make_environment
 from borgmatic.verbosity import VERBOSITY_SOME, VERBOSITY_LOTS
 
 
@@ -25,17 +26,97 @@ def _make_prune_flags(retention_config):
     )
 
 
-def prune_archives(verbosity, repository, retention_config, remote_path=None):
+def _make_list_handler(display_list, kept_archives, pruned_archives):
     '''
-    Given a verbosity flag, a local or remote repository path, a retention config dict, prune Borg
-    archives according the the retention policy specified in that configuration.
+    Given whether to display Borg's list of archives and lists to collect kept and pruned archives
+    into, return a function that handles lines of stderr from "borg prune --list": Each archive line
+    gets parsed into an archives.Archive instance and appended to the appropriate list, and only
+    gets displayed if requested. Any other lines get displayed as is.
     '''
+    def handle_line(line):
+        parsed = archives.parse_prune_line(line.decode('utf-8', 'replace'))
+
+        if parsed is None:
+            execute.write_output(line)
+            return
+
+        (kept, archive) = parsed
+        (kept_archives if kept else pruned_archives).append(archive)
+
+        if display_list:
+            execute.write_output(line)
+
+    return handle_line
+
+
+def prune_archives(
+    verbosity, repository, storage_config, retention_config, remote_path=None, dry_run=False
+):
+    '''
+    Given a verbosity flag, a local or remote repository path, a storage config dict, and a
+    retention config dict, prune Borg archives according the the retention policy specified in that
+    configuration. With dry run, only display which archives would be kept and pruned.
+
+    With a version of Borg that supports --json output, first simulate the prune against the
+    repository's archive list. If no archives would be pruned, skip running Borg, which would
+    otherwise lock the repository for nothing. For a dry run, display the simulated outcome instead
+    of running Borg at all. If the prune can't be simulated, leave it to Borg.
+
+    After a simulated prune, the archives that the simulation pruned get removed from the
+    repository's archive list cache, so that the next run doesn't have to list the repository again.
+    Otherwise, when output is being buffered, Borg's stderr gets piped anyway, so Borg lists the
+    archives that it keeps and prunes, and the archive list cache gets updated from that. Failing
+    both, Borg's stderr goes straight to the terminal, so that any prompts it asks show up, and the
+    archive list cache gets forgotten instead.
+
+    Without a "prefix" retention option, only prune archives with a prefix derived from the
+    "archive_name_format" storage option, if set. See placeholders.archive_prefix() for details.
+    '''
+    prefix = placeholders.archive_prefix(storage_config, retention_config.get('prefix'))
+    retention_config = {
+        option: value for (option, value) in retention_config.items() if option != 'prefix'
+    }
+    if prefix:
+        retention_config['prefix'] = prefix
+
+    # The simulation needs the prefix as Borg expands it.
+    simulated_prefix = placeholders.expand_placeholders(prefix) if prefix else None
+
+    simulation = (
+        retention.simulate_prune(
+            archives.list_archives(repository, storage_config, remote_path),
+            dict(retention_config, prefix=simulated_prefix) if prefix else retention_config,
+        )
+        if version.supports_json() and (simulated_prefix or not prefix)
+        else None
+    )
+
+    if simulation is not None:
+        (kept_archives, pruned_archives) = simulation
+
+        if dry_run:
+            execute.write_output(
+                retention.format_simulation(kept_archives, pruned_archives).encode('utf-8')
+            )
+            return
+
+        if not pruned_archives:
+            if verbosity:
+                execute.write_output(
+                    '{}: No archives to prune; skipping\n'.format(repository).encode('utf-8')
+                )
+            return
+
     remote_path_flags = ('--remote-path', remote_path) if remote_path else ()
     verbosity_flags = {
         VERBOSITY_SOME: ('--info', '--stats',),
-        VERBOSITY_LOTS: ('--debug', '--stats', '--list'),
+        VERBOSITY_LOTS: ('--debug', '--stats'),
     }.get(verbosity, ())
 
+    display_list = dry_run or verbosity == VERBOSITY_LOTS
+    parse_list = execute.output_is_buffered()
+    list_flags = ('--list',) if display_list or parse_list else ()
+
     full_command = (
         'borg', 'prune',
         repository,
@@ -43,6 +124,30 @@ def prune_archives(verbosity, repository, retention_config, remote_path=None):
         element
         for pair in _make_prune_flags(retention_config)
         for element in pair
-    ) + remote_path_flags + verbosity_flags
+    ) + remote_path_flags + verbosity_flags + list_flags + (('--dry-run',) if dry_run else ())
+
+    if not parse_list:
+        execute.execute_command(full_command, extra_environment=make_environment(storage_config))
+    else:
+        listed_kept_archives = []
+        listed_pruned_archives = []
+
+        execute.execute_command_and_capture_output(
+            full_command,
+            extra_environment=make_environment(storage_config),
+            handle_stderr_line=_make_list_handler(
+                display_list, listed_kept_archives, listed_pruned_archives
+            ),
+        )
+
+    if dry_run:
+        return
 
-    subprocess.check_call(full_command)
+    if simulation is not None:
+        archives.record_simulated_prune(repository, storage_config, remote_path, pruned_archives)
+    elif parse_list:
+        archives.record_pruned_archives(
+            repository, listed_kept_archives, listed_pruned_archives, prefix
+        )
+    else:
+        archives.forget_archive_list(repository)
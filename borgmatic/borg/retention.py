@@ -0,0 +1,174 @@
+'''
+A local simulation of "borg prune", so that borgmatic can tell ahead of time which archives a
+retention policy would prune, and skip running Borg when the answer is none. This follows Borg
+1.1's pruning rules:
+
+ * Only archives whose names start with the prefix, if any, are considered.
+ * Checkpoint archives are pruned, except for the most recent archive if it's a checkpoint.
+ * "keep_within" keeps all archives created within the given interval.
+ * Then the hourly, daily, weekly, monthly, and yearly rules each keep the most recent archive in
+   each of that many of the most recent periods containing archives, skipping archives that
+   earlier rules already keep.
+'''
+import datetime
+import re
+
+
+# Archive times are in ISO 8601 format in the local timezone, as recorded by borg.archives.
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Matches the names of checkpoint archives that Borg leaves behind after an interrupted create.
+CHECKPOINT_PATTERN = re.compile(r'\.checkpoint(\.\d+)?$')
+
+# Hours per "keep_within" interval unit, as per Borg.
+WITHIN_UNIT_HOURS = {'H': 1, 'd': 24, 'w': 24 * 7, 'm': 24 * 31, 'y': 24 * 365}
+
+# Retention rules that keep one archive per period, in the order that Borg applies them, each mapped
+# to a function that returns the period containing a given archive time.
+PERIOD_RULES = (
+    ('keep_hourly', lambda time: (time.date(), time.hour)),
+    ('keep_daily', lambda time: time.date()),
+    ('keep_weekly', lambda time: time.isocalendar()[:2]),
+    ('keep_monthly', lambda time: (time.year, time.month)),
+    ('keep_yearly', lambda time: time.year),
+)
+
+# Retention options that the simulation understands.
+SIMULATED_OPTIONS = {'prefix', 'keep_within'} | {option for (option, period) in PERIOD_RULES}
+
+
+def _parse_within(keep_within):
+    '''
+    Given a "keep_within" interval like "3H" or "2d", return it as a datetime.timedelta. Return None
+    if it's invalid.
+    '''
+    interval = str(keep_within)
+
+    try:
+        hours = int(interval[:-1]) * WITHIN_UNIT_HOURS[interval[-1:]]
+    except (KeyError, ValueError):
+        return None
+
+    if hours <= 0:
+        return None
+
+    return datetime.timedelta(hours=hours)
+
+
+def _keep_within(archives, interval, now):
+    '''
+    Given a sequence of (Archive, datetime) pairs, a datetime.timedelta, and the current time,
+    return a list of the pairs for archives created within that interval of now.
+    '''
+    return [(archive, time) for (archive, time) in archives if time > now - interval]
+
+
+def _keep_periods(archives, period, count, kept):
+    '''
+    Given a sequence of (Archive, datetime) pairs sorted from newest to oldest, a function returning
+    the period containing a given time, the number of periods to keep an archive for (-1 for all of
+    them), and a set of the pairs already kept by earlier rules, return a list of the pairs for the
+    most recent archive in each of the most recent periods. An archive already kept still counts as
+    its period's most recent, but doesn't count towards the number of periods.
+    '''
+    keep = []
+    last_period = None
+
+    if count == 0:
+        return keep
+
+    for (archive, time) in archives:
+        archive_period = period(time)
+        if archive_period == last_period:
+            continue
+
+        last_period = archive_period
+
+        if (archive, time) not in kept:
+            keep.append((archive, time))
+            if len(keep) == count:
+                break
+
+    return keep
+
+
+def simulate_prune(archives, retention_config, now=None):
+    '''
+    Given a sequence of borg.archives.Archive instances for all of the archives in a repository, a
+    retention config dict, and the current time as a datetime (defaulting to now), return a tuple of
+    the archives that "borg prune" would keep and a tuple of those that it would prune, each sorted
+    from newest to oldest. Archives not matching the retention prefix are in neither.
+
+    Return None if the outcome can't be determined here, and should be left to Borg: If the
+    retention config has no rules or has options that aren't simulated, if the prefix has Borg
+    placeholders, if "keep_within" is invalid, or if any archive's creation time is unknown.
+    '''
+    if set(retention_config) - SIMULATED_OPTIONS:
+        return None
+
+    if not set(retention_config) - {'prefix'}:
+        return None
+
+    prefix = retention_config.get('prefix') or ''
+    if '{' in prefix:
+        return None
+
+    within = retention_config.get('keep_within')
+    interval = _parse_within(within) if within else None
+    if within and interval is None:
+        return None
+
+    try:
+        matching = sorted(
+            (
+                (archive, datetime.datetime.strptime(archive.time, TIME_FORMAT))
+                for archive in archives
+                if archive.name.startswith(prefix)
+            ),
+            key=lambda pair: (pair[1], pair[0].name),
+            reverse=True,
+        )
+    except (TypeError, ValueError):
+        return None
+
+    checkpoints = [pair for pair in matching if CHECKPOINT_PATTERN.search(pair[0].name)]
+    kept_checkpoints = checkpoints[:1] if checkpoints and matching[0] is checkpoints[0] else []
+    candidates = [pair for pair in matching if not CHECKPOINT_PATTERN.search(pair[0].name)]
+
+    kept = _keep_within(candidates, interval, now or datetime.datetime.now()) if interval else []
+
+    for (option, period) in PERIOD_RULES:
+        count = retention_config.get(option)
+        if count:
+            kept += _keep_periods(candidates, period, count, set(kept))
+
+    kept = set(kept + kept_checkpoints)
+
+    return (
+        tuple(archive for (archive, time) in matching if (archive, time) in kept),
+        tuple(archive for (archive, time) in matching if (archive, time) not in kept),
+    )
+
+
+def format_simulation(kept_archives, pruned_archives):
+    '''
+    Given sequences of the archives that a prune would keep and prune, as returned by
+    simulate_prune(), return a human-readable listing of them from newest to oldest, in the same
+    format as "borg prune --dry-run --list".
+    '''
+    pruned = set(pruned_archives)
+    archives = sorted(
+        tuple(kept_archives) + tuple(pruned_archives),
+        key=lambda archive: (archive.time, archive.name),
+        reverse=True,
+    )
+
+    return ''.join(
+        '{}{:<36} {}{}\n'.format(
+            'Would prune:     ' if archive in pruned else 'Keeping archive: ',
+            archive.name,
+            datetime.datetime.strptime(archive.time, TIME_FORMAT).strftime('%a, %Y-%m-%d %H:%M:%S'),
+            ' [{}]'.format(archive.id) if archive.id else '',
+        )
+        for archive in archives
+    )
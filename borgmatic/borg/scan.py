@@ -0,0 +1,187 @@
+import collections
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+import stat
+import threading
+
+from borgmatic import cache
+from borgmatic.borg import exclude
+
+
+# Scan at most this many directories at once. Scanning mostly waits on the filesystem, so this can
+# exceed the number of CPUs.
+MAX_SCAN_JOBS = 8
+
+# Location options that affect which paths a scan covers.
+SCAN_OPTIONS = ('exclude_if_present', 'exclude_caches', 'one_file_system')
+
+_scans = {}
+_scans_lock = threading.Lock()
+
+
+File_status = collections.namedtuple(
+    'File_status', ('path', 'inode', 'size', 'mtime_ns', 'ctime_ns', 'mode')
+)
+
+
+def _make_status(path, status):
+    return File_status(
+        path, status.st_ino, status.st_size, status.st_mtime_ns, status.st_ctime_ns, status.st_mode
+    )
+
+
+def _excludes_path(matchers, path):
+    '''
+    Given a sequence of exclude pattern matching functions as per exclude.compile_pattern() and a
+    path, return whether Borg would exclude the path.
+    '''
+    normalized_path = exclude.normalize_path(path)
+
+    return any(matches(normalized_path) for matches in matchers)
+
+
+def _is_tagged(directory, names, location_config):
+    '''
+    Given a directory path, the names of the entries within it, and a location config dict, return
+    whether Borg would exclude the directory because of a tag file it contains.
+    '''
+    if_present = location_config.get('exclude_if_present')
+    if if_present and if_present in names:
+        return True
+
+    return bool(
+        location_config.get('exclude_caches')
+        and exclude.CACHEDIR_TAG_FILENAME in names
+        and exclude.is_cache_directory(directory)
+    )
+
+
+def _scan_directory(directory, device, matchers, location_config):
+    '''
+    Given a directory path, the device of the source directory it's within, a sequence of exclude
+    pattern matching functions, and a location config dict, scan the directory's entries without
+    following symlinks. Return a tuple of a list of File_status
+    instances for the entries that aren't excluded, and a list of the paths of the sub-directories
+    among them to scan in turn. If the directory can't be read, treat it as empty, as Borg does
+    after warning about it.
+    '''
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return ([], [])
+
+    if _is_tagged(directory, {entry.name for entry in entries}, location_config):
+        return (None, [])
+
+    statuses = []
+    subdirectories = []
+
+    for entry in entries:
+        if _excludes_path(matchers, entry.path):
+            continue
+
+        try:
+            status = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+
+        if location_config.get('one_file_system') and status.st_dev != device:
+            continue
+
+        statuses.append(_make_status(entry.path, status))
+
+        if entry.is_dir(follow_symlinks=False):
+            subdirectories.append(entry.path)
+
+    return (statuses, subdirectories)
+
+
+def _scan_directories(directories, exclude_patterns, location_config, jobs=MAX_SCAN_JOBS):
+    '''
+    Given a sequence of source paths, a sequence of Borg exclude patterns, a location config dict,
+    and the number of directories to scan concurrently, walk the sources in parallel and return a
+    list of File_status instances for every path that Borg would back up, sorted by path. Honor the
+    exclude patterns and the "exclude_if_present", "exclude_caches", and "one_file_system" options
+    as Borg does. Don't follow symlinks, and skip any paths that can't be read.
+    '''
+    matchers = tuple(
+        matches
+        for matches in (exclude.compile_pattern(pattern) for pattern in exclude_patterns)
+        if matches is not None
+    )
+    statuses = []
+    tagged_directories = set()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {}
+
+        for directory in directories:
+            if _excludes_path(matchers, directory):
+                continue
+
+            try:
+                status = os.lstat(directory)
+            except OSError:
+                continue
+
+            statuses.append(_make_status(directory, status))
+
+            if stat.S_ISDIR(status.st_mode):
+                future = executor.submit(
+                    _scan_directory, directory, status.st_dev, matchers, location_config
+                )
+                pending[future] = (directory, status.st_dev)
+
+        while pending:
+            (done, not_done) = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                (directory, device) = pending.pop(future)
+                (directory_statuses, subdirectories) = future.result()
+
+                # Borg skips a directory containing a tag file entirely, including the directory
+                # itself.
+                if directory_statuses is None:
+                    tagged_directories.add(directory)
+                    continue
+
+                statuses.extend(directory_statuses)
+
+                for subdirectory in subdirectories:
+                    future = executor.submit(
+                        _scan_directory, subdirectory, device, matchers, location_config
+                    )
+                    pending[future] = (subdirectory, device)
+
+    return sorted(status for status in statuses if status.path not in tagged_directories)
+
+
+def scan_directories(directories, exclude_patterns, location_config):
+    '''
+    Given a sequence of source paths, a sequence of Borg exclude patterns, and a location config
+    dict, walk the sources in parallel and return a tuple of File_status instances for every path
+    that Borg would back up, sorted by path. See _scan_directories() for details.
+
+    A particular scan only happens once per borgmatic run, so that for instance creating archives
+    in several repositories from the same configuration only has to walk the sources once.
+    '''
+    key = (
+        tuple(directories),
+        tuple(exclude_patterns),
+        tuple(location_config.get(option) for option in SCAN_OPTIONS),
+    )
+
+    return cache.compute_once(
+        _scans,
+        _scans_lock,
+        key,
+        lambda: tuple(_scan_directories(directories, exclude_patterns, location_config)),
+    )
+
+
+def clear_cache():
+    '''
+    Forget all cached scans, so that subsequent scans walk the filesystem again.
+    '''
+    with _scans_lock:
+        _scans.clear()
@@ -0,0 +1,138 @@
+'''
+A source manifest records the state of every path backed up by the last archive that borgmatic
+created in a repository, so that a subsequent run can tell whether anything has changed since.
+
+Manifests are stored in a packed binary format: A header with a magic string, a format version, the
+time the archive was created, and a digest of the configuration that determines which paths get
+backed up. Then one record per path with its inode, size, modification and status change times in
+nanoseconds, and mode, followed by the path itself.
+'''
+import hashlib
+import json
+import os
+import struct
+import time
+
+from borgmatic import cache
+
+
+MANIFEST_MAGIC = b'BMSM'
+
+# Bump this whenever the manifest format changes, so that stale manifests get ignored.
+MANIFEST_VERSION = 1
+
+HEADER = struct.Struct('<4sHd32s')
+RECORD = struct.Struct('<QQqqII')
+
+# Options that don't affect which paths get backed up or what's recorded about them.
+IGNORED_OPTIONS = {
+    'encryption_passphrase',
+    'repositories',
+    'repository_jobs',
+    'skip_unchanged_max_age',
+}
+
+
+def _manifest_filename(repository, key):
+    '''
+    Given a local or remote repository path and a configuration key as per make_key(), return the
+    path of the manifest file for archives created in the repository with that configuration. Each
+    configuration gets its own manifest, so that several configuration files backing up different
+    sources to the same repository don't overwrite each other's manifests.
+    '''
+    return cache.repository_cache_filename('manifests', repository, '{}.bin'.format(key.hex()))
+
+
+def make_key(sources, exclude_patterns, location_config, storage_config):
+    '''
+    Given a sequence of source paths to back up, a sequence of Borg exclude patterns, a location
+    config dict, and a storage config dict, return a digest of them as bytes. If the digest differs
+    from the one in a repository's manifest, the next archive may differ from the last one even if
+    no files have changed.
+    '''
+    options = {
+        name: value
+        for config in (location_config, storage_config)
+        for name, value in config.items()
+        if name not in IGNORED_OPTIONS
+    }
+
+    return hashlib.sha256(
+        json.dumps(
+            [list(sources), list(exclude_patterns), options], sort_keys=True, default=str
+        ).encode('utf-8', 'surrogateescape')
+    ).digest()
+
+
+def pack_statuses(statuses):
+    '''
+    Given a sequence of scan.File_status instances sorted by path, return the body of a manifest
+    recording them, as bytes.
+    '''
+    records = []
+
+    for status in statuses:
+        path = os.fsencode(status.path)
+        records.append(
+            RECORD.pack(
+                status.inode,
+                status.size,
+                status.mtime_ns,
+                status.ctime_ns,
+                status.mode,
+                len(path),
+            )
+        )
+        records.append(path)
+
+    return b''.join(records)
+
+
+def read_manifest(repository, key):
+    '''
+    Given a local or remote repository path and a configuration key as per make_key(), return a
+    tuple of the archive creation time, the configuration key, and the body from the manifest for
+    that configuration. Return None if there's no usable manifest.
+    '''
+    data = cache.read_cache_file(_manifest_filename(repository, key))
+
+    if data is None or len(data) < HEADER.size:
+        return None
+
+    (magic, version, created_time, key) = HEADER.unpack_from(data)
+    if magic != MANIFEST_MAGIC or version != MANIFEST_VERSION:
+        return None
+
+    return (created_time, key, data[HEADER.size :])
+
+
+def write_manifest(repository, key, body, created_time):
+    '''
+    Given a local or remote repository path, a configuration key as per make_key(), a manifest body
+    as per pack_statuses(), and the time at which the archive that the manifest describes was
+    created, write the repository's manifest for that configuration.
+    '''
+    cache.write_cache_file(
+        _manifest_filename(repository, key),
+        HEADER.pack(MANIFEST_MAGIC, MANIFEST_VERSION, created_time, key) + body,
+    )
+
+
+def is_unchanged(repository, key, body, max_age=None, now=None):
+    '''
+    Given a local or remote repository path, a configuration key as per make_key(), a manifest body
+    as per pack_statuses() from a fresh scan of the sources, the maximum age in seconds of the last
+    archive before another one must be created regardless (or None for no maximum), and the current
+    time, return whether the repository's manifest for that configuration shows that nothing has
+    changed since its last archive.
+    '''
+    manifest = read_manifest(repository, key)
+    if manifest is None:
+        return False
+
+    (created_time, manifest_key, manifest_body) = manifest
+
+    if max_age is not None and (now or time.time()) - created_time >= max_age:
+        return False
+
+    return manifest_key == key and manifest_body == body
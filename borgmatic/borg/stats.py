@@ -0,0 +1,89 @@
+import collections
+import json
+
+
+class Archive_stats(
+    collections.namedtuple(
+        'Archive_stats',
+        (
+            'archive_name',
+            'original_size',
+            'compressed_size',
+            'deduplicated_size',
+            'file_count',
+            'duration',
+        ),
+    )
+):
+    '''
+    Statistics for a single Borg archive, as reported by Borg's --json output. Sizes are in bytes,
+    and the duration is in seconds.
+    '''
+    __slots__ = ()
+
+    @property
+    def throughput(self):
+        '''
+        Return the number of original (pre-compression and pre-deduplication) bytes processed per
+        second, or None if the duration is unknown.
+        '''
+        if not self.duration:
+            return None
+
+        return self.original_size / self.duration
+
+
+def parse_archive_stats(archive):
+    '''
+    Given a single archive dict from Borg's --json output (e.g. the "archive" value from "borg create
+    --json"), return it as an Archive_stats instance.
+    '''
+    stats = archive['stats']
+
+    return Archive_stats(
+        archive_name=archive['name'],
+        original_size=stats['original_size'],
+        compressed_size=stats['compressed_size'],
+        deduplicated_size=stats['deduplicated_size'],
+        file_count=stats['nfiles'],
+        duration=archive.get('duration'),
+    )
+
+
+def parse_create_output(json_output):
+    '''
+    Given the JSON output of "borg create --json" as bytes, return an Archive_stats instance for the
+    created archive.
+    '''
+    return parse_archive_stats(json.loads(json_output.decode('utf-8'))['archive'])
+
+
+def format_size(size):
+    '''
+    Given a size in bytes, return it as a human-readable string like "1.50 MB".
+    '''
+    for unit in ('B', 'kB', 'MB', 'GB', 'TB'):
+        if abs(size) < 1000 or unit == 'TB':
+            break
+        size /= 1000
+
+    return '{:.2f} {}'.format(size, unit) if unit != 'B' else '{} B'.format(size)
+
+
+def format_archive_stats(stats):
+    '''
+    Given an Archive_stats instance, return a human-readable summary of it as a string.
+    '''
+    throughput = stats.throughput
+
+    return '\n'.join(
+        (
+            'Archive name: {}'.format(stats.archive_name),
+            'Number of files: {}'.format(stats.file_count),
+            'Original size: {}'.format(format_size(stats.original_size)),
+            'Compressed size: {}'.format(format_size(stats.compressed_size)),
+            'Deduplicated size: {}'.format(format_size(stats.deduplicated_size)),
+            'Duration: {:.2f} seconds'.format(stats.duration or 0),
+            'Throughput: {}/s'.format(format_size(throughput)) if throughput else 'Throughput: -',
+        )
+    ) + '\n'
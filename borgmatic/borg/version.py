@@ -0,0 +1,60 @@
+import functools
+import re
+import threading
+
+from borgmatic import execute
+
+
+# Borg versions from this one onwards support --json output for create, info, and list.
+JSON_MINIMUM_VERSION = (1, 1, 0)
+
+# Borg versions from this one onwards support archive filters like --last for list and info.
+ARCHIVE_FILTERS_MINIMUM_VERSION = (1, 1, 0)
+
+# Held while asking Borg for its version, so that concurrently running repositories and configuration
+# files wait for the first one to ask, rather than each running "borg --version" themselves.
+_version_lock = threading.Lock()
+
+
+def _parse_version(version_output):
+    '''
+    Given the output of "borg --version" as a string (e.g. "borg 1.1.2"), return the version as a
+    tuple of integers like (1, 1, 2). Ignore any trailing pre-release suffix, like the "b3" in
+    "1.1.0b3". Return an empty tuple if the output can't be parsed.
+    '''
+    match = re.match(r'\d+(\.\d+)*', version_output.strip().split(' ')[-1])
+    if not match:
+        return ()
+
+    return tuple(int(component) for component in match.group(0).split('.'))
+
+
+@functools.lru_cache()
+def _cached_local_borg_version():
+    return _parse_version(
+        execute.execute_command_and_capture_output(('borg', '--version')).decode('utf-8')
+    )
+
+
+def local_borg_version():
+    '''
+    Run "borg --version" and return the local Borg version as a tuple of integers. The result is
+    cached, so Borg is only asked once per borgmatic run, even when called from several threads at
+    once.
+    '''
+    with _version_lock:
+        return _cached_local_borg_version()
+
+
+def supports_json():
+    '''
+    Return whether the local Borg version supports --json output.
+    '''
+    return local_borg_version() >= JSON_MINIMUM_VERSION
+
+
+def supports_archive_filters():
+    '''
+    Return whether the local Borg version supports archive filters like --last.
+    '''
+    return local_borg_version() >= ARCHIVE_FILTERS_MINIMUM_VERSION
@@ -0,0 +1,122 @@
+from concurrent.futures import Future
+import hashlib
+import json
+import os
+import tempfile
+
+
+def cache_directory():
+    '''
+    Return the path of the directory in which borgmatic caches data and keeps state between runs,
+    per the XDG base directory specification.
+    '''
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'borgmatic'
+    )
+
+
+def compute_once(results, lock, key, compute):
+    '''
+    Given a dict of in-process results mapping from keys to Futures, a lock guarding the dict, a key,
+    and a function that takes no arguments and computes the result for the key, return the result,
+    computing it only if it isn't in the dict yet. If several threads request the same key at once,
+    one of them computes and the others wait for its result.
+
+    A computation that raises isn't remembered, so a later request for the same key tries again.
+    '''
+    with lock:
+        result = results.get(key)
+        owner = result is None
+        if owner:
+            result = results[key] = Future()
+
+    if owner:
+        try:
+            result.set_result(compute())
+        except BaseException as error:
+            with lock:
+                del results[key]
+            result.set_exception(error)
+            raise
+
+    return result.result()
+
+
+def repository_cache_filename(kind, repository, extension):
+    '''
+    Given the kind of data cached per repository (e.g. "manifests"), a local or remote repository
+    path, and a filename extension, return the path of the repository's cache file for that kind of
+    data.
+    '''
+    return os.path.join(
+        cache_directory(),
+        kind,
+        '{}.{}'.format(hashlib.sha256(repository.encode('utf-8')).hexdigest(), extension),
+    )
+
+
+def read_cache_file(cache_filename):
+    '''
+    Given the path to a cache file, return its contents as bytes, or None if it doesn't exist or
+    can't be read. Also return None if the file isn't owned by the current user or is accessible to
+    anyone else, as cached data may contain secrets and must not be tampered with.
+    '''
+    try:
+        with open(cache_filename, 'rb') as cache_file:
+            status = os.fstat(cache_file.fileno())
+            if status.st_uid != os.getuid() or status.st_mode & 0o077:
+                return None
+
+            return cache_file.read()
+    except OSError:
+        return None
+
+
+def write_cache_file(cache_filename, data):
+    '''
+    Given the path to a cache file and bytes to cache, write them to the file, readable only by the
+    current user. The file is written atomically, so concurrent borgmatic runs never see a partial
+    cache file. If the cache can't be written, carry on without it.
+    '''
+    try:
+        os.makedirs(os.path.dirname(cache_filename), mode=0o700, exist_ok=True)
+        (descriptor, temporary_filename) = tempfile.mkstemp(dir=os.path.dirname(cache_filename))
+
+        try:
+            with os.fdopen(descriptor, 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(temporary_filename, cache_filename)
+        except BaseException:
+            os.remove(temporary_filename)
+            raise
+    except OSError:
+        pass
+
+
+def read_json_cache_file(cache_filename):
+    '''
+    Given the path to a cache file, return its JSON contents, or None if it doesn't exist, can't be
+    read, or can't be trusted as per read_cache_file().
+    '''
+    data = read_cache_file(cache_filename)
+    if data is None:
+        return None
+
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def write_json_cache_file(cache_filename, data):
+    '''
+    Given the path to a cache file and data to cache, write the data to the file as JSON as per
+    write_cache_file(). If the data can't be represented as JSON, carry on without caching it.
+    '''
+    try:
+        text = json.dumps(data, separators=(',', ':'))
+    # A TypeError means the data has values that JSON can't represent, like dates.
+    except TypeError:
+        return
+
+    write_cache_file(cache_filename, text.encode('utf-8'))
@@ -1,9 +1,12 @@
 from __future__ import print_function
 from argparse import ArgumentParser
+import functools
 import os
-from subprocess import CalledProcessError
+import signal
+from subprocess import CalledProcessError, TimeoutExpired
 import sys
 
+from borgmatic import execute, profiling, scheduler
 from borgmatic.borg import check, create, prune
 from borgmatic.config import collect, convert, validate
 
@@ -21,7 +24,7 @@ def parse_arguments(*arguments):
             '''
             A simple wrapper script for the Borg backup software that creates and prunes backups.
             If none of the --prune, --create, or --check options are given, then borgmatic defaults
-            to all three: prune, create, and check archives.
+            to all three: create, prune, and check archives.
             '''
     )
     parser.add_argument(
@@ -31,6 +34,26 @@ def parse_arguments(*arguments):
         default=collect.DEFAULT_CONFIG_PATHS,
         help='Configuration filenames or directories, defaults to: {}'.format(' '.join(collect.DEFAULT_CONFIG_PATHS)),
     )
+    parser.add_argument(
+        '--config-recursive',
+        dest='config_recursive',
+        action='store_true',
+        help='Collect configuration files from sub-directories of configuration directories as well',
+    )
+    parser.add_argument(
+        '--config-include',
+        nargs='+',
+        dest='config_include_patterns',
+        default=(),
+        help='Only collect configuration files from configuration directories if their names match one of these glob patterns, e.g. "*.yaml"',
+    )
+    parser.add_argument(
+        '--config-exclude',
+        nargs='+',
+        dest='config_exclude_patterns',
+        default=(),
+        help='Skip files and sub-directories within configuration directories whose names match any of these glob patterns',
+    )
     parser.add_argument(
         '--excludes',
         dest='excludes_filename',
@@ -54,6 +77,53 @@ def parse_arguments(*arguments):
         action='store_true',
         help='Check archives for consistency',
     )
+    parser.add_argument(
+        '-n', '--dry-run',
+        dest='dry_run',
+        action='store_true',
+        help='With --prune, only display which archives would be pruned, without pruning any. Simulated locally when possible, without running Borg',
+    )
+    parser.add_argument(
+        '--progress',
+        dest='progress',
+        action='store_true',
+        help='When creating archives, estimate the size of the sources and how long backing them up will take, and display progress while Borg runs',
+    )
+    parser.add_argument(
+        '--cache-config',
+        dest='cache_config',
+        action='store_true',
+        help='Cache validated configuration files in ~/.cache/borgmatic, skipping parsing and validation until they change',
+    )
+    parser.add_argument(
+        '--validate-only',
+        dest='validate_only',
+        action='store_true',
+        help='Only validate configuration files, displaying the status of each, and exit with an error if any are invalid',
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs',
+        type=int,
+        help='Number of configuration files to run concurrently, defaults to 1. Also the number of processes to validate configuration files with, defaults to the number of CPUs',
+    )
+    parser.add_argument(
+        '--repository-jobs',
+        dest='repository_jobs',
+        type=int,
+        help='Number of repositories to back up to concurrently, overriding repository_jobs within configuration',
+    )
+    parser.add_argument(
+        '--profile',
+        dest='profile_filename',
+        help='Record wall and CPU time for each phase of the run, write them to this JSON file, and display a summary table',
+    )
+    parser.add_argument(
+        '--profile-python',
+        dest='profile_python',
+        action='store_true',
+        help='With --profile, also profile borgmatic\'s own Python code with cProfile and tracemalloc, writing cProfile statistics to the profile filename plus ".pstats"',
+    )
     parser.add_argument(
         '-v', '--verbosity',
         type=int,
@@ -62,6 +132,12 @@ def parse_arguments(*arguments):
 
     args = parser.parse_args(arguments)
 
+    if args.profile_python and not args.profile_filename:
+        raise ValueError('The --profile-python option requires --profile')
+
+    if args.dry_run and (not args.prune or args.create or args.check):
+        raise ValueError('The --dry-run option only applies to --prune on its own')
+
     # If any of the three action flags in the given parse arguments have been explicitly requested,
     # leave them as-is. Otherwise, assume defaults: Mutate the given arguments to enable all the
     # actions.
@@ -73,37 +149,186 @@ def parse_arguments(*arguments):
     return args
 
 
+def _make_actions(args, location, storage, retention, consistency):
+    '''
+    Given parsed command-line arguments and location, storage, retention, and consistency config
+    dicts, return a list of scheduler.Action instances for the requested actions against each
+    configured repository. The actions for each repository are locked on the repository path, so
+    they run one at a time in the order: create, prune, check.
+    '''
+    remote_path = location.get('remote_path')
+    actions = []
+
+    for repository in location['repositories']:
+        if args.create:
+            actions.append(scheduler.Action(
+                'create',
+                repository,
+                functools.partial(
+                    create.create_archive, args.verbosity, repository, location, storage,
+                    progress=args.progress,
+                ),
+            ))
+        if args.prune:
+            actions.append(scheduler.Action(
+                'prune',
+                repository,
+                functools.partial(
+                    prune.prune_archives,
+                    args.verbosity, repository, storage, retention, remote_path=remote_path,
+                    dry_run=args.dry_run,
+                ),
+            ))
+        if args.check:
+            actions.append(scheduler.Action(
+                'check',
+                repository,
+                functools.partial(
+                    check.check_archives,
+                    args.verbosity, repository, storage, consistency, remote_path=remote_path,
+                ),
+            ))
+
+    return actions
+
+
+def parse_configurations(config_filenames, args):
+    '''
+    Given a sequence of config filenames and parsed command-line arguments, parse and validate all
+    of the configuration files in parallel before running any of them. Return a tuple of a dict
+    mapping from each valid config filename to its parsed configuration, and a dict mapping from
+    each invalid config filename to its error, both in the order of the given filenames.
+    '''
+    # Each file's parse time gets recorded as a "parse" phase of its own.
+    with profiling.phase('parse_all'):
+        return validate.parse_configurations(
+            config_filenames,
+            validate.schema_filename(),
+            args.jobs or os.cpu_count() or 1,
+            use_cache=args.cache_config,
+        )
+
+
+def display_validation_status(config_filenames, errors):
+    '''
+    Given a sequence of config filenames and a dict mapping from each invalid config filename to its
+    error, display the status of each file on stdout and the details of any errors on stderr.
+    '''
+    for config_filename in config_filenames:
+        error = errors.get(config_filename)
+
+        if error is None:
+            print('{}: valid'.format(config_filename))
+            continue
+
+        print('{}: invalid'.format(config_filename))
+        print(error, file=sys.stderr)
+
+
+def run_configuration(config_filename, config, args):
+    '''
+    Given a config filename, its parsed configuration, and parsed command-line arguments, run the
+    requested actions against each of the configuration's repositories.
+
+    Actions for different repositories run concurrently if more than one repository job is
+    requested, either via the command-line or the "repository_jobs" location option.
+    '''
+    (location, storage, retention, consistency) = (
+        config.get(section_name, {})
+        for section_name in ('location', 'storage', 'retention', 'consistency')
+    )
+
+    scheduler.run_actions(
+        [
+            action._replace(
+                function=profiling.wrap(action.function, action.name, config_filename, action.lock)
+            )
+            for action in _make_actions(args, location, storage, retention, consistency)
+        ],
+        args.repository_jobs or location.get('repository_jobs') or 1,
+    )
+
+
+def run_configurations(configs, args):
+    '''
+    Given a dict mapping from config filename to parsed configuration and parsed command-line
+    arguments, run each configuration, running as many of them concurrently as requested via the
+    --jobs command-line flag. Configurations that back up to a repository in common run one at a
+    time in the given order, as Borg can't access a repository from two processes at once.
+    '''
+    scheduler.run_actions(
+        [
+            scheduler.Action(
+                'configuration',
+                config_filename,
+                functools.partial(run_configuration, config_filename, config, args),
+                shared_locks=tuple(config.get('location', {}).get('repositories', ())),
+            )
+            for config_filename, config in configs.items()
+        ],
+        args.jobs or 1,
+    )
+
+
+def _terminate(signal_number, frame):  # pragma: no cover
+    '''
+    Signal handler that terminates any running child processes and then exits.
+    '''
+    execute.terminate_children(signal_number)
+    sys.exit(128 + signal_number)
+
+
+def _finish_profiling(profile_filename):  # pragma: no cover
+    '''
+    Given the profile filename from the command-line, stop profiling, write the summary to that
+    file as JSON, and display the summary table on stderr.
+    '''
+    summary = profiling.summarize(profile_filename)
+    profiling.write_summary(summary, profile_filename)
+    print(profiling.format_table(summary), file=sys.stderr)
+
+
 def main():  # pragma: no cover
+    signal.signal(signal.SIGTERM, _terminate)
+    args = None
+
     try:
         args = parse_arguments(*sys.argv[1:])
-        config_filenames = tuple(collect.collect_config_filenames(args.config_paths))
+        if args.profile_filename:
+            profiling.enable(python=args.profile_python)
+
+        with profiling.phase('collect'):
+            config_filenames = tuple(
+                collect.collect_config_filenames(
+                    args.config_paths,
+                    recursive=args.config_recursive,
+                    include_patterns=args.config_include_patterns,
+                    exclude_patterns=args.config_exclude_patterns,
+                )
+            )
         convert.guard_configuration_upgraded(LEGACY_CONFIG_PATH, config_filenames)
 
         if len(config_filenames) == 0:
             raise ValueError('Error: No configuration files found in: {}'.format(' '.join(args.config_paths)))
 
-        for config_filename in config_filenames:
-            config = validate.parse_configuration(config_filename, validate.schema_filename())
-            (location, storage, retention, consistency) = (
-                config.get(section_name, {})
-                for section_name in ('location', 'storage', 'retention', 'consistency')
+        (configs, errors) = parse_configurations(config_filenames, args)
+
+        if args.validate_only:
+            display_validation_status(config_filenames, errors)
+            sys.exit(1 if errors else 0)
+
+        if errors:
+            raise ValueError(
+                '\n'.join(str(error) for error in errors.values())
+                + '\n{} of {} configuration files are invalid; not running any of them'.format(
+                    len(errors), len(config_filenames)
+                )
             )
-            remote_path = location.get('remote_path')
-
-            create.initialize(storage)
-
-            for repository in location['repositories']:
-                if args.prune:
-                    prune.prune_archives(args.verbosity, repository, retention, remote_path=remote_path)
-                if args.create:
-                    create.create_archive(
-                        args.verbosity,
-                        repository,
-                        location,
-                        storage,
-                    )
-                if args.check:
-                    check.check_archives(args.verbosity, repository, consistency, remote_path=remote_path)
-    except (ValueError, OSError, CalledProcessError) as error:
+
+        run_configurations(configs, args)
+    except (ValueError, OSError, CalledProcessError, TimeoutExpired) as error:
         print(error, file=sys.stderr)
         sys.exit(1)
+    finally:
+        if args and args.profile_filename:
+            _finish_profiling(args.profile_filename)
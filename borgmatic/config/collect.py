@@ -1,14 +1,58 @@
+import fnmatch
 import os
 
 
 DEFAULT_CONFIG_PATHS = ['/etc/borgmatic/config.yaml', '/etc/borgmatic.d']
 
 
-def collect_config_filenames(config_paths):
+def _matches_any(name, patterns):
+    '''
+    Given a file or directory name and a sequence of glob patterns, return whether the name matches
+    any of the patterns.
+    '''
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def _collect_directory(directory, recursive, include_patterns, exclude_patterns):
+    '''
+    Given a directory path, whether to recurse into sub-directories, and sequences of include and
+    exclude glob patterns, yield the paths of the config files within the directory, sorted by
+    name. See collect_config_filenames() for details.
+    '''
+    # os.scandir() entries cache the file type from the directory listing itself, so telling files
+    # from directories doesn't need a separate stat() call per entry.
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if _matches_any(entry.name, exclude_patterns):
+            continue
+
+        if entry.is_dir():
+            if recursive and not entry.is_symlink():
+                for path in _collect_directory(
+                    entry.path, recursive, include_patterns, exclude_patterns
+                ):
+                    yield path
+            continue
+
+        if include_patterns and not _matches_any(entry.name, include_patterns):
+            continue
+
+        yield entry.path
+
+
+def collect_config_filenames(
+    config_paths, recursive=False, include_patterns=(), exclude_patterns=()
+):
     '''
     Given a sequence of config paths, both filenames and directories, resolve that to just an
     iterable of files. Accomplish this by listing any given directories looking for contained config
-    files. This is non-recursive, so any directories within the given directories are ignored.
+    files, yielding the files in each directory sorted by name. If recursive is False, then any
+    directories within the given directories are ignored. Otherwise, recurse into them, although not
+    into symlinks to directories, so that symlink loops can't cause infinite recursion.
+
+    If include glob patterns are given, then only collect files from directories if their names
+    match at least one of the patterns, e.g. "*.yaml". Skip any files or directories within
+    directories whose names match any of the given exclude glob patterns. Explicitly given config
+    filenames are always collected regardless of patterns.
 
     Return paths even if they don't exist on disk, so the user can find out about missing
     configuration paths. However, skip /etc/borgmatic.d if it's missing, so the user doesn't have to
@@ -24,7 +68,5 @@ def collect_config_filenames(config_paths):
             yield path
             continue
 
-        for filename in os.listdir(path):
-            full_filename = os.path.join(path, filename)
-            if not os.path.isdir(full_filename):
-                yield full_filename
+        for filename in _collect_directory(path, recursive, include_patterns, exclude_patterns):
+            yield filename
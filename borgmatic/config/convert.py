@@ -1,9 +1,5 @@
 import os
 
-from ruamel import yaml
-
-from borgmatic.config import generate
-
 
 def _convert_section(source_section_config, section_schema):
     '''
@@ -12,6 +8,8 @@ def _convert_section(source_section_config, section_schema):
 
     Where integer types exist in the given section schema, convert their values to integers.
     '''
+    from ruamel import yaml
+
     destination_section_config = yaml.comments.CommentedMap([
         (
             option_name,
@@ -33,6 +31,10 @@ def convert_legacy_parsed_config(source_config, source_excludes, schema):
     Additionally, use the given schema as a source of helpful comments to include within the
     returned CommentedMap.
     '''
+    from ruamel import yaml
+
+    from borgmatic.config import generate
+
     destination_config = yaml.comments.CommentedMap([
         (section_name, _convert_section(section_config, schema['map'][section_name]))
         for section_name, section_config in source_config._asdict().items()
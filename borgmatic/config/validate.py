@@ -1,11 +1,13 @@
-import logging
-import sys
-import warnings
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import itertools
+import os
+import threading
+import time
 
-import pkg_resources
-import pykwalify.core
-import pykwalify.errors
-from ruamel import yaml
+from borgmatic import cache, profiling
+from borgmatic.config import validator
 
 
 def schema_filename():
@@ -13,7 +15,208 @@ def schema_filename():
     Path to the installed YAML configuration schema file, used to validate and parse the
     configuration.
     '''
-    return pkg_resources.resource_filename('borgmatic', 'config/schema.yaml')
+    return os.path.join(os.path.dirname(__file__), 'schema.yaml')
+
+
+# Bump these whenever the format of cached schemas or configurations changes, so stale cache files
+# get ignored.
+SCHEMA_CACHE_VERSION = 1
+CONFIG_CACHE_VERSION = 1
+
+_schemas = {}
+_validators = {}
+_schemas_lock = threading.Lock()
+
+
+def _hash_text(text):
+    '''
+    Given a string, return the hex digest of a SHA-256 hash of it.
+    '''
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _schema_cache_filename(schema_hash):
+    '''
+    Given the hex digest of a schema file's contents, return the path of its cache file.
+    '''
+    return os.path.join(
+        cache.cache_directory(), 'schema-{}-{}.json'.format(SCHEMA_CACHE_VERSION, schema_hash)
+    )
+
+
+def _read_cached_schema(schema_hash):
+    '''
+    Given the hex digest of a schema file's contents, return the loaded schema from its cache file,
+    or None if it isn't cached.
+    '''
+    return cache.read_json_cache_file(_schema_cache_filename(schema_hash))
+
+
+def _write_cached_schema(schema_hash, schema):
+    '''
+    Given the hex digest of a schema file's contents and the loaded schema, write the schema to its
+    cache file.
+    '''
+    cache.write_json_cache_file(_schema_cache_filename(schema_hash), schema)
+
+
+def _config_cache_filename(config_filename):
+    '''
+    Given the path to a configuration file, return the path of its cache file. There's one cache
+    file per configuration path, so stale cache files get replaced rather than piling up.
+    '''
+    return os.path.join(
+        cache.cache_directory(),
+        'config-{}.json'.format(_hash_text(os.path.abspath(config_filename))),
+    )
+
+
+def _read_cached_config(config_filename, cache_key):
+    '''
+    Given the path to a configuration file and the cache key for its current contents, return the
+    parsed configuration from its cache file, or None if it isn't cached or the cached copy is
+    stale.
+    '''
+    cached = cache.read_json_cache_file(_config_cache_filename(config_filename))
+
+    if not isinstance(cached, dict) or cached.get('key') != cache_key:
+        return None
+
+    return cached.get('config')
+
+
+def _write_cached_config(config_filename, cache_key, config):
+    '''
+    Given the path to a configuration file, the cache key for its current contents, and its parsed
+    configuration, write the configuration to its cache file.
+    '''
+    cache.write_json_cache_file(_config_cache_filename(config_filename), {'key': cache_key, 'config': config})
+
+
+def _parse_schema(schema_text):
+    '''
+    Given the contents of a schema file in pykwalify YAML schema format, parse it and return it
+    ready for validation as nested dicts and lists.
+    '''
+    from ruamel import yaml
+
+    schema = yaml.safe_load(schema_text)
+
+    # pykwalify gets angry if the example field is not a string. So rather than bend to its will,
+    # simply remove all examples before passing the schema to pykwalify.
+    for section_name, section_schema in schema['map'].items():
+        for field_name, field_schema in section_schema['map'].items():
+            field_schema.pop('example')
+
+    return schema
+
+
+def _load_schema(schema_filename):
+    '''
+    Given the path to a schema filename, load the schema as per load_schema(). Return a tuple of the
+    hex digest of the schema file's contents and the schema.
+    '''
+    schema_text = open(schema_filename).read()
+    schema_hash = _hash_text(schema_text)
+
+    with _schemas_lock:
+        schema = _schemas.get(schema_hash)
+        if schema is not None:
+            return (schema_hash, schema)
+
+        schema = _read_cached_schema(schema_hash)
+        if schema is None:
+            schema = _parse_schema(schema_text)
+            _write_cached_schema(schema_hash, schema)
+
+        _schemas[schema_hash] = schema
+
+    return (schema_hash, schema)
+
+
+def load_schema(schema_filename):
+    '''
+    Given the path to a schema filename in pykwalify YAML schema format, return the schema ready for
+    validation as nested dicts and lists.
+
+    Since parsing the schema is slow, it only happens once per process for each distinct schema, and
+    the result is also cached on disk for subsequent borgmatic runs. Both caches are keyed on a hash
+    of the schema file's contents, so editing the schema invalidates them. Callers must not modify
+    the returned schema.
+
+    Raise FileNotFoundError if the file does not exist, or ruamel.yaml.error.YAMLError if it can't
+    be parsed.
+    '''
+    return _load_schema(schema_filename)[1]
+
+
+def _make_pykwalify_validator(schema):
+    '''
+    Given a schema as nested dicts and lists, return a function that validates a parsed
+    configuration against it with pykwalify and returns a list of error message strings.
+
+    Raise ValueError if pykwalify isn't installed.
+    '''
+    try:
+        import pykwalify.core
+    except ImportError:
+        raise ValueError('Validating against this schema requires pykwalify to be installed')
+
+    def validate_config(config):
+        core = pykwalify.core.Core(source_data=config, schema_data=schema)
+        core.validate(raise_exception=False)
+
+        return core.validation_errors
+
+    return validate_config
+
+
+def load_validator(schema_filename):
+    '''
+    Given the path to a schema filename in pykwalify YAML schema format, return a function that takes
+    a parsed configuration and returns a list of validation error message strings, empty if the
+    configuration is valid.
+
+    The schema gets compiled into Python checking functions once per process. If the schema uses
+    features that can't be compiled, fall back to validating with pykwalify.
+
+    Raise FileNotFoundError if the file does not exist, ruamel.yaml.error.YAMLError if it can't be
+    parsed, or ValueError if it can't be compiled and pykwalify isn't installed.
+    '''
+    (schema_hash, schema) = _load_schema(schema_filename)
+
+    with _schemas_lock:
+        validate_config = _validators.get(schema_hash)
+        if validate_config is not None:
+            return validate_config
+
+        try:
+            validate_config = validator.compile_schema(schema)
+        except validator.Unsupported_schema_error:
+            validate_config = _make_pykwalify_validator(schema)
+
+        _validators[schema_hash] = validate_config
+
+    return validate_config
+
+
+def load_configuration_yaml(config_text):
+    '''
+    Given the contents of a configuration file in YAML format, parse it and return it as nested
+    dicts and lists. Use the C LibYAML-based safe loader if it's available, falling back to
+    the pure Python safe loader otherwise. Unlike round-trip loading, this doesn't preserve comments
+    or formatting, and so it's only suitable for reading configuration rather than rewriting it.
+
+    Raise ruamel.yaml.error.YAMLError if the YAML can't be parsed.
+    '''
+    from ruamel import yaml
+
+    # The safe loaders always parse YAML 1.2, so leave any file declaring its own YAML version to
+    # the slower round-trip loader, which honors the declared version.
+    if config_text.lstrip().startswith('%YAML'):
+        return yaml.round_trip_load(config_text)
+
+    return yaml.load(config_text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
 
 
 class Validation_error(ValueError):
@@ -22,53 +225,148 @@ class Validation_error(ValueError):
     configurartion file.
     '''
     def __init__(self, config_filename, error_messages):
+        # Pass the arguments along so that the error survives pickling between processes.
+        super(Validation_error, self).__init__(config_filename, error_messages)
         self.config_filename = config_filename
         self.error_messages = error_messages
 
+    def __str__(self):
+        return '\n'.join(
+            ('An error occurred while parsing a configuration file at {}:'.format(
+                self.config_filename
+            ),)
+            + tuple(str(error) for error in self.error_messages)
+        )
 
-def parse_configuration(config_filename, schema_filename):
+
+def parse_configuration(config_filename, schema_filename, use_cache=False):
     '''
     Given the path to a config filename in YAML format and the path to a schema filename in
-    pykwalify YAML schema format, return the parsed configuration as a data structure of nested
-    dicts and lists corresponding to the schema. Example return value:
+    pykwalify YAML schema format, validate the configuration against the schema and return the
+    parsed configuration as a data structure of nested dicts and lists corresponding to the schema.
+    Example return value:
 
        {'location': {'source_directories': ['/home', '/etc'], 'repository': 'hostname.borg'},
        'retention': {'keep_daily': 7}, 'consistency': {'checks': ['repository', 'archives']}}
 
+    If use_cache is True, then look for a previously validated copy of the configuration in the
+    cache directory first, and skip parsing and validation if it's there. The cache is keyed on the
+    contents of both the configuration file and the schema, so any change to either invalidates it.
+    Successfully validated configurations get written to the cache, readable only by the current
+    user as they may contain passphrases.
+
     Raise FileNotFoundError if the file does not exist, PermissionError if the user does not
     have permissions to read the file, or Validation_error if the config does not match the schema.
     '''
+    config_text = open(config_filename).read()
+
+    if use_cache:
+        cache_key = _hash_text(
+            '{} {} {}'.format(
+                CONFIG_CACHE_VERSION,
+                _hash_text(open(schema_filename).read()),
+                _hash_text(config_text),
+            )
+        )
+        cached_config = _read_cached_config(config_filename, cache_key)
+        if cached_config is not None:
+            return cached_config
+
+    # Import this here rather than at module load, as it's slow to import and borgmatic doesn't need
+    # it until it actually parses a configuration file.
+    from ruamel import yaml
+
     try:
-        config = yaml.round_trip_load(open(config_filename))
-        schema = yaml.round_trip_load(open(schema_filename))
+        config = load_configuration_yaml(config_text)
+        validate_config = load_validator(schema_filename)
     except yaml.error.YAMLError as error:
         raise Validation_error(config_filename, (str(error),))
 
-    # pykwalify gets angry if the example field is not a string. So rather than bend to its will,
-    # simply remove all examples before passing the schema to pykwalify.
-    for section_name, section_schema in schema['map'].items():
-        for field_name, field_schema in section_schema['map'].items():
-            field_schema.pop('example')
+    validation_errors = validate_config(config)
 
-    validator = pykwalify.core.Core(source_data=config, schema_data=schema)
-    parsed_result = validator.validate(raise_exception=False)
+    if validation_errors:
+        raise Validation_error(config_filename, validation_errors)
 
-    if validator.validation_errors:
-        raise Validation_error(config_filename, validator.validation_errors)
+    if use_cache:
+        _write_cached_config(config_filename, cache_key, config)
 
-    return parsed_result
+    return config
 
 
-def display_validation_error(validation_error):
+def _parse_configuration_or_error(config_filename, schema_filename, use_cache):
     '''
-    Given a Validation_error, display its error messages to stderr.
+    Given the arguments for parse_configuration(), call it and return a tuple of the parsed
+    configuration, None, and the wall time and CPU time in seconds that parsing took. If parsing
+    fails, return None and the error raised in place of the parsed configuration and None.
+
+    The timings are returned rather than recorded here, as this may run in a worker process whose
+    profiling records would be lost.
     '''
-    print(
-        'An error occurred while parsing a configuration file at {}:'.format(
-            validation_error.config_filename
-        ),
-        file=sys.stderr,
-    )
+    start_wall = time.monotonic()
+    start_cpu = time.process_time()
+
+    try:
+        result = (parse_configuration(config_filename, schema_filename, use_cache), None)
+    except (ValueError, OSError) as error:
+        result = (None, error)
+
+    return result + (time.monotonic() - start_wall, time.process_time() - start_cpu)
+
+
+def parse_configurations(config_filenames, schema_filename, jobs, use_cache=False):
+    '''
+    Given a sequence of config filenames in YAML format, the path to a schema filename in pykwalify
+    YAML schema format, the maximum number of worker processes to use, and whether to use the
+    configuration cache, parse and validate all of the configuration files as per
+    parse_configuration(). Spread the files across a pool of worker processes if more than one job
+    is requested, as parsing is CPU-bound.
+
+    Return a tuple of two collections.OrderedDict instances, both in the order of the given
+    filenames: One mapping from each valid config filename to its parsed configuration, and the
+    other mapping from each invalid config filename to the error encountered parsing it
+    (Validation_error, or OSError if the file couldn't be read).
+
+    Record how long each file took to parse as its own "parse" profiling phase.
+
+    Raise FileNotFoundError or ruamel.yaml.error.YAMLError if the schema can't be loaded.
+    '''
+    # Load the schema up front, so that any problem with it gets raised right away rather than for
+    # every configuration file, and so that forked workers inherit the compiled validator.
+    load_validator(schema_filename)
+
+    if jobs <= 1 or len(config_filenames) <= 1:
+        results = [
+            _parse_configuration_or_error(config_filename, schema_filename, use_cache)
+            for config_filename in config_filenames
+        ]
+    else:
+        workers = min(jobs, len(config_filenames))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    _parse_configuration_or_error,
+                    config_filenames,
+                    itertools.repeat(schema_filename),
+                    itertools.repeat(use_cache),
+                    # Hand out files in batches, so that thousands of them don't mean thousands of
+                    # round trips to the workers.
+                    chunksize=max(1, len(config_filenames) // (workers * 4)),
+                )
+            )
+
+    configs = collections.OrderedDict()
+    errors = collections.OrderedDict()
+
+    for config_filename, (config, error, wall_seconds, cpu_seconds) in zip(
+        config_filenames, results
+    ):
+        profiling.record_phase('parse', wall_seconds, cpu_seconds, config_filename)
+
+        if error is None:
+            configs[config_filename] = config
+        else:
+            errors[config_filename] = error
+
+    return (configs, errors)
 
-    for error in validation_error.error_messages:
-        print(error, file=sys.stderr)
@@ -0,0 +1,249 @@
+'''
+Compile a configuration schema in pykwalify YAML schema format into plain Python checking functions,
+one per section and field. This validates configuration files much faster than pykwalify's
+general-purpose schema interpreter, while producing the same error messages. Only the subset of
+pykwalify's schema format that borgmatic's own schema uses is supported.
+'''
+
+# Keys within a schema rule that only document the rule and don't affect validation.
+DOCUMENTATION_KEYS = {'desc', 'example', 'name', 'version'}
+
+SUPPORTED_KEYS = DOCUMENTATION_KEYS | {'type', 'required', 'map', 'seq', 'enum', 'unique'}
+
+
+def _is_string(value):
+    return isinstance(value, (str, bytes))
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_bool(value):
+    return isinstance(value, bool)
+
+
+def _is_float(value):
+    if isinstance(value, bool):
+        return False
+
+    try:
+        float(value)
+    except (ValueError, TypeError):
+        return False
+
+    return True
+
+
+def _is_number(value):
+    return _is_int(value) or _is_float(value)
+
+
+def _is_text(value):
+    return (_is_string(value) or _is_number(value)) and not _is_bool(value)
+
+
+def _is_any(value):
+    return True
+
+
+def _is_scalar(value):
+    return not isinstance(value, (dict, list)) and value is not None
+
+
+# Scalar types supported in a schema, mapped to functions that check whether a value is of that type.
+TYPE_CHECKS = {
+    'str': _is_string,
+    'int': _is_int,
+    'bool': _is_bool,
+    'float': _is_float,
+    'number': _is_number,
+    'text': _is_text,
+    'any': _is_any,
+    'scalar': _is_scalar,
+}
+
+
+class Unsupported_schema_error(ValueError):
+    '''
+    Raised when a schema uses a feature of pykwalify's schema format that can't be compiled.
+    '''
+
+
+def _compile_map(rule, path_description):
+    '''
+    Given a schema rule for a mapping and a description of where it is in the schema, return a
+    function that checks a mapping value against the rule.
+    '''
+    field_checks = {
+        key: _compile_rule(field_rule, '{}/{}'.format(path_description, key))
+        for key, field_rule in rule['map'].items()
+    }
+    required_keys = tuple(
+        key for key, field_rule in rule['map'].items() if field_rule.get('required')
+    )
+
+    def check_map(value, path, errors):
+        if not isinstance(value, dict):
+            errors.append("Value '{}' is not a dict. Value path: '{}'".format(value, path))
+            return
+
+        for key in required_keys:
+            if key not in value:
+                errors.append("Cannot find required key '{}'. Path: '{}'".format(key, path))
+
+        for key, field_value in value.items():
+            field_check = field_checks.get(key)
+
+            if field_check is None:
+                errors.append("Key '{}' was not defined. Path: '{}'".format(key, path))
+                continue
+
+            field_check(field_value, '{}/{}'.format(path, key), errors)
+
+    return check_map
+
+
+def _check_unique(value, path, errors):
+    '''
+    Given a list value, its path, and a list of error messages, add an error message for each item
+    duplicating an earlier item.
+    '''
+    first_index_for_item = {}
+
+    for index, item in enumerate(value):
+        if item is None:
+            continue
+
+        try:
+            if item in first_index_for_item:
+                errors.append(
+                    "Value '{}' is not unique. Previous path: '{}/{}'. Path: '{}/{}'".format(
+                        item, path, first_index_for_item[item], path, index
+                    )
+                )
+            else:
+                first_index_for_item[item] = index
+        except TypeError:
+            # Unhashable items like lists can't be compared for uniqueness, and they'll fail type
+            # checks anyway.
+            continue
+
+
+def _compile_seq(rule, path_description):
+    '''
+    Given a schema rule for a sequence and a description of where it is in the schema, return a
+    function that checks a list value against the rule.
+    '''
+    if len(rule['seq']) != 1:
+        raise Unsupported_schema_error(
+            'Sequences must have exactly one item rule: {}'.format(path_description)
+        )
+
+    item_rule = rule['seq'][0]
+    item_check = _compile_rule(item_rule, '{}/seq'.format(path_description))
+    unique = item_rule.get('unique')
+
+    def check_seq(value, path, errors):
+        if value is None:
+            return
+
+        if not isinstance(value, list):
+            errors.append("Value '{}' is not a list. Value path: '{}'".format(value, path))
+            return
+
+        if unique:
+            _check_unique(value, path, errors)
+
+        for index, item in enumerate(value):
+            item_check(item, '{}/{}'.format(path, index), errors)
+
+    return check_seq
+
+
+def _compile_scalar(rule, path_description):
+    '''
+    Given a schema rule for a scalar and a description of where it is in the schema, return a
+    function that checks a scalar value against the rule.
+    '''
+    type_name = rule.get('type', 'str')
+    type_check = TYPE_CHECKS.get(type_name)
+    if type_check is None:
+        raise Unsupported_schema_error(
+            'Unsupported type "{}": {}'.format(type_name, path_description)
+        )
+
+    enum = rule.get('enum')
+
+    def check_scalar(value, path, errors):
+        if value is None:
+            return
+
+        if enum is not None and value not in enum:
+            errors.append("Enum '{}' does not exist. Path: '{}'".format(value, path))
+
+        if not type_check(value):
+            errors.append(
+                "Value '{}' is not of type '{}'. Path: '{}'".format(value, type_name, path)
+            )
+
+    return check_scalar
+
+
+def _compile_rule(rule, path_description):
+    '''
+    Given a single schema rule as a dict and a description of where it is in the schema, return a
+    function that checks a value against the rule. The function takes the value, the path to the
+    value within the configuration, and a list to append any error messages to.
+
+    Raise Unsupported_schema_error if the rule can't be compiled.
+    '''
+    unsupported_keys = set(rule) - SUPPORTED_KEYS
+    if unsupported_keys:
+        raise Unsupported_schema_error(
+            'Unsupported schema keys {}: {}'.format(
+                ', '.join(sorted(unsupported_keys)), path_description or '/'
+            )
+        )
+
+    if 'map' in rule:
+        check_value = _compile_map(rule, path_description)
+    elif 'seq' in rule:
+        check_value = _compile_seq(rule, path_description)
+    elif rule.get('type') in ('map', 'seq'):
+        raise Unsupported_schema_error(
+            'Missing {} rule: {}'.format(rule['type'], path_description or '/')
+        )
+    else:
+        check_value = _compile_scalar(rule, path_description)
+
+    if not rule.get('required'):
+        return check_value
+
+    def check_required(value, path, errors):
+        if value is None:
+            errors.append("required.novalue : '{}'".format(path))
+            return
+
+        check_value(value, path, errors)
+
+    return check_required
+
+
+def compile_schema(schema):
+    '''
+    Given a schema as nested dicts and lists in pykwalify YAML schema format, compile it into a
+    function that takes a parsed configuration and returns a list of validation error message
+    strings, empty if the configuration is valid.
+
+    Raise Unsupported_schema_error if the schema uses a feature that can't be compiled.
+    '''
+    check_root = _compile_rule(schema, '')
+
+    def validate(config):
+        errors = []
+        check_root(config, '', errors)
+
+        return errors
+
+    return validate
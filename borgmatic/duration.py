@@ -0,0 +1,38 @@
+import re
+
+
+SECONDS_PER_UNIT = {
+    'second': 1,
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+    'week': 7 * 24 * 60 * 60,
+    'month': 30 * 24 * 60 * 60,
+    'year': 365 * 24 * 60 * 60,
+}
+
+UNIT_ABBREVIATIONS = {'s': 'second', 'm': 'minute', 'h': 'hour', 'd': 'day', 'w': 'week', 'y': 'year'}
+
+DURATION_PATTERN = re.compile(r'^\s*(\d+)\s*([a-z]+?)s?\s*$')
+
+
+def parse_duration(duration):
+    '''
+    Given a duration as a string with a number and a unit, like "2 weeks", "1 day", or "12h", return
+    it as a number of seconds. A month is 30 days and a year is 365 days. Given an integer, treat it
+    as a number of seconds.
+
+    Raise ValueError if the duration can't be parsed.
+    '''
+    if isinstance(duration, int) and not isinstance(duration, bool):
+        return duration
+
+    match = DURATION_PATTERN.match(str(duration).lower())
+    unit = match and UNIT_ABBREVIATIONS.get(match.group(2), match.group(2))
+
+    if not match or unit not in SECONDS_PER_UNIT:
+        raise ValueError(
+            'Invalid duration "{}"; expected a number and a unit, e.g. "2 weeks"'.format(duration)
+        )
+
+    return int(match.group(1)) * SECONDS_PER_UNIT[unit]
@@ -0,0 +1,407 @@
+import contextlib
+import os
+import selectors
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from borgmatic import profiling
+
+
+# Read child output in chunks of this many bytes, and hand off any single line longer than this
+# without waiting for its end, so that memory use stays bounded no matter what a command outputs.
+READ_SIZE = 64 * 1024
+
+# Hand off a partial line of output once nothing more has arrived on its pipe for this many seconds,
+# so that prompts, which don't end with a newline, show up rather than waiting for the rest of their
+# line.
+PARTIAL_LINE_SECONDS = 0.2
+
+# Buffered output beyond this many bytes spills from memory to a temporary file.
+MAX_BUFFER_MEMORY = 1024 * 1024
+
+# After a command times out, give it this many seconds to exit after SIGTERM before killing it.
+TERMINATE_GRACE_SECONDS = 10
+
+# While waiting for a command with a timeout to exit, check on it this often.
+WAIT_POLL_SECONDS = 0.05
+
+_children = set()
+_children_lock = threading.Lock()
+_terminating = False
+_local = threading.local()
+
+
+def _start_process(full_command, **kwargs):
+    '''
+    Given a command to run as a sequence of command/argument strings and any keyword arguments for
+    subprocess.Popen, start the command and register it as a running child so that it can be
+    terminated along with its siblings. Return the subprocess.Popen instance.
+
+    Raise OSError if borgmatic is in the process of terminating, so no new children get started.
+    '''
+    with _children_lock:
+        if _terminating:
+            raise OSError('Terminating; not running: {}'.format(' '.join(full_command)))
+
+        process = subprocess.Popen(full_command, **kwargs)
+        _children.add(process)
+
+    return process
+
+
+def _read_lines(selector, key, partial_lines):
+    '''
+    Given a selector, a selector key for a readable output pipe registered with it, and a dict
+    mapping from each pipe to its partial line of output read so far, read the next chunk from the
+    pipe and pass each complete line to the key's line handler. Keep any trailing partial line for
+    next time, unless it exceeds READ_SIZE. Once the pipe hits end-of-file, flush any partial line
+    and unregister the pipe.
+    '''
+    pipe = key.fileobj
+    handle_line = key.data
+    chunk = os.read(key.fd, READ_SIZE)
+
+    if not chunk:
+        selector.unregister(pipe)
+        pipe.close()
+        if partial_lines.get(pipe):
+            handle_line(partial_lines.pop(pipe))
+        return
+
+    lines = (partial_lines.get(pipe, b'') + chunk).split(b'\n')
+    partial_lines[pipe] = lines.pop()
+
+    for line in lines:
+        handle_line(line + b'\n')
+
+    if len(partial_lines[pipe]) > READ_SIZE:
+        handle_line(partial_lines.pop(pipe))
+
+
+def _hand_off_stale_partial_lines(selector, partial_lines, partial_line_times):
+    '''
+    Given a selector, a dict mapping from each pipe to its partial line of output read so far as per
+    _read_lines(), and a dict mapping from each pipe with a partial line to the time.monotonic()
+    value when output last arrived on it, pass each partial line that has been waiting for at least
+    PARTIAL_LINE_SECONDS to its pipe's line handler. Return the number of seconds until the next
+    remaining partial line is due, or None if there are none.
+    '''
+    now = time.monotonic()
+    next_due = None
+
+    for pipe, arrival_time in tuple(partial_line_times.items()):
+        due = arrival_time + PARTIAL_LINE_SECONDS - now
+
+        if due <= 0:
+            del partial_line_times[pipe]
+            selector.get_key(pipe).data(partial_lines.pop(pipe))
+        elif next_due is None or due < next_due:
+            next_due = due
+
+    return next_due
+
+
+def _remaining_time(deadline):
+    '''
+    Given a deadline as a time.monotonic() value or None, return the number of seconds until then or
+    None if there is no deadline. Never return a negative value.
+    '''
+    if deadline is None:
+        return None
+
+    return max(deadline - time.monotonic(), 0)
+
+
+def _stop_processes(processes):
+    '''
+    Given a sequence of subprocess.Popen instances, terminate any that are still running, and kill
+    any that don't exit within TERMINATE_GRACE_SECONDS.
+    '''
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+
+    for process in processes:
+        try:
+            process.wait(timeout=TERMINATE_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def _wait_for_process(process, deadline, timeout):
+    '''
+    Given a subprocess.Popen instance, a deadline as a time.monotonic() value or None, and the
+    original timeout in seconds that the deadline is based on, wait for the process to exit and set
+    its returncode. Reap it with os.wait4() so that its resource usage
+    can be recorded in the profile of the current phase.
+
+    Raise subprocess.TimeoutExpired if the process is still running at the deadline.
+    '''
+    while True:
+        try:
+            (pid, status, rusage) = os.wait4(process.pid, 0 if deadline is None else os.WNOHANG)
+        except ChildProcessError:
+            # Something else already reaped the process, so fall back to Popen's own bookkeeping.
+            process.wait()
+            return
+
+        if pid:
+            break
+
+        remaining = _remaining_time(deadline)
+        if remaining == 0:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+
+        time.sleep(min(remaining, WAIT_POLL_SECONDS))
+
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    profiling.record_child_usage(rusage)
+
+
+def supervise_processes(process_handlers, timeout=None):
+    '''
+    Given a dict mapping from started subprocess.Popen instances to their output line handlers, run
+    a single event loop that streams output from all of the processes at once until they exit. Each
+    process' handlers are a dict mapping from one of its piped output files (like process.stdout) to
+    a function to call with each line of output, as bytes including the trailing newline. A partial
+    line that stays without its newline for PARTIAL_LINE_SECONDS, like a prompt, is passed on as is.
+    Processes may also have no piped output at all.
+
+    Once all processes have exited, unregister them as running children. If a timeout in seconds is
+    given and the processes haven't all finished by then, stop them and raise
+    subprocess.TimeoutExpired. Otherwise, raise subprocess.CalledProcessError for the first process
+    that exits with a non-zero status.
+
+    The loop runs in the calling thread. The execute_*() functions below each supervise their one
+    command this way, so commands only run concurrently when called from different threads, like
+    the worker threads of scheduler.run_actions().
+    '''
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    selector = selectors.DefaultSelector()
+    partial_lines = {}
+    partial_line_times = {}
+
+    for handlers in process_handlers.values():
+        for pipe, handle_line in handlers.items():
+            selector.register(pipe, selectors.EVENT_READ, handle_line)
+
+    try:
+        while selector.get_map():
+            remaining = _remaining_time(deadline)
+            if remaining == 0:
+                raise subprocess.TimeoutExpired(
+                    [process.args for process in process_handlers], timeout
+                )
+
+            partial_line_due = _hand_off_stale_partial_lines(
+                selector, partial_lines, partial_line_times
+            )
+            if partial_line_due is not None and (remaining is None or partial_line_due < remaining):
+                remaining = partial_line_due
+
+            for (key, events) in selector.select(remaining):
+                _read_lines(selector, key, partial_lines)
+
+                if partial_lines.get(key.fileobj):
+                    partial_line_times[key.fileobj] = time.monotonic()
+                else:
+                    partial_line_times.pop(key.fileobj, None)
+
+        for process in process_handlers:
+            _wait_for_process(process, deadline, timeout)
+    except BaseException:
+        _stop_processes(process_handlers)
+        raise
+    finally:
+        selector.close()
+
+        with _children_lock:
+            _children.difference_update(process_handlers)
+
+    for process in process_handlers:
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+def _output_buffer():
+    '''
+    Return the output buffer for the current thread as set by buffered_output(), or None if output
+    isn't being buffered.
+    '''
+    return getattr(_local, 'output_buffer', None)
+
+
+@contextlib.contextmanager
+def buffered_output():
+    '''
+    Within this context, collect the terminal output of any commands executed by the current thread
+    into a buffer instead of writing it directly to the terminal. This prevents the output of
+    commands running concurrently in different threads from interleaving. The buffer is held in
+    memory up to MAX_BUFFER_MEMORY bytes, and spills to a temporary file beyond that.
+
+    Yield the buffer, a binary file object. Once the context exits, the buffer is rewound so that
+    it's ready for passing to copy_output(). The caller is responsible for closing it.
+    '''
+    previous_buffer = _output_buffer()
+    _local.output_buffer = tempfile.SpooledTemporaryFile(max_size=MAX_BUFFER_MEMORY)
+
+    try:
+        yield _local.output_buffer
+    finally:
+        _local.output_buffer.seek(0)
+        _local.output_buffer = previous_buffer
+
+
+def output_is_buffered():
+    '''
+    Return whether output for the current thread is being buffered as per buffered_output().
+    '''
+    return _output_buffer() is not None
+
+
+def write_output(output):
+    '''
+    Given bytes of output, write them to the current thread's output buffer if it has one, or to
+    stdout otherwise.
+    '''
+    output_buffer = _output_buffer()
+
+    if output_buffer is not None:
+        output_buffer.write(output)
+        return
+
+    sys.stdout.flush()
+    sys.stdout.buffer.write(output)
+    sys.stdout.buffer.flush()
+
+
+def copy_output(output_file):
+    '''
+    Given a binary file object as yielded by buffered_output(), copy its contents in chunks to the
+    current thread's output buffer if it has one, or to stdout otherwise.
+    '''
+    output_buffer = _output_buffer()
+
+    if output_buffer is not None:
+        shutil.copyfileobj(output_file, output_buffer)
+        return
+
+    sys.stdout.flush()
+    shutil.copyfileobj(output_file, sys.stdout.buffer)
+    sys.stdout.buffer.flush()
+
+
+def _make_environment(extra_environment):
+    '''
+    Given a dict of extra environment variables, return a complete environment dict for a child
+    process consisting of borgmatic's own environment plus those variables. Return None if there are
+    no extra variables, meaning that the child should simply inherit borgmatic's environment.
+    '''
+    if not extra_environment:
+        return None
+
+    environment = dict(os.environ)
+    environment.update(extra_environment)
+
+    return environment
+
+
+def execute_command(full_command, output_file=None, extra_environment=None, timeout=None):
+    '''
+    Given a command to run as a sequence of command/argument strings, execute it and wait for it to
+    finish. If an output file object is given, send the command's stdout and stderr there.
+    Otherwise, send them to the terminal, or stream them line by line into the current thread's
+    output buffer if there is one. If a dict of extra environment variables is given, set them for
+    the command only.
+
+    Raise subprocess.TimeoutExpired if a timeout in seconds is given and the command takes longer
+    than that, or subprocess.CalledProcessError if the command exits with a non-zero status.
+    '''
+    environment = _make_environment(extra_environment)
+
+    if output_file is not None:
+        process = _start_process(
+            full_command, stdout=output_file, stderr=subprocess.STDOUT, env=environment
+        )
+        supervise_processes({process: {}}, timeout)
+        return
+
+    if _output_buffer() is None:
+        process = _start_process(full_command, env=environment)
+        supervise_processes({process: {}}, timeout)
+        return
+
+    process = _start_process(
+        full_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=environment
+    )
+    supervise_processes({process: {process.stdout: write_output}}, timeout)
+
+
+def execute_command_and_stream_output(
+    full_command, handle_output_line, extra_environment=None, timeout=None, handle_stderr_line=None
+):
+    '''
+    Given a command to run as a sequence of command/argument strings and a function to handle lines
+    of output, execute the command, pass each line of its stdout as bytes to the function as it's
+    read, and wait for the command to finish. Send its stderr to the terminal, or stream it line by
+    line into the current thread's output buffer if there is one. If a dict of extra environment
+    variables is given, set them for the command only. If a stderr line handler function is given,
+    pass each line of stderr as bytes to it instead.
+
+    Raise subprocess.TimeoutExpired if a timeout in seconds is given and the command takes longer
+    than that, or subprocess.CalledProcessError if the command exits with a non-zero status.
+    '''
+    pipe_stderr = handle_stderr_line is not None or _output_buffer() is not None
+    process = _start_process(
+        full_command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE if pipe_stderr else None,
+        env=_make_environment(extra_environment),
+    )
+
+    handlers = {process.stdout: handle_output_line}
+    if pipe_stderr:
+        handlers[process.stderr] = handle_stderr_line or write_output
+
+    supervise_processes({process: handlers}, timeout)
+
+
+def execute_command_and_capture_output(
+    full_command, extra_environment=None, timeout=None, handle_stderr_line=None
+):
+    '''
+    Given a command to run as a sequence of command/argument strings, execute it, wait for it to
+    finish, and return its stdout as bytes. Otherwise behave as per
+    execute_command_and_stream_output().
+    '''
+    output_lines = []
+    execute_command_and_stream_output(
+        full_command, output_lines.append, extra_environment, timeout, handle_stderr_line
+    )
+
+    return b''.join(output_lines)
+
+
+def terminate_children(signal_number=signal.SIGTERM):
+    '''
+    Send the given signal to all running child processes started by this module, and refuse to
+    start any further children. This allows borgmatic to shut down cleanly even when several
+    commands are running concurrently.
+    '''
+    global _terminating
+
+    with _children_lock:
+        _terminating = True
+        children = tuple(_children)
+
+    for process in children:
+        try:
+            process.send_signal(signal_number)
+        except OSError:  # pragma: no cover
+            pass
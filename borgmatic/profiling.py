@@ -0,0 +1,223 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+# Per-thread CPU time where available, so that concurrent phases don't count each other's CPU use.
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+_enabled = False
+_records = []
+_records_lock = threading.Lock()
+_local = threading.local()
+_python_profiler = None
+
+TABLE_COLUMNS = (
+    ('phase', 'Phase', '{}'),
+    ('config_filename', 'Configuration', '{}'),
+    ('repository', 'Repository', '{}'),
+    ('wall_seconds', 'Wall', '{:.3f}s'),
+    ('cpu_seconds', 'CPU', '{:.3f}s'),
+    ('child_user_seconds', 'Child user', '{:.3f}s'),
+    ('child_system_seconds', 'Child sys', '{:.3f}s'),
+)
+
+
+def enable(python=False):
+    '''
+    Start recording phase timings. If python is True, additionally profile borgmatic's own Python
+    code with cProfile and trace its memory allocations with tracemalloc.
+
+    Note that cProfile only profiles the calling thread, so code run in worker threads (with --jobs
+    or repository_jobs) shows up in phase timings but not in the Python profile.
+    '''
+    global _enabled, _python_profiler
+
+    _enabled = True
+
+    if python:
+        import cProfile
+        import tracemalloc
+
+        tracemalloc.start()
+        _python_profiler = cProfile.Profile()
+        _python_profiler.enable()
+
+
+def _active_records():
+    '''
+    Return the stack of phase records currently being timed in this thread.
+    '''
+    if not hasattr(_local, 'active_records'):
+        _local.active_records = []
+
+    return _local.active_records
+
+
+def _new_record(name, config_filename, repository):
+    '''
+    Given a phase name, config filename, and repository, return a new phase record without any
+    timings.
+    '''
+    return {
+        'phase': name,
+        'config_filename': config_filename,
+        'repository': repository,
+        'child_user_seconds': 0.0,
+        'child_system_seconds': 0.0,
+        'child_max_rss_kilobytes': 0,
+    }
+
+
+@contextlib.contextmanager
+def phase(name, config_filename=None, repository=None):
+    '''
+    Within this context, record the wall time and CPU time used by a named phase of the borgmatic
+    run, along with the resource usage of any child processes that finish during it. Label the
+    record with the given config filename and repository. If either isn't given, inherit it from the
+    enclosing phase in the current thread, if any. If profiling isn't enabled, do nothing.
+    '''
+    if not _enabled:
+        yield
+        return
+
+    active_records = _active_records()
+    if active_records:
+        config_filename = config_filename or active_records[-1]['config_filename']
+        repository = repository or active_records[-1]['repository']
+
+    record = _new_record(name, config_filename, repository)
+    active_records.append(record)
+    start_wall = time.monotonic()
+    start_cpu = _cpu_time()
+
+    try:
+        yield
+    finally:
+        record['wall_seconds'] = time.monotonic() - start_wall
+        record['cpu_seconds'] = _cpu_time() - start_cpu
+        active_records.remove(record)
+
+        with _records_lock:
+            _records.append(record)
+
+
+def record_phase(name, wall_seconds, cpu_seconds, config_filename=None, repository=None):
+    '''
+    Given the name of a phase that was timed elsewhere, like in a worker process, its wall time and
+    CPU time in seconds, and the config filename and repository to label it with, record it along
+    with the phases timed by phase(). If profiling isn't enabled, do nothing.
+    '''
+    if not _enabled:
+        return
+
+    record = _new_record(name, config_filename, repository)
+    record['wall_seconds'] = wall_seconds
+    record['cpu_seconds'] = cpu_seconds
+
+    with _records_lock:
+        _records.append(record)
+
+
+def wrap(function, name, config_filename=None, repository=None):
+    '''
+    Given a function, return a version of it that records its calls as a phase with the given name,
+    config filename, and repository.
+    '''
+    @functools.wraps(function)
+    def profiled_function(*args, **kwargs):
+        with phase(name, config_filename, repository):
+            return function(*args, **kwargs)
+
+    return profiled_function
+
+
+def record_child_usage(rusage):
+    '''
+    Given a resource.struct_rusage for a child process that just finished, as returned by
+    os.wait4(), add its CPU time and peak memory to each phase active in the current thread.
+    '''
+    for record in _active_records():
+        record['child_user_seconds'] += rusage.ru_utime
+        record['child_system_seconds'] += rusage.ru_stime
+        record['child_max_rss_kilobytes'] = max(record['child_max_rss_kilobytes'], rusage.ru_maxrss)
+
+
+def _stop_python_profiling(summary_filename):
+    '''
+    Stop any Python profiling, dump the cProfile statistics to the given summary filename with
+    ".pstats" appended, and return a dict summarizing tracemalloc results. Return None if Python
+    profiling isn't enabled.
+    '''
+    global _python_profiler
+
+    if _python_profiler is None:
+        return None
+
+    import tracemalloc
+
+    _python_profiler.disable()
+    pstats_filename = '{}.pstats'.format(summary_filename)
+    _python_profiler.dump_stats(pstats_filename)
+    _python_profiler = None
+
+    (current_memory, peak_memory) = tracemalloc.get_traced_memory()
+    top_allocations = tracemalloc.take_snapshot().statistics('lineno')[:10]
+    tracemalloc.stop()
+
+    return {
+        'pstats_filename': pstats_filename,
+        'peak_memory_bytes': peak_memory,
+        'top_allocations': [
+            {'location': str(statistic.traceback), 'size_bytes': statistic.size, 'count': statistic.count}
+            for statistic in top_allocations
+        ],
+    }
+
+
+def summarize(summary_filename):
+    '''
+    Given a filename to write to, stop profiling and return a summary dict of the recorded phases in
+    the order that they finished, plus Python profiling results if enabled.
+    '''
+    with _records_lock:
+        records = list(_records)
+
+    return {
+        'phases': records,
+        'python': _stop_python_profiling(summary_filename),
+    }
+
+
+def write_summary(summary, summary_filename):
+    '''
+    Given a summary dict as returned by summarize() and a filename, write the summary there as JSON.
+    The file is only readable by the current user, since it may contain repository paths.
+    '''
+    descriptor = os.open(summary_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+    with os.fdopen(descriptor, 'w') as summary_file:
+        json.dump(summary, summary_file, indent=4, sort_keys=True)
+
+
+def format_table(summary):
+    '''
+    Given a summary dict as returned by summarize(), return a human-readable table of its phase
+    timings as a string.
+    '''
+    rows = [tuple(heading for (key, heading, value_format) in TABLE_COLUMNS)] + [
+        tuple(
+            value_format.format(record[key]) if record[key] is not None else '-'
+            for (key, heading, value_format) in TABLE_COLUMNS
+        )
+        for record in summary['phases']
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(TABLE_COLUMNS))]
+
+    return '\n'.join(
+        '  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
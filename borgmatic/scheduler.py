@@ -0,0 +1,172 @@
+import collections
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from subprocess import CalledProcessError, TimeoutExpired
+
+from borgmatic import execute
+
+
+Action = collections.namedtuple('Action', ('name', 'lock', 'function', 'shared_locks'))
+Action.__new__.__defaults__ = ((),)
+Action.__doc__ = '''
+A single unit of work to schedule, like creating an archive in a particular repository. "name" is
+the kind of action (e.g. "create"), "lock" is the resource that the action needs exclusive access
+to while it runs (e.g. a repository path), and "function" is a callable taking no arguments that
+performs the action. "shared_locks" is an optional sequence of further resources that the action
+needs exclusive access to, like the repositories that a configuration file backs up to, which
+unlike "lock" don't group the action's output or identify it in errors.
+'''
+
+# Ready actions start in this order, so that for instance all of the creates get their fresh data
+# into repositories before any of the slower maintenance actions run. Actions not listed here start
+# before any listed ones.
+ACTION_PRIORITIES = {
+    'create': 1,
+    'prune': 2,
+    'check': 3,
+}
+
+
+def _make_dependencies(actions):
+    '''
+    Given a sequence of Action instances, return a dict mapping from the index of each action to
+    a sorted tuple of the indices of the actions it depends on.
+
+    Actions that share a lock, including shared locks, must run one at a time in the given order,
+    so each action depends on the closest preceding action with each of its locks.
+    '''
+    dependencies = {}
+    last_index_for_lock = {}
+
+    for index, action in enumerate(actions):
+        locks = set((action.lock,) + tuple(action.shared_locks))
+        dependencies[index] = tuple(
+            sorted(
+                set(last_index_for_lock[lock] for lock in locks if lock in last_index_for_lock)
+            )
+        )
+
+        for lock in locks:
+            last_index_for_lock[lock] = index
+
+    return dependencies
+
+
+def _order_ready(indices, actions):
+    '''
+    Given a collection of indices of actions that are ready to run and the sequence of all actions,
+    return the indices sorted in the order the actions should start: by action priority, and then
+    by original order.
+    '''
+    return sorted(
+        indices,
+        key=lambda index: (ACTION_PRIORITIES.get(actions[index].name, 0), index),
+    )
+
+
+def _run_buffered(action):
+    '''
+    Given an Action, run it while buffering all command output. Return a tuple of the output buffer
+    (a binary file object) and the error raised (or None if the action succeeded).
+    '''
+    with execute.buffered_output() as output_buffer:
+        try:
+            action.function()
+        except (ValueError, OSError, CalledProcessError, TimeoutExpired) as error:
+            return (output_buffer, error)
+
+    return (output_buffer, None)
+
+
+def run_actions(actions, jobs):
+    '''
+    Given a sequence of Action instances and a maximum number of actions to run at once, run the
+    actions as a dependency graph: Actions sharing a lock or a shared lock run one at a time in the
+    given order, while actions without any locks in common are independent and may run
+    concurrently. Whenever there is room within the jobs budget, the ready action with the highest
+    priority per ACTION_PRIORITIES starts next.
+
+    If jobs is one, run the actions in scheduled order in the current thread, and let any error
+    propagate immediately.
+
+    Otherwise, run the actions in a pool of worker threads, one per running action. The Borg
+    commands that an action runs block its thread while they run. Each lock's output is buffered and
+    displayed together, in the order that the locks first appear in the actions, as soon as all of
+    that lock's actions and those of every earlier lock finish. If an action fails, skip the
+    actions depending on it but continue running independent actions. Once everything is done,
+    raise ValueError summarizing any failures.
+    '''
+    dependencies = _make_dependencies(actions)
+    dependents = collections.defaultdict(list)
+    for index, index_dependencies in dependencies.items():
+        for dependency in index_dependencies:
+            dependents[dependency].append(index)
+
+    unfinished_dependencies = {
+        index: len(index_dependencies) for index, index_dependencies in dependencies.items()
+    }
+    ready = [index for index, count in unfinished_dependencies.items() if count == 0]
+    finished = set()
+
+    def release_dependents(index):
+        for dependent in dependents[index]:
+            unfinished_dependencies[dependent] -= 1
+            if unfinished_dependencies[dependent] == 0 and dependent not in finished:
+                ready.append(dependent)
+
+    if jobs <= 1:
+        while ready:
+            index = _order_ready(ready, actions)[0]
+            ready.remove(index)
+            actions[index].function()
+            release_dependents(index)
+        return
+
+    remaining_for_lock = collections.Counter(action.lock for action in actions)
+    output_for_lock = collections.defaultdict(list)
+    unwritten_locks = collections.deque(collections.OrderedDict.fromkeys(
+        action.lock for action in actions
+    ))
+    errors = []
+
+    def write_finished_output():
+        while unwritten_locks and remaining_for_lock[unwritten_locks[0]] == 0:
+            for output_buffer in output_for_lock.pop(unwritten_locks.popleft(), ()):
+                execute.copy_output(output_buffer)
+                output_buffer.close()
+
+    def finish(index, output, error, skipped=False):
+        action = actions[index]
+        finished.add(index)
+        if output:
+            output_for_lock[action.lock].append(output)
+        remaining_for_lock[action.lock] -= 1
+
+        if error:
+            errors.append('Error running {} for {}: {}'.format(action.name, action.lock, error))
+
+        if remaining_for_lock[action.lock] == 0:
+            write_finished_output()
+
+        if error or skipped:
+            for skipped_index in dependents[index]:
+                if skipped_index not in finished:
+                    finish(skipped_index, None, None, skipped=True)
+        else:
+            release_dependents(index)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {}
+
+        while ready or running:
+            for index in _order_ready(ready, actions)[:jobs - len(running)]:
+                ready.remove(index)
+                running[executor.submit(_run_buffered, actions[index])] = index
+
+            (done, not_done) = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                (output, error) = future.result()
+                finish(running.pop(future), output, error)
+
+    if errors:
+        raise ValueError('\n'.join(errors))
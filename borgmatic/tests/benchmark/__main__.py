@@ -0,0 +1,4 @@
+from borgmatic.tests.benchmark.benchmark import main
+
+
+main()
@@ -0,0 +1,451 @@
+'''
+End-to-end benchmarks for borgmatic's own overhead, run against synthetic configuration files and a
+fake borg executable. Run them with:
+
+    python -m borgmatic.tests.benchmark --output results.json
+
+Then compare the results of two commits with:
+
+    python -m borgmatic.tests.benchmark --output new.json --compare old.json
+'''
+from argparse import ArgumentParser
+import json
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from flexmock import flexmock
+
+from borgmatic.borg import create
+from borgmatic.config import collect, validate
+
+
+CONFIG_SCALES = (1, 100, 5000, 10000)
+PARSE_SCALES = (1, 100)
+MAIN_SCALES = (1, 100)
+SOURCE_DIRECTORY_SCALES = (10, 1000)
+EXCLUDE_PATTERN_SCALES = (10, 10000)
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+
+def install_fake_borg(bin_directory):
+    '''
+    Given a directory, write an executable named "borg" there that runs the fake Borg script. Return
+    the path to the executable.
+    '''
+    borg_path = os.path.join(bin_directory, 'borg')
+
+    with open(borg_path, 'w') as borg_file:
+        borg_file.write(
+            '#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(
+                sys.executable, os.path.join(os.path.dirname(__file__), 'fake_borg.py')
+            )
+        )
+
+    os.chmod(borg_path, os.stat(borg_path).st_mode | stat.S_IXUSR)
+
+    return borg_path
+
+
+def make_source_tree(root_directory, directory_count, files_per_directory=2):
+    '''
+    Given a root directory, create the given number of source directories within it, each with a
+    "data" subdirectory containing a few files. Return a source directory glob pattern that matches
+    all of the data files.
+    '''
+    for directory_number in range(directory_count):
+        data_directory = os.path.join(root_directory, 'dir{}'.format(directory_number), 'data')
+        os.makedirs(data_directory)
+
+        for file_number in range(files_per_directory):
+            open(os.path.join(data_directory, 'file{}'.format(file_number)), 'w').close()
+
+    return os.path.join(root_directory, '*', 'data', '*')
+
+
+def listdir_collect_config_filenames(config_paths):
+    '''
+    The original os.listdir()-based implementation of collect.collect_config_filenames(), kept as a
+    baseline to benchmark against.
+    '''
+    for path in config_paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for filename in os.listdir(path):
+            full_filename = os.path.join(path, filename)
+            if not os.path.isdir(full_filename):
+                yield full_filename
+
+
+def make_exclude_patterns(pattern_count):
+    '''
+    Given a number of patterns, return a list of that many distinct exclude patterns, mixing plain
+    paths and wildcards.
+    '''
+    return [
+        '/home/*/.cache/{}'.format(number) if number % 2 else '/var/tmp/{}'.format(number)
+        for number in range(pattern_count)
+    ]
+
+
+def write_config(config_filename, source_directories, exclude_patterns, repository):
+    '''
+    Given a config filename to write, a list of source directories, a list of exclude patterns, and
+    a repository path, write a borgmatic YAML configuration file.
+    '''
+    def format_list(values):
+        return ''.join('\n        - "{}"'.format(value) for value in values) or ' []'
+
+    with open(config_filename, 'w') as config_file:
+        config_file.write(
+            '''location:
+    source_directories:{}
+    repositories:
+        - "{}"
+    exclude_patterns:{}
+retention:
+    keep_daily: 7
+consistency:
+    checks:
+        - repository
+'''.format(
+                format_list(source_directories), repository, format_list(exclude_patterns)
+            )
+        )
+
+
+def make_config_directory(directory, config_count, source_directories, exclude_patterns=()):
+    '''
+    Given a directory to create, a number of config files, a list of source directories, and a list
+    of exclude patterns, create the directory and write that many config files to it. Return the
+    directory.
+    '''
+    os.makedirs(directory)
+
+    for config_number in range(config_count):
+        write_config(
+            os.path.join(directory, 'config{}.yaml'.format(config_number)),
+            source_directories,
+            exclude_patterns,
+            'repo{}.borg'.format(config_number),
+        )
+
+    return directory
+
+
+def measure(function):
+    '''
+    Given a function taking no arguments, call it and return a tuple of the elapsed wall time in
+    seconds and the peak Python memory allocated during the call in bytes.
+    '''
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    try:
+        function()
+        elapsed = time.perf_counter() - start
+        (current_memory, peak_memory) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return (elapsed, peak_memory)
+
+
+def run_import():
+    '''
+    Import borgmatic's command in a separate process, so that none of its modules are imported yet.
+    Return a tuple of the elapsed wall time of the import in seconds and the peak Python memory
+    allocated during it in bytes.
+    '''
+    output = subprocess.check_output(
+        (
+            sys.executable,
+            '-c',
+            'import time, tracemalloc; tracemalloc.start(); start = time.perf_counter(); '
+            'import borgmatic.commands.borgmatic; '
+            'print(time.perf_counter() - start, tracemalloc.get_traced_memory()[1])',
+        ),
+        env=dict(os.environ, PYTHONPATH=PACKAGE_ROOT),
+    )
+    (elapsed, peak_memory) = output.decode().split()
+
+    return (float(elapsed), int(peak_memory))
+
+
+def run_main(config_directory, bin_directory, cache_directory, latency=0, output_lines=0):
+    '''
+    Given a config directory, a directory containing the fake borg, a directory for borgmatic's
+    caches, a fake Borg latency in seconds, and a number of lines of fake Borg output, run
+    borgmatic's main() in a separate process against the config directory. Return a tuple of the elapsed wall time in seconds and the peak resident
+    memory of the borgmatic process in bytes.
+    '''
+    environment = dict(
+        os.environ,
+        PATH=os.pathsep.join((bin_directory, os.environ.get('PATH', ''))),
+        PYTHONPATH=PACKAGE_ROOT,
+        XDG_CACHE_HOME=cache_directory,
+        FAKE_BORG_LATENCY=str(latency),
+        FAKE_BORG_OUTPUT_LINES=str(output_lines),
+    )
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        (
+            sys.executable,
+            '-c',
+            'import sys; from borgmatic.commands.borgmatic import main; sys.argv[0] = "borgmatic"; main()',
+            '--config',
+            config_directory,
+        ),
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    (pid, status, rusage) = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS.
+    peak_memory = rusage.ru_maxrss * (1 if platform.system() == 'Darwin' else 1024)
+
+    return (elapsed, peak_memory)
+
+
+def _result(name, scale, elapsed, peak_memory):
+    return {
+        'name': name,
+        'scale': scale,
+        'seconds': elapsed,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run_benchmarks(
+    work_directory,
+    config_scales=CONFIG_SCALES,
+    parse_scales=PARSE_SCALES,
+    main_scales=MAIN_SCALES,
+    source_directory_scales=SOURCE_DIRECTORY_SCALES,
+    exclude_pattern_scales=EXCLUDE_PATTERN_SCALES,
+    latency=0,
+    output_lines=0,
+):
+    '''
+    Given an empty work directory and the scales at which to run each benchmark, run all of the
+    benchmarks and return a list of result dicts, one per benchmark and scale.
+    '''
+    results = []
+    bin_directory = os.path.join(work_directory, 'bin')
+    os.makedirs(bin_directory)
+    install_fake_borg(bin_directory)
+    source_pattern = make_source_tree(os.path.join(work_directory, 'source'), 10)
+    schema_filename = validate.schema_filename()
+
+    results.append(_result('import', 1, *run_import()))
+
+    for scale in sorted(set(config_scales) | set(parse_scales) | set(main_scales)):
+        config_directory = make_config_directory(
+            os.path.join(work_directory, 'configs{}'.format(scale)), scale, [source_pattern]
+        )
+
+        if scale in config_scales:
+            results.append(
+                _result(
+                    'collect_config_filenames',
+                    scale,
+                    *measure(lambda: tuple(collect.collect_config_filenames([config_directory])))
+                )
+            )
+            results.append(
+                _result(
+                    'listdir_collect_config_filenames',
+                    scale,
+                    *measure(lambda: tuple(listdir_collect_config_filenames([config_directory])))
+                )
+            )
+
+        if scale in parse_scales:
+            config_filenames = tuple(collect.collect_config_filenames([config_directory]))
+            results.append(
+                _result(
+                    'parse_configuration',
+                    scale,
+                    *measure(
+                        lambda: [
+                            validate.parse_configuration(config_filename, schema_filename)
+                            for config_filename in config_filenames
+                        ]
+                    )
+                )
+            )
+
+        if scale in main_scales:
+            results.append(
+                _result(
+                    'main',
+                    scale,
+                    *run_main(
+                        config_directory,
+                        bin_directory,
+                        os.path.join(work_directory, 'cache'),
+                        latency,
+                        output_lines,
+                    )
+                )
+            )
+
+    # Measure building the Borg create command without actually running anything.
+    flexmock(create.execute).should_receive('execute_command')
+    flexmock(create.version).should_receive('supports_json').and_return(False)
+
+    for scale in source_directory_scales:
+        source_pattern = make_source_tree(
+            os.path.join(work_directory, 'sources{}'.format(scale)), scale
+        )
+        results.append(
+            _result(
+                'create_archive_source_globs',
+                scale,
+                *measure(
+                    lambda: create.create_archive(
+                        None, 'repo', {'source_directories': [source_pattern]}, {}
+                    )
+                )
+            )
+        )
+
+    for scale in exclude_pattern_scales:
+        exclude_patterns = make_exclude_patterns(scale)
+        results.append(
+            _result(
+                'create_archive_exclude_patterns',
+                scale,
+                *measure(
+                    lambda: create.create_archive(
+                        None,
+                        'repo',
+                        {'source_directories': ['/etc'], 'exclude_patterns': exclude_patterns},
+                        {},
+                    )
+                )
+            )
+        )
+
+    return results
+
+
+def compare(results, baseline_results):
+    '''
+    Given a list of result dicts and a list of baseline result dicts to compare them against, return
+    a human-readable table of the time and memory of each benchmark relative to the baseline.
+    '''
+    baseline = {(result['name'], result['scale']): result for result in baseline_results}
+    lines = []
+
+    for result in results:
+        base = baseline.get((result['name'], result['scale']))
+        if not base:
+            continue
+
+        lines.append(
+            '{:<35} {:>6} {:>10.4f}s {:>7.2f}x {:>10.1f}MB {:>7.2f}x'.format(
+                result['name'],
+                result['scale'],
+                result['seconds'],
+                result['seconds'] / base['seconds'] if base['seconds'] else 0,
+                result['peak_memory_bytes'] / 1e6,
+                result['peak_memory_bytes'] / base['peak_memory_bytes']
+                if base['peak_memory_bytes']
+                else 0,
+            )
+        )
+
+    return '\n'.join(lines)
+
+
+def parse_arguments(*arguments):
+    '''
+    Given command-line arguments with which this script was invoked, parse the arguments and return
+    them as an ArgumentParser instance.
+    '''
+    parser = ArgumentParser(description='Benchmark borgmatic\'s own overhead with a fake Borg.')
+    parser.add_argument(
+        '-o', '--output',
+        dest='output_filename',
+        required=True,
+        help='JSON file to write benchmark results to',
+    )
+    parser.add_argument(
+        '--compare',
+        dest='baseline_filename',
+        help='JSON results file from a previous run to compare against',
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='Run parsing and full borgmatic runs at every config scale, including {} files'.format(
+            max(CONFIG_SCALES)
+        ),
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0,
+        help='Seconds that each fake Borg command takes, defaults to 0',
+    )
+    parser.add_argument(
+        '--output-lines',
+        type=int,
+        default=0,
+        help='Lines of output that each fake Borg command writes, defaults to 0',
+    )
+
+    return parser.parse_args(arguments)
+
+
+def main():  # pragma: no cover
+    args = parse_arguments(*sys.argv[1:])
+    work_directory = tempfile.mkdtemp(prefix='borgmatic-benchmark-')
+
+    try:
+        results = run_benchmarks(
+            work_directory,
+            parse_scales=CONFIG_SCALES if args.full else PARSE_SCALES,
+            main_scales=CONFIG_SCALES if args.full else MAIN_SCALES,
+            latency=args.latency,
+            output_lines=args.output_lines,
+        )
+    finally:
+        shutil.rmtree(work_directory)
+
+    with open(args.output_filename, 'w') as output_file:
+        json.dump(
+            {'python_version': platform.python_version(), 'results': results},
+            output_file,
+            indent=4,
+        )
+
+    for result in results:
+        print(
+            '{:<35} {:>6} {:>10.4f}s {:>10.1f}MB'.format(
+                result['name'], result['scale'], result['seconds'], result['peak_memory_bytes'] / 1e6
+            )
+        )
+
+    if args.baseline_filename:
+        with open(args.baseline_filename) as baseline_file:
+            baseline_results = json.load(baseline_file)['results']
+
+        print('\nCompared to {}:'.format(args.baseline_filename))
+        print(compare(results, baseline_results))
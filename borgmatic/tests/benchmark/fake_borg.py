@@ -0,0 +1,61 @@
+'''
+A stand-in for the borg executable, installed on the PATH by the benchmarks so that borgmatic's own
+overhead can be measured without a real Borg or repository. Its behavior is controlled by
+environment variables:
+
+    FAKE_BORG_LATENCY: seconds to sleep before exiting, simulating Borg's own work (default: 0)
+    FAKE_BORG_OUTPUT_LINES: number of lines of output to write to stderr (default: 0)
+'''
+import json
+import os
+import sys
+import time
+
+
+REPOSITORY = {'last_modified': '2018-01-01T00:00:00.000000'}
+ARCHIVE = {'name': 'archive', 'start': '2018-01-01T00:00:00.000000', 'id': '0' * 64}
+
+
+def main():
+    arguments = sys.argv[1:]
+
+    if arguments == ['--version']:
+        print('borg 1.1.2')
+        return
+
+    for line_number in range(int(os.environ.get('FAKE_BORG_OUTPUT_LINES', 0))):
+        sys.stderr.write('fake borg output line {}\n'.format(line_number))
+
+    time.sleep(float(os.environ.get('FAKE_BORG_LATENCY', 0)))
+
+    if arguments[:1] == ['create'] and '--json' in arguments:
+        json.dump(
+            {
+                'repository': REPOSITORY,
+                'archive': dict(
+                    ARCHIVE,
+                    duration=0.0,
+                    stats={
+                        'original_size': 0,
+                        'compressed_size': 0,
+                        'deduplicated_size': 0,
+                        'nfiles': 0,
+                    },
+                ),
+            },
+            sys.stdout,
+        )
+    elif arguments[:1] == ['prune'] and '--list' in arguments:
+        sys.stderr.write(
+            'Keeping archive: {name:<36} Mon, 2018-01-01 00:00:00 [{id}]\n'.format(**ARCHIVE)
+        )
+    elif arguments[:1] == ['info'] and '--json' in arguments:
+        json.dump({'repository': REPOSITORY}, sys.stdout)
+    elif arguments[:1] == ['list'] and '--json' in arguments:
+        json.dump({'repository': REPOSITORY, 'archives': [ARCHIVE]}, sys.stdout)
+    elif arguments[:1] == ['list']:
+        print('archive')
+
+
+if __name__ == '__main__':
+    main()
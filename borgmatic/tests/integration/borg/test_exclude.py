@@ -0,0 +1,73 @@
+from borgmatic.borg import exclude as module
+
+
+def test_skip_excluded_directories_drops_excluded_and_tagged_directories(tmpdir):
+    for path in ('var/cache/file', 'var/lib/file', 'home/user/.nobackup', 'srv/CACHEDIR.TAG'):
+        tmpdir.join(path).ensure()
+    tmpdir.join('srv/CACHEDIR.TAG').write('Signature: 8a477f597d28d172789f06886806bc55\n')
+    exclude_file = tmpdir.join('excludes')
+    exclude_file.write('# Caches\n{}\n'.format(tmpdir.join('var/cache')))
+    directories = tuple(str(tmpdir.join(path)) for path in ('var/cache', 'var/lib', 'home', 'home/user', 'srv'))
+
+    location_config = {
+        'exclude_from': [str(exclude_file)],
+        'exclude_if_present': '.nobackup',
+        'exclude_caches': True,
+    }
+    (exclude_patterns, unreadable_filenames) = module.read_exclude_patterns(location_config)
+
+    (remaining, dropped) = module.skip_excluded_directories(
+        directories, exclude_patterns, location_config
+    )
+
+    assert remaining == (str(tmpdir.join('var/lib')), str(tmpdir.join('home')))
+    assert dropped == (
+        (str(tmpdir.join('var/cache')), 'Excluded by pattern {}'.format(tmpdir.join('var/cache'))),
+        (str(tmpdir.join('home/user')), 'Contains .nobackup'),
+        (str(tmpdir.join('srv')), 'Contains CACHEDIR.TAG'),
+    )
+
+
+def test_skip_excluded_directories_keeps_directory_with_invalid_cache_tag(tmpdir):
+    tmpdir.join('srv/CACHEDIR.TAG').ensure()
+    tmpdir.join('etc').ensure(dir=True)
+
+    (remaining, dropped) = module.skip_excluded_directories(
+        (str(tmpdir.join('srv')), str(tmpdir.join('etc'))), (), {'exclude_caches': True}
+    )
+
+    assert remaining == (str(tmpdir.join('srv')), str(tmpdir.join('etc')))
+    assert dropped == ()
+
+
+def test_compile_exclude_patterns_excludes_same_paths(tmpdir):
+    patterns = (
+        '/home/*/.cache',
+        '/home/user/.cache',
+        '/home/user',
+        'fm:/home/user/',
+        'pf:/home/user/file',
+        '*.pyc',
+        '/var/cache',
+        're:^tmp/',
+    )
+    paths = (
+        'home/user',
+        'home/user/.cache',
+        'home/user/file',
+        'home/other/.cache/x',
+        'home/other/file.pyc',
+        'home/other/file.py',
+        'var/cache',
+        'var/lib',
+        'tmp/x',
+    )
+    (compiled_patterns, removed_patterns) = module.compile_exclude_patterns(patterns)
+
+    def excluded(patterns, path):
+        return any(module.compile_pattern(pattern)(path) for pattern in patterns)
+
+    assert len(compiled_patterns) + len(removed_patterns) == len(patterns)
+    assert [excluded(compiled_patterns, path) for path in paths] == [
+        excluded(patterns, path) for path in paths
+    ]
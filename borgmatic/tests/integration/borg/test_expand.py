@@ -0,0 +1,194 @@
+import glob
+import os
+import threading
+
+import pytest
+
+from borgmatic.borg import expand as module
+
+
+@pytest.fixture
+def source_tree(tmpdir):
+    for path in (
+        'srv/one/data/a.txt',
+        'srv/one/data/b.log',
+        'srv/one/data/.hidden',
+        'srv/two/data/nested/c.txt',
+        'srv/two/other/d.txt',
+        'srv/.dot/data/e.txt',
+        'srv/file.txt',
+    ):
+        tmpdir.join(path).ensure()
+
+    module.clear_cache()
+
+    return str(tmpdir)
+
+
+@pytest.mark.parametrize(
+    'pattern',
+    (
+        'srv',
+        'srv/*',
+        'srv/*/',
+        'srv/*/data/*',
+        'srv/*/data/.*',
+        'srv/*/data/*.txt',
+        'srv/t?o/*',
+        'srv/[ot]*/data',
+        'srv/**',
+        'srv/**/',
+        'srv/**/*.txt',
+        'srv/**/data',
+        'srv/**/data/**',
+        'srv/one/**/a.txt',
+        'srv/missing/*',
+        'srv/file.txt/*',
+    ),
+)
+def test_expand_pattern_matches_glob(source_tree, pattern):
+    absolute_pattern = os.path.join(source_tree, pattern)
+
+    assert module._expand_pattern(absolute_pattern) == sorted(
+        glob.glob(absolute_pattern, recursive=True)
+    )
+
+
+def test_expand_pattern_with_relative_pattern_matches_glob(source_tree):
+    original_directory = os.getcwd()
+    os.chdir(source_tree)
+
+    try:
+        assert module._expand_pattern('srv/**/*.txt') == sorted(
+            glob.glob('srv/**/*.txt', recursive=True)
+        )
+        assert module._expand_pattern('*') == sorted(glob.glob('*'))
+    finally:
+        os.chdir(original_directory)
+
+
+def test_expand_pattern_with_recursive_glob_does_not_follow_directory_symlinks(source_tree):
+    os.symlink(os.path.join(source_tree, 'srv'), os.path.join(source_tree, 'srv/two/loop'))
+
+    paths = module._expand_pattern(os.path.join(source_tree, 'srv/**/*.txt'))
+
+    assert paths == [
+        os.path.join(source_tree, path)
+        for path in (
+            'srv/file.txt',
+            'srv/one/data/a.txt',
+            'srv/two/data/nested/c.txt',
+            'srv/two/other/d.txt',
+        )
+    ]
+
+
+def test_expand_pattern_with_recursive_glob_and_wildcard_does_not_match_within_directory_symlinks(
+    source_tree,
+):
+    os.symlink(os.path.join(source_tree, 'srv/one'), os.path.join(source_tree, 'srv/two/link'))
+
+    paths = module._expand_pattern(os.path.join(source_tree, 'srv/two/**/*'))
+
+    assert paths == [
+        os.path.join(source_tree, path)
+        for path in (
+            'srv/two/data',
+            'srv/two/data/nested',
+            'srv/two/data/nested/c.txt',
+            'srv/two/link',
+            'srv/two/other',
+            'srv/two/other/d.txt',
+        )
+    ]
+
+
+def test_expand_pattern_with_recursive_glob_last_matches_directory_symlink_but_not_within_it(
+    source_tree,
+):
+    os.symlink(os.path.join(source_tree, 'srv/one'), os.path.join(source_tree, 'srv/two/link'))
+
+    paths = module._expand_pattern(os.path.join(source_tree, 'srv/two/**'))
+
+    assert os.path.join(source_tree, 'srv/two/link') in paths
+    assert not [path for path in paths if path.startswith(os.path.join(source_tree, 'srv/two/link/'))]
+
+
+def test_expand_directories_expands_concurrently_in_order(source_tree):
+    patterns = [
+        os.path.join(source_tree, 'srv/two/*'),
+        os.path.join(source_tree, 'srv/file.txt'),
+        os.path.join(source_tree, 'srv/one/data/*'),
+    ]
+
+    paths = module.expand_directories(patterns)
+
+    assert paths == tuple(
+        path for pattern in patterns for path in sorted(glob.glob(pattern))
+    )
+
+
+def test_expand_directories_from_concurrent_threads_returns_same_result(source_tree):
+    patterns = [os.path.join(source_tree, 'srv/**/*.txt')]
+    results = []
+
+    threads = [
+        threading.Thread(target=lambda: results.append(module.expand_directories(patterns)))
+        for thread_number in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8
+    assert all(result is results[0] for result in results)
+
+
+def test_deduplicate_directories_resolves_symlinked_parents_and_tildes(source_tree, monkeypatch):
+    monkeypatch.setenv('HOME', os.path.join(source_tree, 'srv'))
+    os.symlink(os.path.join(source_tree, 'srv'), os.path.join(source_tree, 'srv-link'))
+    directories = module.expand_directories(
+        [
+            '~/one/data',
+            os.path.join(source_tree, 'srv-link/one'),
+            os.path.join(source_tree, 'srv/*'),
+        ]
+    )
+
+    assert module.deduplicate_directories(directories) == (
+        (
+            os.path.join(source_tree, 'srv-link/one'),
+            os.path.join(source_tree, 'srv/file.txt'),
+            os.path.join(source_tree, 'srv/two'),
+        ),
+        (
+            (
+                os.path.join(source_tree, 'srv/one/data'),
+                'Already backed up as part of {}'.format(os.path.join(source_tree, 'srv-link/one')),
+            ),
+            (
+                os.path.join(source_tree, 'srv/one'),
+                'Already backed up as part of {}'.format(os.path.join(source_tree, 'srv-link/one')),
+            ),
+        ),
+    )
+
+
+def test_deduplicate_directories_does_not_let_symlink_source_cover_its_target(source_tree):
+    os.symlink(os.path.join(source_tree, 'srv/one'), os.path.join(source_tree, 'one-link'))
+    directories = (
+        os.path.join(source_tree, 'one-link'),
+        os.path.join(source_tree, 'srv/one'),
+        os.path.join(source_tree, 'srv/one/data'),
+    )
+
+    assert module.deduplicate_directories(directories) == (
+        directories[:2],
+        (
+            (
+                os.path.join(source_tree, 'srv/one/data'),
+                'Already backed up as part of {}'.format(os.path.join(source_tree, 'srv/one')),
+            ),
+        ),
+    )
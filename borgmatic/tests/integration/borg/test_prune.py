@@ -0,0 +1,91 @@
+import json
+
+from flexmock import flexmock
+import pytest
+
+from borgmatic.borg import archives, prune as module
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    archives.clear_cache()
+    yield
+    archives.clear_cache()
+
+
+def make_archive(day):
+    return {
+        'name': 'host-2018-01-0{}'.format(day),
+        'start': '2018-01-0{}T03:04:05.000000'.format(day),
+        'id': str(day) * 64,
+    }
+
+
+def insert_fake_borg(tmpdir, repository_archives, calls):
+    '''
+    Pretend that Borg runs against a repository with the given list of archive dicts as per
+    "borg list --json", appending each Borg command to the given calls list. Pruning keeps only the
+    newest archive, as per a retention policy of keep_daily: 1 with one archive per day.
+    '''
+    state = {'last_modified': 0}
+
+    def repository_json():
+        return {'last_modified': 'modified-{}'.format(state['last_modified'])}
+
+    def capture_output(full_command, extra_environment=None, timeout=None, handle_stderr_line=None):
+        calls.append(full_command[1])
+
+        if full_command[1] == 'list':
+            return json.dumps(
+                {'repository': repository_json(), 'archives': repository_archives}
+            ).encode('utf-8')
+        if full_command[1] == 'info':
+            return json.dumps({'repository': repository_json()}).encode('utf-8')
+
+        raise AssertionError('Unexpected Borg command: {}'.format(full_command))
+
+    def execute_command(full_command, extra_environment=None):
+        calls.append(full_command[1])
+        assert full_command[1] == 'prune'
+        repository_archives[:-1] = []
+        state['last_modified'] += 1
+
+    flexmock(archives.cache).should_receive('cache_directory').and_return(str(tmpdir))
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.execute).should_receive('output_is_buffered').and_return(False)
+    flexmock(module.execute).should_receive('execute_command_and_capture_output').replace_with(
+        capture_output
+    )
+    flexmock(module.execute).should_receive('execute_command').replace_with(execute_command)
+
+    def create_archive(day):
+        archive = make_archive(day)
+        repository_archives.append(archive)
+        state['last_modified'] += 1
+
+        return json.dumps({'repository': repository_json(), 'archive': archive}).encode('utf-8')
+
+    return create_archive
+
+
+def test_prune_archives_in_consecutive_runs_lists_repository_only_once(tmpdir):
+    repository_archives = [make_archive(1), make_archive(2)]
+    calls = []
+    create_archive = insert_fake_borg(tmpdir, repository_archives, calls)
+
+    module.prune_archives(None, 'repo', {}, {'keep_daily': 1})
+
+    assert calls == ['list', 'prune', 'info']
+    assert [archive['name'] for archive in repository_archives] == ['host-2018-01-02']
+
+    # The next run creates an archive the way create.create_archive() does, and then prunes again.
+    archives.clear_cache()
+    del calls[:]
+    archives.revalidate_archive_list('repo', {})
+    archives.record_created_archive('repo', create_archive(3))
+    module.prune_archives(None, 'repo', {}, {'keep_daily': 1})
+
+    assert calls == ['info', 'prune', 'info']
+    assert [archive.name for archive in archives.list_archives('repo', {})] == [
+        'host-2018-01-03'
+    ]
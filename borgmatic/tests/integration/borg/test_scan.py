@@ -0,0 +1,55 @@
+import os
+
+from borgmatic.borg import scan as module
+
+
+def scanned_paths(root, statuses):
+    return [os.path.relpath(status.path, root) for status in statuses]
+
+
+def test_scan_directories_returns_statuses_sorted_by_path(tmpdir):
+    for path in ('a/b/c.txt', 'a/d.txt', 'e.txt'):
+        tmpdir.join('source', path).write('data', ensure=True)
+    os.symlink(str(tmpdir.join('source', 'a')), str(tmpdir.join('source', 'link')))
+    root = str(tmpdir.join('source'))
+
+    statuses = module._scan_directories((root,), (), {})
+
+    assert scanned_paths(str(tmpdir), statuses) == [
+        'source',
+        'source/a',
+        'source/a/b',
+        'source/a/b/c.txt',
+        'source/a/d.txt',
+        'source/e.txt',
+        'source/link',
+    ]
+    file_status = statuses[3]
+    assert file_status.size == 4
+    assert file_status.inode == os.stat(file_status.path).st_ino
+    assert file_status.mtime_ns == os.stat(file_status.path).st_mtime_ns
+
+
+def test_scan_directories_honors_excludes(tmpdir):
+    for path in ('a/keep.txt', 'a/skip.pyc', 'cache/file', 'tagged/file', 'tagged/.nobackup'):
+        tmpdir.join('source', path).write('data', ensure=True)
+    tmpdir.join('source', 'b', '.nobackup').write('', ensure=True)
+    root = str(tmpdir.join('source'))
+
+    statuses = module._scan_directories(
+        (root, str(tmpdir.join('source', 'b'))),
+        ('fm:*.pyc', 'pp:{}'.format(tmpdir.join('source', 'cache'))),
+        {'exclude_if_present': '.nobackup'},
+    )
+
+    assert scanned_paths(str(tmpdir), statuses) == ['source', 'source/a', 'source/a/keep.txt']
+
+
+def test_scan_directories_skips_missing_sources(tmpdir):
+    tmpdir.join('source', 'file').write('data', ensure=True)
+
+    statuses = module._scan_directories(
+        (str(tmpdir.join('missing')), str(tmpdir.join('source'))), (), {}
+    )
+
+    assert scanned_paths(str(tmpdir), statuses) == ['source', 'source/file']
@@ -0,0 +1,41 @@
+from flexmock import flexmock
+
+from borgmatic.borg import scan
+from borgmatic.borg import source_manifest as module
+
+
+def test_write_manifest_then_is_unchanged_detects_changes(tmpdir):
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+    tmpdir.join('source', 'file').write('data', ensure=True)
+    root = str(tmpdir.join('source'))
+    key = module.make_key((root,), (), {}, {})
+    body = module.pack_statuses(scan._scan_directories((root,), (), {}))
+
+    module.write_manifest('repo', key, body, 100.0)
+
+    assert module.read_manifest('repo', key) == (100.0, key, body)
+    assert module.is_unchanged('repo', key, body, now=200.0)
+    assert not module.is_unchanged('other-repo', key, body, now=200.0)
+
+    tmpdir.join('source', 'file').write('more data')
+    changed_body = module.pack_statuses(scan._scan_directories((root,), (), {}))
+
+    assert not module.is_unchanged('repo', key, changed_body, now=200.0)
+
+
+def test_write_manifest_for_configurations_sharing_repository_keeps_both(tmpdir):
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+    tmpdir.join('documents', 'file').write('data', ensure=True)
+    tmpdir.join('photos', 'file').write('data', ensure=True)
+    documents = str(tmpdir.join('documents'))
+    photos = str(tmpdir.join('photos'))
+    documents_key = module.make_key((documents,), (), {}, {})
+    documents_body = module.pack_statuses(scan._scan_directories((documents,), (), {}))
+    photos_key = module.make_key((photos,), (), {}, {})
+    photos_body = module.pack_statuses(scan._scan_directories((photos,), (), {}))
+
+    module.write_manifest('repo', documents_key, documents_body, 100.0)
+    module.write_manifest('repo', photos_key, photos_body, 100.0)
+
+    assert module.is_unchanged('repo', documents_key, documents_body, now=200.0)
+    assert module.is_unchanged('repo', photos_key, photos_body, now=200.0)
@@ -1,4 +1,7 @@
 import os
+import subprocess
+import sys
+import time
 
 from flexmock import flexmock
 import pytest
@@ -6,12 +9,36 @@ import pytest
 from borgmatic.commands import borgmatic as module
 
 
+# Importing the borgmatic command must take less than this many times as long as starting a bare
+# Python interpreter, so that frequent runs from cron don't pay for slow imports. The budget is
+# relative, so that it holds on slow or loaded machines too.
+IMPORT_TIME_BUDGET_FACTOR = 10
+
+
 def test_parse_arguments_with_no_arguments_uses_defaults():
     parser = module.parse_arguments()
 
     assert parser.config_paths == module.collect.DEFAULT_CONFIG_PATHS
     assert parser.excludes_filename == None
     assert parser.verbosity is None
+    assert parser.repository_jobs is None
+    assert parser.jobs is None
+    assert parser.cache_config is False
+    assert parser.progress is False
+    assert parser.dry_run is False
+    assert parser.config_recursive is False
+    assert parser.config_include_patterns == ()
+    assert parser.config_exclude_patterns == ()
+
+
+def test_parse_arguments_with_config_collection_arguments_sets_them():
+    parser = module.parse_arguments(
+        '--config-recursive', '--config-include', '*.yaml', '*.yml', '--config-exclude', 'old'
+    )
+
+    assert parser.config_recursive is True
+    assert parser.config_include_patterns == ['*.yaml', '*.yml']
+    assert parser.config_exclude_patterns == ['old']
 
 
 def test_parse_arguments_with_path_arguments_overrides_defaults():
@@ -37,6 +64,36 @@ def test_parse_arguments_with_verbosity_flag_overrides_default():
     assert parser.verbosity == 1
 
 
+def test_parse_arguments_with_jobs_flag_overrides_default():
+    parser = module.parse_arguments('--jobs', '4')
+
+    assert parser.jobs == 4
+
+
+def test_parse_arguments_with_repository_jobs_flag_overrides_default():
+    parser = module.parse_arguments('--repository-jobs', '3')
+
+    assert parser.repository_jobs == 3
+
+
+def test_parse_arguments_with_progress_flag_enables_progress():
+    parser = module.parse_arguments('--progress')
+
+    assert parser.progress is True
+
+
+def test_parse_arguments_with_profile_flags_enables_profiling():
+    parser = module.parse_arguments('--profile', 'profile.json', '--profile-python')
+
+    assert parser.profile_filename == 'profile.json'
+    assert parser.profile_python is True
+
+
+def test_parse_arguments_with_profile_python_flag_but_without_profile_flag_raises():
+    with pytest.raises(ValueError):
+        module.parse_arguments('--profile-python')
+
+
 def test_parse_arguments_with_no_actions_defaults_to_all_actions_enabled():
     parser = module.parse_arguments()
 
@@ -61,6 +118,59 @@ def test_parse_arguments_with_multiple_actions_leaves_other_action_disabled():
     assert parser.check is True
 
 
+def test_parse_arguments_with_dry_run_and_prune_action_enables_dry_run():
+    parser = module.parse_arguments('--prune', '--dry-run')
+
+    assert parser.dry_run is True
+    assert parser.prune is True
+
+
+def test_parse_arguments_with_dry_run_but_without_prune_action_raises():
+    with pytest.raises(ValueError):
+        module.parse_arguments('--dry-run')
+
+
+def test_parse_arguments_with_dry_run_and_other_actions_raises():
+    with pytest.raises(ValueError):
+        module.parse_arguments('--prune', '--create', '--dry-run')
+
+
 def test_parse_arguments_with_invalid_arguments_exits():
     with pytest.raises(SystemExit):
         module.parse_arguments('--posix-me-harder')
+
+
+def test_import_defers_slow_imports():
+    output = subprocess.check_output(
+        (
+            sys.executable,
+            '-c',
+            'import sys, borgmatic.commands.borgmatic; '
+            'print(" ".join(sorted(name for name in ("pkg_resources", "pykwalify", "ruamel") '
+            'if name in sys.modules)))',
+        )
+    )
+
+    assert output.decode().strip() == ''
+
+
+def fastest_run_seconds(command, runs=3):
+    '''
+    Given a command to run in a new Python interpreter, run it several times and return the fastest
+    run's wall time in seconds, so that a single slow run on a loaded machine doesn't count.
+    '''
+    elapsed = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call((sys.executable, '-c', command))
+        elapsed.append(time.perf_counter() - start)
+
+    return min(elapsed)
+
+
+def test_import_takes_less_than_budget():
+    interpreter_seconds = fastest_run_seconds('pass')
+    import_seconds = fastest_run_seconds('import borgmatic.commands.borgmatic') - interpreter_seconds
+
+    assert import_seconds < interpreter_seconds * IMPORT_TIME_BUDGET_FACTOR
@@ -0,0 +1,23 @@
+import os
+
+from borgmatic.config import collect as module
+
+
+def test_collect_config_filenames_with_recursive_collects_sorted_files(tmpdir):
+    tmpdir.join('b.yaml').write('')
+    tmpdir.join('a.yaml').write('')
+    tmpdir.join('notes.txt').write('')
+    tmpdir.mkdir('tenant2').join('config.yaml').write('')
+    tmpdir.mkdir('tenant1').join('config.yaml').write('')
+    os.symlink(str(tmpdir), str(tmpdir.join('loop')))
+
+    config_filenames = tuple(
+        module.collect_config_filenames(
+            (str(tmpdir),), recursive=True, include_patterns=('*.yaml',)
+        )
+    )
+
+    assert config_filenames == tuple(
+        str(tmpdir.join(path))
+        for path in ('a.yaml', 'b.yaml', 'tenant1/config.yaml', 'tenant2/config.yaml')
+    )
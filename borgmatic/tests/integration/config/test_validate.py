@@ -1,7 +1,9 @@
+import datetime
 import io
 import string
 import sys
 import os
+import textwrap
 
 from flexmock import flexmock
 import pytest
@@ -22,6 +24,9 @@ def mock_config_and_schema(config_yaml):
     '''
     config_stream = io.StringIO(config_yaml)
     schema_stream = open(module.schema_filename())
+    module._schemas.clear()
+    flexmock(module).should_receive('_read_cached_schema').and_return(None)
+    flexmock(module).should_receive('_write_cached_schema')
     builtins = flexmock(sys.modules['builtins'])
     builtins.should_receive('open').with_args('config.yaml').and_return(config_stream)
     builtins.should_receive('open').with_args('schema.yaml').and_return(schema_stream)
@@ -116,8 +121,348 @@ def test_parse_configuration_raises_for_validation_error():
         module.parse_configuration('config.yaml', 'schema.yaml')
 
 
-def test_display_validation_error_does_not_raise():
-    flexmock(sys.modules['builtins']).should_receive('print')
+def test_load_schema_strips_examples():
+    module._schemas.clear()
+    flexmock(module).should_receive('_read_cached_schema').and_return(None)
+    flexmock(module).should_receive('_write_cached_schema')
+
+    schema = module.load_schema(module.schema_filename())
+
+    assert 'example' not in schema['map']['location']['map']['source_directories']
+
+
+def test_load_schema_parses_schema_only_once_per_process():
+    module._schemas.clear()
+    flexmock(module).should_receive('_read_cached_schema').and_return(None).once()
+    flexmock(module).should_receive('_write_cached_schema').once()
+
+    schema = module.load_schema(module.schema_filename())
+
+    assert module.load_schema(module.schema_filename()) is schema
+
+
+def test_load_schema_uses_schema_cached_on_disk(tmpdir):
+    module._schemas.clear()
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir))
+
+    schema = module.load_schema(module.schema_filename())
+    module._schemas.clear()
+    flexmock(module).should_receive('_parse_schema').never()
+
+    assert module.load_schema(module.schema_filename()) == schema
+
+
+def test_load_schema_reparses_schema_when_its_contents_change(tmpdir):
+    module._schemas.clear()
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir))
+    schema_file = tmpdir.join('schema.yaml')
+    schema_file.write(
+        'map:\n    location:\n        map:\n            foo:\n                type: str\n'
+        '                example: bar\n'
+    )
+    module.load_schema(str(schema_file))
+    schema_file.write(
+        'map:\n    location:\n        map:\n            baz:\n                type: str\n'
+        '                example: quux\n'
+    )
+    module._schemas.clear()
+
+    schema = module.load_schema(str(schema_file))
+
+    assert schema == {'map': {'location': {'map': {'baz': {'type': 'str'}}}}}
+
+
+def test_load_schema_ignores_unwritable_cache_directory(tmpdir):
+    module._schemas.clear()
+    cache_directory = tmpdir.join('cache')
+    cache_directory.write('not a directory')
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(cache_directory))
+
+    assert module.load_schema(module.schema_filename())
+
+
+def test_parse_configuration_with_use_cache_writes_validated_config_to_cache(tmpdir):
+    config_file = tmpdir.join('config.yaml')
+    config_file.write('location:\n    source_directories:\n        - /home\n    repositories:\n        - hostname.borg\n')
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+
+    config = module.parse_configuration(str(config_file), module.schema_filename(), use_cache=True)
+
+    cache_filename = module._config_cache_filename(str(config_file))
+    assert os.stat(cache_filename).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.dirname(cache_filename)).st_mode & 0o777 == 0o700
+    assert module.parse_configuration(
+        str(config_file), module.schema_filename(), use_cache=True
+    ) == config
+
+
+def test_parse_configuration_with_use_cache_skips_validation_of_cached_config(tmpdir):
+    config_file = tmpdir.join('config.yaml')
+    config_file.write('location:\n    source_directories:\n        - /home\n    repositories:\n        - hostname.borg\n')
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+    config = module.parse_configuration(str(config_file), module.schema_filename(), use_cache=True)
+    flexmock(module).should_receive('load_validator').never()
+
+    assert module.parse_configuration(
+        str(config_file), module.schema_filename(), use_cache=True
+    ) == config
+
+
+def test_parse_configuration_with_use_cache_invalidates_cache_when_config_changes(tmpdir):
+    config_file = tmpdir.join('config.yaml')
+    config_file.write('location:\n    source_directories:\n        - /home\n    repositories:\n        - hostname.borg\n')
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+    module.parse_configuration(str(config_file), module.schema_filename(), use_cache=True)
+    config_file.write('location:\n    source_directories:\n        - /etc\n    repositories:\n        - hostname.borg\n')
+
+    config = module.parse_configuration(str(config_file), module.schema_filename(), use_cache=True)
+
+    assert config['location']['source_directories'] == ['/etc']
+
+
+def test_parse_configuration_with_use_cache_does_not_cache_invalid_config(tmpdir):
+    config_file = tmpdir.join('config.yaml')
+    config_file.write('location:\n    source_directories: yes\n    repositories:\n        - hostname.borg\n')
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+    flexmock(module).should_receive('_write_cached_config').never()
+
+    with pytest.raises(module.Validation_error):
+        module.parse_configuration(str(config_file), module.schema_filename(), use_cache=True)
+
+
+def test_parse_configuration_with_use_cache_ignores_cache_file_accessible_to_others(tmpdir):
+    config_file = tmpdir.join('config.yaml')
+    config_file.write('location:\n    source_directories:\n        - /home\n    repositories:\n        - hostname.borg\n')
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+    module.parse_configuration(str(config_file), module.schema_filename(), use_cache=True)
+    os.chmod(module._config_cache_filename(str(config_file)), 0o644)
+    flexmock(module).should_call('load_validator').once()
+
+    module.parse_configuration(str(config_file), module.schema_filename(), use_cache=True)
+
+
+def test_parse_configuration_with_use_cache_skips_caching_config_with_dates(tmpdir):
+    config_file = tmpdir.join('config.yaml')
+    config_file.write('location:\n    source_directories:\n        - /home\n    repositories:\n        - hostname.borg\nretention:\n    prefix: 2018-01-01\n')
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+
+    config = module.parse_configuration(str(config_file), module.schema_filename(), use_cache=True)
+
+    assert config['retention']['prefix'] == datetime.date(2018, 1, 1)
+    assert not os.path.exists(module._config_cache_filename(str(config_file)))
+
+
+def test_load_validator_compiles_schema_only_once_per_process():
+    module._schemas.clear()
+    module._validators.clear()
+    flexmock(module).should_receive('_read_cached_schema').and_return(None)
+    flexmock(module).should_receive('_write_cached_schema')
+    flexmock(module.validator).should_call('compile_schema').once()
+
+    validate_config = module.load_validator(module.schema_filename())
+
+    assert module.load_validator(module.schema_filename()) is validate_config
+
+
+def test_load_validator_falls_back_to_pykwalify_for_unsupported_schema(tmpdir):
+    module._schemas.clear()
+    module._validators.clear()
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+    schema_file = tmpdir.join('schema.yaml')
+    schema_file.write(
+        'map:\n    location:\n        map:\n            foo:\n                type: str\n'
+        '                pattern: ^bar$\n                example: bar\n'
+    )
+
+    validate_config = module.load_validator(str(schema_file))
+
+    assert validate_config({'location': {'foo': 'bar'}}) == []
+    assert validate_config({'location': {'foo': 'baz'}})
+
+
+VALID_CONFIG_YAML = 'location:\n    source_directories:\n        - /home\n    repositories:\n        - hostname.borg\n'
+
+
+def write_configs(tmpdir, count, invalid_numbers=()):
+    '''
+    Given a temporary directory, a number of config files, and the numbers of any config files to
+    make invalid, write the config files and return their paths.
+    '''
+    config_filenames = []
+
+    for number in range(count):
+        config_file = tmpdir.join('config{}.yaml'.format(number))
+        config_file.write('location: {}\n' if number in invalid_numbers else VALID_CONFIG_YAML)
+        config_filenames.append(str(config_file))
+
+    return config_filenames
+
+
+def test_parse_configurations_returns_configs_in_order():
+    flexmock(module).should_receive('load_validator')
+    flexmock(module).should_receive('parse_configuration').replace_with(
+        lambda config_filename, schema_filename, use_cache: {'file': config_filename}
+    )
+
+    (configs, errors) = module.parse_configurations(('b.yaml', 'a.yaml'), 'schema.yaml', jobs=1)
+
+    assert list(configs.items()) == [('b.yaml', {'file': 'b.yaml'}), ('a.yaml', {'file': 'a.yaml'})]
+    assert errors == {}
+
+
+def test_parse_configurations_collects_all_errors():
+    flexmock(module).should_receive('load_validator')
+    flexmock(module).should_receive('parse_configuration').with_args(
+        'a.yaml', 'schema.yaml', False
+    ).and_raise(module.Validation_error('a.yaml', ('oops',)))
+    flexmock(module).should_receive('parse_configuration').with_args(
+        'b.yaml', 'schema.yaml', False
+    ).and_return({})
+    flexmock(module).should_receive('parse_configuration').with_args(
+        'c.yaml', 'schema.yaml', False
+    ).and_raise(FileNotFoundError)
+
+    (configs, errors) = module.parse_configurations(
+        ('a.yaml', 'b.yaml', 'c.yaml'), 'schema.yaml', jobs=1
+    )
+
+    assert list(configs) == ['b.yaml']
+    assert list(errors) == ['a.yaml', 'c.yaml']
+    assert isinstance(errors['a.yaml'], module.Validation_error)
+    assert isinstance(errors['c.yaml'], FileNotFoundError)
+
+
+def test_parse_configurations_with_multiple_jobs_parses_in_worker_processes(tmpdir):
+    module._schemas.clear()
+    module._validators.clear()
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+    config_filenames = write_configs(tmpdir, 10, invalid_numbers=(3, 7))
+
+    (configs, errors) = module.parse_configurations(
+        config_filenames, module.schema_filename(), jobs=3
+    )
+
+    assert list(configs) == [
+        config_filename
+        for number, config_filename in enumerate(config_filenames)
+        if number not in (3, 7)
+    ]
+    assert configs[config_filenames[0]]['location']['repositories'] == ['hostname.borg']
+    assert list(errors) == [config_filenames[3], config_filenames[7]]
+    assert errors[config_filenames[3]].error_messages == [
+        "Cannot find required key 'source_directories'. Path: '/location'",
+        "Cannot find required key 'repositories'. Path: '/location'",
+    ]
+
+
+def test_parse_configurations_with_multiple_jobs_records_parse_phase_for_each_file(tmpdir):
+    flexmock(module.cache).should_receive('cache_directory').and_return(str(tmpdir.join('cache')))
+    config_filenames = write_configs(tmpdir, 3, invalid_numbers=(1,))
+    recorded = []
+    flexmock(module.profiling).should_receive('record_phase').replace_with(
+        lambda name, wall_seconds, cpu_seconds, config_filename: recorded.append(
+            (name, config_filename, wall_seconds >= 0, cpu_seconds >= 0)
+        )
+    )
+
+    module.parse_configurations(config_filenames, module.schema_filename(), jobs=2)
+
+    assert recorded == [
+        ('parse', config_filename, True, True) for config_filename in config_filenames
+    ]
+
+def test_validation_error_displays_filename_and_error_messages():
     error = module.Validation_error('config.yaml', ('oops', 'uh oh'))
 
-    module.display_validation_error(error)
+    assert str(error) == (
+        'An error occurred while parsing a configuration file at config.yaml:\noops\nuh oh'
+    )
+
+
+def normalize(value):
+    '''
+    Given a parsed YAML value, return it with all mappings as plain dicts, all sequences as plain
+    lists, and all scalars paired with their basic type, so that values parsed by different loaders
+    can be compared.
+    '''
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+
+    for basic_type in (bool, int, float, str, datetime.datetime, datetime.date, type(None)):
+        if isinstance(value, basic_type):
+            return (basic_type.__name__, value)
+
+    raise AssertionError('Unexpected type: {}'.format(type(value)))
+
+
+@pytest.mark.parametrize(
+    'config_yaml',
+    (
+        '',
+        '''
+        # Comment.
+        location:
+            source_directories:
+                - /home
+                - "/etc"
+                - '/var/log/syslog*'
+
+            repositories:
+                - user@backupserver:sourcehostname.borg
+            one_file_system: true
+            exclude_patterns: ['*.pyc', /home/*/.cache]
+        storage:
+            encryption_passphrase: "!\\"#$%&'()*+,-./:;<=>?@[\\\\]^_`{|}~"
+            compression: lz4
+            umask: 0077
+        retention:
+            keep_daily: 7
+            keep_weekly: 0o17
+            keep_monthly: 0x1F
+            prefix: 2018-01-01
+        consistency:
+            checks: [repository, archives]
+            check_last: ~
+        ''',
+        '''
+        base: &base
+            compression: lz4
+        storage:
+            <<: *base
+            umask: 1_000
+        values: [yes, no, on, off, True, FALSE, 1e3, .inf, -.5, +1, 0b101, 1.2.3]
+        sexagesimal: 12:30:45
+        ''',
+        '''
+        multiline: |
+            line one
+            line two
+        folded: >
+            folded
+            text
+        unicode: "\\u00e9"
+        ''',
+    ),
+)
+def test_load_configuration_yaml_matches_round_trip_load(config_yaml):
+    from ruamel import yaml
+
+    config_text = textwrap.dedent(config_yaml)
+
+    assert normalize(module.load_configuration_yaml(config_text)) == normalize(
+        yaml.round_trip_load(config_text)
+    )
+
+
+def test_load_configuration_yaml_raises_for_syntax_error():
+    from ruamel import yaml
+
+    with pytest.raises(yaml.error.YAMLError):
+        module.load_configuration_yaml('foo:\nbar')
+
+
+def test_load_configuration_yaml_with_yaml_version_directive_honors_version():
+    assert module.load_configuration_yaml('%YAML 1.1\n---\nfoo: yes\n') == {'foo': True}
@@ -0,0 +1,124 @@
+import logging
+import re
+
+import pykwalify.core
+import pytest
+from ruamel import yaml
+
+from borgmatic.config import validate
+from borgmatic.config import validator as module
+
+
+CONFIGS = (
+    [],
+    'foo',
+    {},
+    {'location': None},
+    {'location': {}},
+    {'location': 5},
+    {'location': {'source_directories': 'foo', 'repositories': ['repo']}},
+    {'location': {'source_directories': None, 'repositories': ['repo']}},
+    {'location': {'source_directories': [], 'repositories': ['repo']}},
+    {
+        'location': {
+            'source_directories': ['/foo', 5, None, True, [1], {'a': 1}],
+            'repositories': ['repo'],
+        }
+    },
+    {
+        'location': {
+            'source_directories': ['/foo'],
+            'repositories': ['repo'],
+            'one_file_system': 'yes',
+            'repository_jobs': '2',
+            'remote_path': [1],
+        }
+    },
+    {
+        'location': {
+            'source_directories': ['/foo'],
+            'repositories': ['repo'],
+            'repository_jobs': True,
+            'remote_path': None,
+            'one_file_system': 1,
+        }
+    },
+    {
+        'location': {
+            'source_directories': ['/foo'],
+            'repositories': ['repo'],
+            'repository_jobs': 2.5,
+            'bogus': 1,
+        },
+        'extra': {},
+    },
+    {
+        'location': {'source_directories': ['/foo'], 'repositories': ['repo']},
+        'consistency': {'checks': ['repository', 'nope', 5, 'repository'], 'check_last': 'all'},
+    },
+    {
+        'location': {'source_directories': ['/foo'], 'repositories': ['repo']},
+        'storage': {'umask': 77, 'compression': 1.5, 'encryption_passphrase': True},
+        'retention': {'keep_daily': None, 'keep_weekly': 4, 'prefix': 'host-'},
+    },
+    {
+        'location': {'source_directories': ['/foo'], 'repositories': ['repo']},
+        'retention': None,
+        'storage': [],
+    },
+    {'location': {'source_directories': ['/foo'], 'repositories': ['repo']}, 1: 2},
+)
+
+CONFIG_YAMLS = (
+    '''
+    location:
+        source_directories:
+            - /home
+        repositories:
+            - hostname.borg
+        exclude_patterns: /foo
+        bogus: [1, 2]
+    ''',
+    '''
+    location:
+        source_directories: {a: 1}
+        repositories: hostname.borg
+    retention:
+        keep_daily: seven
+    ''',
+)
+
+
+def pykwalify_errors(config, schema):
+    core = pykwalify.core.Core(source_data=config, schema_data=schema)
+    core.validate(raise_exception=False)
+
+    # pykwalify displays string values that aren't lists as byte strings, which isn't worth
+    # imitating.
+    return [
+        re.sub(r"^Value 'b'(.*)'' is not a list", r"Value '\1' is not a list", error)
+        for error in core.validation_errors
+    ]
+
+
+def setup_function():
+    logging.disable(logging.CRITICAL)
+
+
+def teardown_function():
+    logging.disable(logging.NOTSET)
+
+
+@pytest.mark.parametrize('config', CONFIGS)
+def test_compile_schema_agrees_with_pykwalify(config):
+    schema = validate._parse_schema(open(validate.schema_filename()).read())
+
+    assert module.compile_schema(schema)(config) == pykwalify_errors(config, schema)
+
+
+@pytest.mark.parametrize('config_yaml', CONFIG_YAMLS)
+def test_compile_schema_agrees_with_pykwalify_for_round_trip_loaded_config(config_yaml):
+    schema = validate._parse_schema(open(validate.schema_filename()).read())
+    config = yaml.round_trip_load(config_yaml)
+
+    assert module.compile_schema(schema)(config) == pykwalify_errors(config, schema)
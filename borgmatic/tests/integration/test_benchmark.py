@@ -0,0 +1,49 @@
+import json
+
+from flexmock import flexmock
+
+from borgmatic.tests.benchmark import benchmark as module
+
+
+def test_run_benchmarks_at_tiny_scale_produces_results(tmpdir):
+    flexmock(module.validate.cache).should_receive('cache_directory').and_return(
+        str(tmpdir.join('cache'))
+    )
+    results = module.run_benchmarks(
+        str(tmpdir.join('work')),
+        config_scales=(1, 2),
+        parse_scales=(1,),
+        main_scales=(1,),
+        source_directory_scales=(2,),
+        exclude_pattern_scales=(2,),
+    )
+
+    assert [(result['name'], result['scale']) for result in results] == [
+        ('import', 1),
+        ('collect_config_filenames', 1),
+        ('listdir_collect_config_filenames', 1),
+        ('parse_configuration', 1),
+        ('main', 1),
+        ('collect_config_filenames', 2),
+        ('listdir_collect_config_filenames', 2),
+        ('create_archive_source_globs', 2),
+        ('create_archive_exclude_patterns', 2),
+    ]
+    assert all(result['seconds'] > 0 for result in results)
+    json.dumps(results)
+
+
+def test_compare_reports_ratios_against_baseline():
+    results = [{'name': 'main', 'scale': 1, 'seconds': 2.0, 'peak_memory_bytes': 3000000}]
+    baseline = [{'name': 'main', 'scale': 1, 'seconds': 1.0, 'peak_memory_bytes': 1000000}]
+
+    table = module.compare(results, baseline)
+
+    assert '2.00x' in table
+    assert '3.00x' in table
+
+
+def test_compare_skips_results_missing_from_baseline():
+    results = [{'name': 'main', 'scale': 1, 'seconds': 2.0, 'peak_memory_bytes': 3000000}]
+
+    assert module.compare(results, []) == ''
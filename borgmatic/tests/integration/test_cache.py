@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+from borgmatic import cache as module
+
+
+def test_write_cache_file_then_read_cache_file_round_trips(tmpdir):
+    cache_filename = str(tmpdir.join('cache', 'file'))
+
+    module.write_cache_file(cache_filename, b'data')
+
+    assert module.read_cache_file(cache_filename) == b'data'
+    assert os.stat(cache_filename).st_mode & 0o777 == 0o600
+    assert os.stat(str(tmpdir.join('cache'))).st_mode & 0o777 == 0o700
+
+
+def test_read_cache_file_with_missing_file_returns_none(tmpdir):
+    assert module.read_cache_file(str(tmpdir.join('missing'))) is None
+
+
+def test_read_cache_file_accessible_to_others_returns_none(tmpdir):
+    cache_file = tmpdir.join('file')
+    cache_file.write('data')
+    cache_file.chmod(0o644)
+
+    assert module.read_cache_file(str(cache_file)) is None
+
+
+def test_write_cache_file_with_unwritable_directory_does_not_raise(tmpdir):
+    tmpdir.join('cache').write('not a directory')
+
+    module.write_cache_file(str(tmpdir.join('cache', 'file')), b'data')
+
+
+def test_cache_directory_honors_xdg_cache_home(monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', '/tmp/cache')
+
+    assert module.cache_directory() == '/tmp/cache/borgmatic'
+
+
+def test_compute_once_only_computes_same_key_once():
+    computations = []
+
+    def compute():
+        computations.append(None)
+        return 'result'
+
+    results = {}
+    lock = threading.Lock()
+
+    assert module.compute_once(results, lock, 'key', compute) == 'result'
+    assert module.compute_once(results, lock, 'key', compute) == 'result'
+    assert len(computations) == 1
+
+
+def test_compute_once_from_concurrent_threads_computes_once():
+    computations = []
+
+    def compute():
+        computations.append(None)
+        time.sleep(0.05)
+        return 'result'
+
+    results = {}
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        values = list(
+            executor.map(lambda _: module.compute_once(results, lock, 'key', compute), range(4))
+        )
+
+    assert values == ['result'] * 4
+    assert len(computations) == 1
+
+
+def test_compute_once_with_error_does_not_remember_it():
+    def fail():
+        raise OSError()
+
+    results = {}
+    lock = threading.Lock()
+
+    try:
+        module.compute_once(results, lock, 'key', fail)
+    except OSError:
+        pass
+
+    assert results == {}
+    assert module.compute_once(results, lock, 'key', lambda: 'result') == 'result'
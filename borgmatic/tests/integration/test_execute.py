@@ -0,0 +1,114 @@
+import subprocess
+import sys
+import time
+
+from flexmock import flexmock
+import pytest
+
+from borgmatic import execute as module
+
+
+def test_execute_command_and_capture_output_streams_stdout_from_real_process():
+    output = module.execute_command_and_capture_output(
+        (sys.executable, '-c', 'print("one"); print("two", end="")')
+    )
+
+    assert output == b'one\ntwo'
+
+
+def test_execute_command_and_capture_output_with_stderr_line_handler_passes_it_stderr_lines():
+    stderr_lines = []
+
+    output = module.execute_command_and_capture_output(
+        (sys.executable, '-c', 'import sys; print("out"); print("one\\ntwo", file=sys.stderr)'),
+        handle_stderr_line=stderr_lines.append,
+    )
+
+    assert output == b'out\n'
+    assert stderr_lines == [b'one\n', b'two\n']
+
+
+def test_execute_command_and_stream_output_passes_stdout_lines_to_handler():
+    output_lines = []
+
+    module.execute_command_and_stream_output(
+        (sys.executable, '-c', 'print("one"); print("two")'), output_lines.append
+    )
+
+    assert output_lines == [b'one\n', b'two\n']
+
+
+def test_execute_command_with_buffered_output_collects_stdout_and_stderr():
+    with module.buffered_output() as output_buffer:
+        module.execute_command(
+            (sys.executable, '-c', 'import sys; print("out"); sys.stdout.flush(); print("err", file=sys.stderr)')
+        )
+
+    assert output_buffer.read() == b'out\nerr\n'
+
+
+def test_execute_command_with_extra_environment_sets_it_for_command_only():
+    output = module.execute_command_and_capture_output(
+        (sys.executable, '-c', 'import os; print(os.environ["BORGMATIC_TEST"])'),
+        extra_environment={'BORGMATIC_TEST': 'value'},
+    )
+
+    assert output == b'value\n'
+
+
+def test_execute_command_with_error_exit_status_raises():
+    with pytest.raises(subprocess.CalledProcessError):
+        module.execute_command((sys.executable, '-c', 'import sys; sys.exit(2)'))
+
+    assert not module._children
+
+
+def test_execute_command_with_timeout_stops_command_and_raises():
+    start = time.monotonic()
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        with module.buffered_output():
+            module.execute_command((sys.executable, '-c', 'import time; time.sleep(30)'), timeout=0.5)
+
+    assert time.monotonic() - start < 10
+    assert not module._children
+
+
+def test_execute_command_and_stream_output_passes_on_prompt_without_waiting_for_newline():
+    received = []
+    process_script = (
+        'import sys, time; sys.stderr.write("Continue? "); sys.stderr.flush(); time.sleep(1); '
+        'print("done")'
+    )
+
+    module.execute_command_and_stream_output(
+        (sys.executable, '-c', process_script),
+        lambda line: received.append((line, time.monotonic())),
+        handle_stderr_line=lambda line: received.append((line, time.monotonic())),
+    )
+
+    ((prompt, prompt_time), (output, output_time)) = received
+    assert prompt == b'Continue? '
+    assert output == b'done\n'
+    assert output_time - prompt_time > 0.5
+
+
+def test_supervise_processes_streams_output_from_multiple_processes_in_one_loop():
+    processes = [
+        module._start_process(
+            (sys.executable, '-c', 'print("{}")'.format(name)), stdout=subprocess.PIPE
+        )
+        for name in ('one', 'two')
+    ]
+    lines = []
+
+    module.supervise_processes({process: {process.stdout: lines.append} for process in processes})
+
+    assert sorted(lines) == [b'one\n', b'two\n']
+    assert not module._children
+
+
+def test_execute_command_records_child_usage_for_profiling():
+    flexmock(module.profiling).should_receive('record_child_usage').once()
+
+    module.execute_command((sys.executable, '-c', 'pass'))
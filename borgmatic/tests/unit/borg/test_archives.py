@@ -0,0 +1,386 @@
+import json
+
+from flexmock import flexmock
+import pytest
+
+from borgmatic.borg import archives as module
+
+
+ARCHIVE_ONE = module.Archive('host-1', '2018-01-01T03:04:05', 'a' * 64)
+ARCHIVE_TWO = module.Archive('host-2', '2018-01-02T03:04:05', 'b' * 64)
+ARCHIVE_THREE = module.Archive('host-3', '2018-01-03T03:04:05', 'c' * 64)
+
+LIST_JSON_OUTPUT = json.dumps(
+    {
+        'repository': {'last_modified': 'modified'},
+        'archives': [
+            {'name': 'host-2', 'start': '2018-01-02T03:04:05.000000', 'id': 'b' * 64},
+            {'name': 'host-1', 'start': '2018-01-01T03:04:05.000000', 'id': 'a' * 64},
+        ],
+    }
+).encode('utf-8')
+
+CREATE_JSON_OUTPUT = json.dumps(
+    {
+        'repository': {'last_modified': 'modified-after-create'},
+        'archive': {'name': 'host-3', 'start': '2018-01-03T03:04:05.123456', 'id': 'c' * 64},
+    }
+).encode('utf-8')
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    module.clear_cache()
+    yield
+    module.clear_cache()
+
+
+def insert_cache_mock(data):
+    flexmock(module.cache).should_receive('read_json_cache_file').and_return(data)
+    flexmock(module.cache).should_receive('write_json_cache_file')
+
+
+def insert_up_to_date_entry(last_modified, archives):
+    flexmock(module.cache).should_receive('write_json_cache_file')
+    module._archive_lists['repo'] = (last_modified, tuple(archives))
+
+
+def insert_borg_mock(subcommand, output):
+    flexmock(module).should_receive('_run_borg').with_args(
+        subcommand, 'repo', {}, None, flags=('--json',)
+    ).and_return(output).once()
+
+
+def test_list_archives_without_cache_lists_repository_and_caches_archives():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.cache).should_receive('read_json_cache_file').and_return(None)
+    flexmock(module.cache).should_receive('write_json_cache_file').with_args(
+        str,
+        {
+            'last_modified': 'modified',
+            'archives': [list(ARCHIVE_ONE), list(ARCHIVE_TWO)],
+        },
+    ).once()
+    insert_borg_mock('list', LIST_JSON_OUTPUT)
+
+    assert module.list_archives('repo', {}) == (ARCHIVE_ONE, ARCHIVE_TWO)
+
+
+def test_list_archives_with_unchanged_manifest_uses_cache_without_listing():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_cache_mock({'last_modified': 'modified', 'archives': [list(ARCHIVE_ONE)]})
+    insert_borg_mock('info', b'{"repository": {"last_modified": "modified"}}')
+
+    assert module.list_archives('repo', {}) == (ARCHIVE_ONE,)
+
+
+def test_list_archives_with_changed_manifest_lists_repository():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_cache_mock({'last_modified': 'old', 'archives': [list(ARCHIVE_ONE)]})
+    insert_borg_mock('info', b'{"repository": {"last_modified": "modified"}}')
+    insert_borg_mock('list', LIST_JSON_OUTPUT)
+
+    assert module.list_archives('repo', {}) == (ARCHIVE_ONE, ARCHIVE_TWO)
+
+
+def test_list_archives_with_unknown_manifest_modification_time_lists_repository():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_cache_mock({'last_modified': None, 'archives': [list(ARCHIVE_ONE)]})
+    insert_borg_mock('list', LIST_JSON_OUTPUT)
+
+    assert module.list_archives('repo', {}) == (ARCHIVE_ONE, ARCHIVE_TWO)
+
+
+def test_list_archives_with_invalid_cache_lists_repository():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_cache_mock({'last_modified': 'modified', 'archives': [['too', 'short']]})
+    insert_borg_mock('list', LIST_JSON_OUTPUT)
+
+    assert module.list_archives('repo', {}) == (ARCHIVE_ONE, ARCHIVE_TWO)
+
+
+def test_list_archives_a_second_time_in_a_run_asks_borg_only_once():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_cache_mock(None)
+    insert_borg_mock('list', LIST_JSON_OUTPUT)
+
+    module.list_archives('repo', {})
+
+    assert module.list_archives('repo', {}) == (ARCHIVE_ONE, ARCHIVE_TWO)
+
+
+def test_list_archives_without_json_support_lists_archive_names():
+    flexmock(module.version).should_receive('supports_json').and_return(False)
+    flexmock(module.cache).should_receive('read_json_cache_file').never()
+    flexmock(module).should_receive('_run_borg').with_args(
+        'list', 'repo', {}, 'borg1', flags=('--short',)
+    ).and_return(b'host-1\nhost-2\n')
+
+    assert module.list_archives('repo', {}, remote_path='borg1') == (
+        module.Archive('host-1', None, None),
+        module.Archive('host-2', None, None),
+    )
+
+
+def test_run_borg_calls_borg_with_flags_and_remote_path():
+    flexmock(module.execute).should_receive('execute_command_and_capture_output').with_args(
+        ('borg', 'list', '--json', 'repo', '--remote-path', 'borg1'), extra_environment={}
+    ).and_return(b'output').once()
+
+    assert module._run_borg('list', 'repo', {}, 'borg1', flags=('--json',)) == b'output'
+
+
+def test_newest_archive_with_up_to_date_cached_list_uses_it_without_asking_borg():
+    flexmock(module.version).should_receive('supports_archive_filters').and_return(True)
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_cache_mock(None)
+    insert_borg_mock('list', LIST_JSON_OUTPUT)
+    module.list_archives('repo', {})
+    flexmock(module).should_receive('_run_borg').never()
+
+    assert module.newest_archive('repo', {}) == ARCHIVE_TWO
+
+
+def test_newest_archive_asks_borg_for_last_archive_only():
+    flexmock(module.version).should_receive('supports_archive_filters').and_return(True)
+    insert_cache_mock(None)
+    flexmock(module).should_receive('_run_borg').with_args(
+        'list', 'repo', {}, 'borg1', flags=('--json', '--last', '1')
+    ).and_return(
+        b'{"repository": {"last_modified": "modified"}, "archives": [{"name": "host-2", '
+        b'"start": "2018-01-02T03:04:05.000000", "id": "' + b'b' * 64 + b'"}]}'
+    ).once()
+
+    assert module.newest_archive('repo', {}, remote_path='borg1') == ARCHIVE_TWO
+
+
+def test_newest_archive_with_prefix_and_up_to_date_cached_list_returns_newest_matching_archive():
+    flexmock(module.version).should_receive('supports_archive_filters').and_return(True)
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.placeholders).should_receive('expand_placeholders').with_args(
+        '{hostname}-1'
+    ).and_return('host-1')
+    insert_cache_mock(None)
+    insert_borg_mock('list', LIST_JSON_OUTPUT)
+    module.list_archives('repo', {})
+    flexmock(module).should_receive('_run_borg').never()
+
+    assert module.newest_archive('repo', {}, prefix='{hostname}-1') == ARCHIVE_ONE
+
+
+def test_newest_archive_with_unexpandable_prefix_asks_borg_despite_up_to_date_cached_list():
+    flexmock(module.version).should_receive('supports_archive_filters').and_return(True)
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_cache_mock(None)
+    insert_borg_mock('list', LIST_JSON_OUTPUT)
+    module.list_archives('repo', {})
+    flexmock(module).should_receive('_run_borg').with_args(
+        'list', 'repo', {}, None, flags=('--json', '--last', '1', '--prefix', '{now}')
+    ).and_return(b'{"repository": {"last_modified": "modified"}, "archives": []}').once()
+
+    assert module.newest_archive('repo', {}, prefix='{now}') is None
+
+
+def test_newest_archive_with_unchanged_manifest_revalidates_cached_list():
+    flexmock(module.version).should_receive('supports_archive_filters').and_return(True)
+    insert_cache_mock({'last_modified': 'modified', 'archives': [list(ARCHIVE_ONE)]})
+    flexmock(module).should_receive('_run_borg').and_return(
+        b'{"repository": {"last_modified": "modified"}, "archives": [{"name": "host-1", '
+        b'"start": "2018-01-01T03:04:05.000000", "id": "' + b'a' * 64 + b'"}]}'
+    ).once()
+
+    assert module.newest_archive('repo', {}) == ARCHIVE_ONE
+    assert module._read_entry('repo') == ('modified', (ARCHIVE_ONE,), True)
+
+
+def test_newest_archive_with_changed_manifest_does_not_revalidate_cached_list():
+    flexmock(module.version).should_receive('supports_archive_filters').and_return(True)
+    insert_cache_mock({'last_modified': 'old', 'archives': [list(ARCHIVE_ONE)]})
+    flexmock(module).should_receive('_run_borg').and_return(
+        b'{"repository": {"last_modified": "modified"}, "archives": []}'
+    ).once()
+
+    assert module.newest_archive('repo', {}) is None
+    assert module._read_entry('repo')[2] is False
+
+
+def test_newest_archive_without_archive_filters_support_keeps_last_listed_name():
+    flexmock(module.version).should_receive('supports_archive_filters').and_return(False)
+
+    def stream(command, handle_output_line, extra_environment):
+        assert command == ('borg', 'list', '--short', 'repo')
+        for line in (b'host-1\n', b'host-2\n', b'\n'):
+            handle_output_line(line)
+
+    flexmock(module.execute).should_receive('execute_command_and_stream_output').replace_with(
+        stream
+    )
+
+    assert module.newest_archive('repo', {}) == module.Archive('host-2', None, None)
+
+
+def test_newest_archive_without_archive_filters_support_passes_prefix_to_borg():
+    flexmock(module.version).should_receive('supports_archive_filters').and_return(False)
+    flexmock(module.execute).should_receive('execute_command_and_stream_output').with_args(
+        ('borg', 'list', '--short', '--prefix', 'host-', 'repo'), object, extra_environment={}
+    ).once()
+
+    assert module.newest_archive('repo', {}, prefix='host-') is None
+
+
+def test_newest_archive_without_archive_filters_support_and_without_archives_returns_none():
+    flexmock(module.version).should_receive('supports_archive_filters').and_return(False)
+    flexmock(module.execute).should_receive('execute_command_and_stream_output')
+
+    assert module.newest_archive('repo', {}) is None
+
+
+def test_revalidate_archive_list_with_unchanged_manifest_marks_cached_list_up_to_date():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_cache_mock({'last_modified': 'modified', 'archives': [list(ARCHIVE_ONE)]})
+    insert_borg_mock('info', b'{"repository": {"last_modified": "modified"}}')
+
+    module.revalidate_archive_list('repo', {})
+
+    assert module._read_entry('repo') == ('modified', (ARCHIVE_ONE,), True)
+
+
+def test_revalidate_archive_list_with_changed_manifest_leaves_cached_list_stale():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_cache_mock({'last_modified': 'old', 'archives': [list(ARCHIVE_ONE)]})
+    insert_borg_mock('info', b'{"repository": {"last_modified": "modified"}}')
+
+    module.revalidate_archive_list('repo', {})
+
+    assert module._read_entry('repo') == ('old', (ARCHIVE_ONE,), False)
+
+
+def test_revalidate_archive_list_with_up_to_date_cached_list_does_not_ask_borg():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    insert_up_to_date_entry('modified', (ARCHIVE_ONE,))
+    flexmock(module).should_receive('_run_borg').never()
+
+    module.revalidate_archive_list('repo', {})
+
+
+def test_record_created_archive_adds_archive_to_cached_list():
+    insert_up_to_date_entry('modified', (ARCHIVE_ONE,))
+
+    module.record_created_archive('repo', CREATE_JSON_OUTPUT)
+
+    assert module._read_entry('repo') == (
+        'modified-after-create',
+        (ARCHIVE_ONE, ARCHIVE_THREE),
+        True,
+    )
+
+
+def test_record_created_archive_already_in_cached_list_does_not_duplicate_it():
+    insert_up_to_date_entry('modified', (ARCHIVE_THREE,))
+
+    module.record_created_archive('repo', CREATE_JSON_OUTPUT)
+
+    assert module._read_entry('repo') == ('modified-after-create', (ARCHIVE_THREE,), True)
+
+
+def test_record_created_archive_with_stale_cached_list_forgets_it():
+    insert_cache_mock({'last_modified': 'modified', 'archives': [list(ARCHIVE_ONE)]})
+    flexmock(module.cache).should_receive('write_json_cache_file').with_args(str, None).once()
+
+    module.record_created_archive('repo', CREATE_JSON_OUTPUT)
+
+    assert 'repo' not in module._archive_lists
+
+
+def test_record_created_archive_without_cached_list_does_not_cache():
+    flexmock(module.cache).should_receive('read_json_cache_file').and_return(None)
+    flexmock(module.cache).should_receive('write_json_cache_file').never()
+
+    module.record_created_archive('repo', CREATE_JSON_OUTPUT)
+
+
+def test_record_simulated_prune_removes_pruned_archives_and_refreshes_manifest_time():
+    insert_up_to_date_entry('modified', (ARCHIVE_ONE, ARCHIVE_TWO, ARCHIVE_THREE))
+    insert_borg_mock('info', b'{"repository": {"last_modified": "modified-after-prune"}}')
+
+    module.record_simulated_prune('repo', {}, None, (ARCHIVE_ONE, ARCHIVE_TWO))
+
+    assert module._read_entry('repo') == ('modified-after-prune', (ARCHIVE_THREE,), True)
+
+
+def test_record_simulated_prune_with_stale_cached_list_forgets_it():
+    insert_cache_mock({'last_modified': 'modified', 'archives': [list(ARCHIVE_ONE)]})
+    flexmock(module.cache).should_receive('write_json_cache_file').with_args(str, None).once()
+    flexmock(module).should_receive('_run_borg').never()
+
+    module.record_simulated_prune('repo', {}, None, (ARCHIVE_ONE,))
+
+    assert 'repo' not in module._archive_lists
+
+
+def test_record_simulated_prune_without_cached_list_does_not_cache():
+    flexmock(module.cache).should_receive('read_json_cache_file').and_return(None)
+    flexmock(module.cache).should_receive('write_json_cache_file').never()
+    flexmock(module).should_receive('_run_borg').never()
+
+    module.record_simulated_prune('repo', {}, None, (ARCHIVE_ONE,))
+
+
+def test_parse_prune_line_parses_kept_and_pruned_archives():
+    assert module.parse_prune_line(
+        'Keeping archive: host-2          Tue, 2018-01-02 03:04:05 [{}]\n'.format('b' * 64)
+    ) == (True, ARCHIVE_TWO)
+    assert module.parse_prune_line(
+        'Pruning archive (1/2): host-1    Mon, 2018-01-01 03:04:05 [{}]'.format('a' * 64)
+    ) == (False, ARCHIVE_ONE)
+    assert module.parse_prune_line(
+        'Keeping archive (rule: daily #1): host-2    Tue, 2018-01-02 03:04:05 [{}]'.format('b' * 64)
+    ) == (True, ARCHIVE_TWO)
+
+
+def test_parse_prune_line_with_other_line_returns_none():
+    assert module.parse_prune_line('Deleted data: 1.00 MB') is None
+
+
+def test_record_pruned_archives_without_prefix_replaces_cached_list():
+    insert_cache_mock(
+        {'last_modified': 'modified', 'archives': [list(ARCHIVE_ONE), list(ARCHIVE_TWO)]}
+    )
+
+    module.record_pruned_archives('repo', [ARCHIVE_THREE], [ARCHIVE_TWO])
+
+    assert module._read_entry('repo') == (None, (ARCHIVE_THREE,), True)
+
+
+def test_record_pruned_archives_with_prefix_updates_cached_list():
+    other_archive = module.Archive('other-1', '2018-01-01T00:00:00', 'd' * 64)
+    insert_up_to_date_entry('modified', (other_archive, ARCHIVE_ONE))
+
+    module.record_pruned_archives('repo', [ARCHIVE_TWO], [ARCHIVE_ONE], prefix='host-')
+
+    assert module._read_entry('repo') == (None, (other_archive, ARCHIVE_TWO), True)
+
+
+def test_record_pruned_archives_with_prefix_and_stale_cached_list_forgets_it():
+    insert_cache_mock({'last_modified': 'modified', 'archives': [list(ARCHIVE_ONE)]})
+    flexmock(module.cache).should_receive('write_json_cache_file').with_args(str, None).once()
+
+    module.record_pruned_archives('repo', [ARCHIVE_TWO], [ARCHIVE_ONE], prefix='host-')
+
+    assert 'repo' not in module._archive_lists
+
+
+def test_record_pruned_archives_without_cached_list_does_not_cache():
+    flexmock(module.cache).should_receive('read_json_cache_file').and_return(None)
+    flexmock(module.cache).should_receive('write_json_cache_file').never()
+
+    module.record_pruned_archives('repo', [ARCHIVE_TWO], [ARCHIVE_ONE])
+
+
+def test_record_pruned_archives_without_any_archives_forgets_cached_list():
+    insert_cache_mock({'last_modified': 'modified', 'archives': [list(ARCHIVE_ONE)]})
+    flexmock(module.cache).should_receive('write_json_cache_file').with_args(str, None).once()
+
+    module.record_pruned_archives('repo', [], [])
+
+    assert module._read_entry('repo') == ('modified', (ARCHIVE_ONE,), False)
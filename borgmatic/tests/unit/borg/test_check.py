@@ -1,4 +1,3 @@
-from subprocess import STDOUT
 import sys
 
 from flexmock import flexmock
@@ -8,14 +7,19 @@ from borgmatic.borg import check as module
 from borgmatic.verbosity import VERBOSITY_SOME, VERBOSITY_LOTS
 
 
-def insert_subprocess_mock(check_call_command, **kwargs):
-    subprocess = flexmock(module.subprocess)
-    subprocess.should_receive('check_call').with_args(check_call_command, **kwargs).once()
+def insert_execute_command_mock(command, extra_environment={}, **kwargs):
+    flexmock(module.execute).should_receive('execute_command').with_args(
+        command, extra_environment=extra_environment, **kwargs
+    ).once()
 
 
-def insert_subprocess_never():
-    subprocess = flexmock(module.subprocess)
-    subprocess.should_receive('check_call').never()
+def insert_execute_command_never():
+    flexmock(module.execute).should_receive('execute_command').never()
+
+
+def insert_due_checks_mock(checks):
+    flexmock(module).should_receive('_due_checks').and_return(checks)
+    flexmock(module).should_receive('_record_check_times')
 
 
 def test_parse_checks_returns_them_as_tuple():
@@ -72,6 +76,25 @@ def test_make_check_flags_with_default_checks_and_last_returns_last_flag():
     assert flags == ('--last', '3')
 
 
+
+def test_make_check_flags_with_archives_check_and_prefix_returns_prefix_flag():
+    flags = module._make_check_flags(('archives',), prefix='{hostname}-')
+
+    assert flags == ('--archives-only', '--prefix', '{hostname}-')
+
+
+def test_make_check_flags_with_default_checks_and_prefix_returns_prefix_flag():
+    flags = module._make_check_flags(module.DEFAULT_CHECKS, prefix='{hostname}-')
+
+    assert flags == ('--prefix', '{hostname}-')
+
+
+def test_make_check_flags_with_repository_check_and_prefix_omits_prefix_flag():
+    flags = module._make_check_flags(('repository',), prefix='{hostname}-')
+
+    assert flags == ('--repository-only',)
+
+
 @pytest.mark.parametrize(
     'checks',
     (
@@ -85,11 +108,15 @@ def test_check_archives_should_call_borg_with_parameters(checks):
     check_last = flexmock()
     consistency_config = flexmock().should_receive('get').and_return(check_last).mock
     flexmock(module).should_receive('_parse_checks').and_return(checks)
-    flexmock(module).should_receive('_make_check_flags').with_args(checks, check_last).and_return(())
+    insert_due_checks_mock(checks)
+    flexmock(module.placeholders).should_receive('archive_prefix').and_return(None)
+    flexmock(module).should_receive('_make_check_flags').with_args(
+        checks, check_last, None
+    ).and_return(())
     stdout = flexmock()
-    insert_subprocess_mock(
+    insert_execute_command_mock(
         ('borg', 'check', 'repo'),
-        stdout=stdout, stderr=STDOUT,
+        output_file=stdout,
     )
     flexmock(sys.modules['builtins']).should_receive('open').and_return(stdout)
     flexmock(module.os).should_receive('devnull')
@@ -97,6 +124,7 @@ def test_check_archives_should_call_borg_with_parameters(checks):
     module.check_archives(
         verbosity=None,
         repository='repo',
+        storage_config={},
         consistency_config=consistency_config,
     )
 
@@ -106,13 +134,36 @@ def test_check_archives_with_extract_check_should_call_extract_only():
     check_last = flexmock()
     consistency_config = flexmock().should_receive('get').and_return(check_last).mock
     flexmock(module).should_receive('_parse_checks').and_return(checks)
+    insert_due_checks_mock(checks)
     flexmock(module).should_receive('_make_check_flags').never()
     flexmock(module.extract).should_receive('extract_last_archive_dry_run').once()
-    insert_subprocess_never()
+    insert_execute_command_never()
 
     module.check_archives(
         verbosity=None,
         repository='repo',
+        storage_config={},
+        consistency_config=consistency_config,
+    )
+
+
+def test_check_archives_with_extract_check_should_pass_archive_prefix_to_extract():
+    checks = ('extract',)
+    consistency_config = {'checks': ['extract']}
+    flexmock(module).should_receive('_parse_checks').and_return(checks)
+    insert_due_checks_mock(checks)
+    flexmock(module.placeholders).should_receive('archive_prefix').with_args(
+        {'archive_name_format': '{hostname}-{now}'}, None
+    ).and_return('{hostname}-')
+    flexmock(module.extract).should_receive('extract_last_archive_dry_run').with_args(
+        None, 'repo', {'archive_name_format': '{hostname}-{now}'}, None, prefix='{hostname}-'
+    ).once()
+    insert_execute_command_never()
+
+    module.check_archives(
+        verbosity=None,
+        repository='repo',
+        storage_config={'archive_name_format': '{hostname}-{now}'},
         consistency_config=consistency_config,
     )
 
@@ -121,15 +172,17 @@ def test_check_archives_with_verbosity_some_should_call_borg_with_info_parameter
     checks = ('repository',)
     consistency_config = flexmock().should_receive('get').and_return(None).mock
     flexmock(module).should_receive('_parse_checks').and_return(checks)
+    insert_due_checks_mock(checks)
     flexmock(module).should_receive('_make_check_flags').and_return(())
-    insert_subprocess_mock(
+    insert_execute_command_mock(
         ('borg', 'check', 'repo', '--info'),
-        stdout=None, stderr=STDOUT,
+        output_file=None,
     )
 
     module.check_archives(
         verbosity=VERBOSITY_SOME,
         repository='repo',
+        storage_config={},
         consistency_config=consistency_config,
     )
 
@@ -138,15 +191,17 @@ def test_check_archives_with_verbosity_lots_should_call_borg_with_debug_paramete
     checks = ('repository',)
     consistency_config = flexmock().should_receive('get').and_return(None).mock
     flexmock(module).should_receive('_parse_checks').and_return(checks)
+    insert_due_checks_mock(checks)
     flexmock(module).should_receive('_make_check_flags').and_return(())
-    insert_subprocess_mock(
+    insert_execute_command_mock(
         ('borg', 'check', 'repo', '--debug'),
-        stdout=None, stderr=STDOUT,
+        output_file=None,
     )
 
     module.check_archives(
         verbosity=VERBOSITY_LOTS,
         repository='repo',
+        storage_config={},
         consistency_config=consistency_config,
     )
 
@@ -154,11 +209,13 @@ def test_check_archives_with_verbosity_lots_should_call_borg_with_debug_paramete
 def test_check_archives_without_any_checks_should_bail():
     consistency_config = flexmock().should_receive('get').and_return(None).mock
     flexmock(module).should_receive('_parse_checks').and_return(())
-    insert_subprocess_never()
+    insert_due_checks_mock(())
+    insert_execute_command_never()
 
     module.check_archives(
         verbosity=None,
         repository='repo',
+        storage_config={},
         consistency_config=consistency_config,
     )
 
@@ -168,11 +225,15 @@ def test_check_archives_with_remote_path_should_call_borg_with_remote_path_param
     check_last = flexmock()
     consistency_config = flexmock().should_receive('get').and_return(check_last).mock
     flexmock(module).should_receive('_parse_checks').and_return(checks)
-    flexmock(module).should_receive('_make_check_flags').with_args(checks, check_last).and_return(())
+    insert_due_checks_mock(checks)
+    flexmock(module.placeholders).should_receive('archive_prefix').and_return(None)
+    flexmock(module).should_receive('_make_check_flags').with_args(
+        checks, check_last, None
+    ).and_return(())
     stdout = flexmock()
-    insert_subprocess_mock(
+    insert_execute_command_mock(
         ('borg', 'check', 'repo', '--remote-path', 'borg1'),
-        stdout=stdout, stderr=STDOUT,
+        output_file=stdout,
     )
     flexmock(sys.modules['builtins']).should_receive('open').and_return(stdout)
     flexmock(module.os).should_receive('devnull')
@@ -180,6 +241,197 @@ def test_check_archives_with_remote_path_should_call_borg_with_remote_path_param
     module.check_archives(
         verbosity=None,
         repository='repo',
+        storage_config={},
         consistency_config=consistency_config,
         remote_path='borg1',
     )
+
+
+def test_parse_frequency_with_always_returns_none():
+    assert module._parse_frequency('always') is None
+
+
+def test_parse_frequency_without_frequency_returns_none():
+    assert module._parse_frequency(None) is None
+
+
+def test_parse_frequency_returns_seconds():
+    assert module._parse_frequency('3 hours') == 3 * 60 * 60
+
+
+def test_parse_frequency_accepts_abbreviated_units():
+    assert module._parse_frequency('12h') == 12 * 60 * 60
+
+
+def test_parse_frequency_with_invalid_frequency_raises():
+    with pytest.raises(ValueError):
+        module._parse_frequency('weekly')
+
+
+def test_splay_seconds_without_splay_returns_zero():
+    assert module._splay_seconds('repo', None) == 0
+
+
+def test_splay_seconds_is_deterministic_and_within_splay():
+    flexmock(module.socket).should_receive('gethostname').and_return('host')
+
+    splay = module._splay_seconds('repo', '1 day')
+
+    assert 0 <= splay < 24 * 60 * 60
+    assert module._splay_seconds('repo', '1 day') == splay
+
+
+def test_splay_seconds_differs_between_hosts():
+    flexmock(module.socket).should_receive('gethostname').and_return('host1').and_return('host2')
+
+    assert module._splay_seconds('repo', '1 day') != module._splay_seconds('repo', '1 day')
+
+
+def test_read_check_times_omits_invalid_times():
+    flexmock(module.cache).should_receive('read_json_cache_file').and_return(
+        {'repository': 100.5, 'archives': 'bogus'}
+    )
+
+    assert module._read_check_times('repo') == {'repository': 100.5}
+
+
+def test_read_check_times_without_state_file_returns_empty_dict():
+    flexmock(module.cache).should_receive('read_json_cache_file').and_return(None)
+
+    assert module._read_check_times('repo') == {}
+
+
+def test_record_check_times_updates_given_checks_only():
+    flexmock(module).should_receive('_read_check_times').and_return(
+        {'repository': 100, 'extract': 100}
+    )
+    flexmock(module).should_receive('_check_times_filename').and_return('checks.json')
+    flexmock(module.cache).should_receive('write_json_cache_file').with_args(
+        'checks.json', {'repository': 200, 'extract': 100, 'archives': 200}
+    ).once()
+
+    module._record_check_times('repo', ('repository', 'archives'), 200)
+
+
+DAY = 24 * 60 * 60
+
+
+def test_due_checks_without_frequencies_returns_all_checks_without_reading_state():
+    flexmock(module).should_receive('_read_check_times').never()
+
+    checks = module._due_checks('repo', ('repository', 'archives'), {}, now=10 * DAY)
+
+    assert checks == ('repository', 'archives')
+
+
+def test_due_checks_skips_checks_that_succeeded_recently():
+    flexmock(module).should_receive('_read_check_times').and_return(
+        {'repository': 5 * DAY, 'archives': 5 * DAY, 'extract': 9 * DAY}
+    )
+    consistency_config = {
+        'check_frequency': {'repository': '2 weeks', 'archives': '5 days', 'extract': 'always'}
+    }
+
+    checks = module._due_checks(
+        'repo', ('repository', 'archives', 'extract'), consistency_config, now=10 * DAY
+    )
+
+    assert checks == ('archives', 'extract')
+
+
+def test_due_checks_with_check_never_succeeded_returns_it():
+    flexmock(module).should_receive('_read_check_times').and_return({})
+
+    checks = module._due_checks(
+        'repo', ('repository',), {'check_frequency': {'repository': '2 weeks'}}, now=10 * DAY
+    )
+
+    assert checks == ('repository',)
+
+
+def test_due_checks_with_last_success_in_future_returns_check():
+    flexmock(module).should_receive('_read_check_times').and_return({'repository': 20 * DAY})
+
+    checks = module._due_checks(
+        'repo', ('repository',), {'check_frequency': {'repository': '2 weeks'}}, now=10 * DAY
+    )
+
+    assert checks == ('repository',)
+
+
+def test_due_checks_delays_check_by_splay():
+    flexmock(module).should_receive('_read_check_times').and_return({'repository': 0})
+    flexmock(module).should_receive('_splay_seconds').with_args('repo', '2 days').and_return(DAY)
+    consistency_config = {'check_frequency': {'repository': '1 week'}, 'check_splay': '2 days'}
+
+    assert module._due_checks('repo', ('repository',), consistency_config, now=7 * DAY) == ()
+    assert module._due_checks('repo', ('repository',), consistency_config, now=8 * DAY) == (
+        'repository',
+    )
+
+
+def test_due_checks_with_invalid_frequency_raises():
+    with pytest.raises(ValueError):
+        module._due_checks(
+            'repo', ('repository',), {'check_frequency': {'repository': 'weekly'}}, now=0
+        )
+
+
+def test_check_archives_runs_only_due_checks_and_records_them():
+    consistency_config = {'checks': ['repository', 'archives', 'extract']}
+    flexmock(module.time).should_receive('time').and_return(200)
+    flexmock(module.placeholders).should_receive('archive_prefix').and_return(None)
+    flexmock(module).should_receive('_due_checks').with_args(
+        'repo', ('repository', 'archives', 'extract'), consistency_config, 200
+    ).and_return(('archives',))
+    insert_execute_command_mock(
+        ('borg', 'check', 'repo', '--archives-only', '--info'), output_file=None
+    )
+    flexmock(module.extract).should_receive('extract_last_archive_dry_run').never()
+    flexmock(module).should_receive('_record_check_times').with_args(
+        'repo', ('archives',), 200
+    ).once()
+    flexmock(module.execute).should_receive('write_output').with_args(
+        b'repo: Skipping checks that are not due yet: repository, extract\n'
+    ).once()
+
+    module.check_archives(
+        verbosity=VERBOSITY_SOME,
+        repository='repo',
+        storage_config={},
+        consistency_config=consistency_config,
+    )
+
+
+def test_check_archives_records_extract_check_after_it_succeeds():
+    consistency_config = {'checks': ['extract']}
+    flexmock(module.time).should_receive('time').and_return(200)
+    flexmock(module.placeholders).should_receive('archive_prefix').and_return(None)
+    flexmock(module).should_receive('_due_checks').and_return(('extract',))
+    flexmock(module.extract).should_receive('extract_last_archive_dry_run').once()
+    flexmock(module).should_receive('_record_check_times').with_args(
+        'repo', ('extract',), 200
+    ).once()
+
+    module.check_archives(
+        verbosity=None,
+        repository='repo',
+        storage_config={},
+        consistency_config=consistency_config,
+    )
+
+
+def test_check_archives_with_failing_check_does_not_record_it():
+    consistency_config = {'checks': ['repository']}
+    flexmock(module.placeholders).should_receive('archive_prefix').and_return(None)
+    flexmock(module).should_receive('_due_checks').and_return(('repository',))
+    flexmock(module.execute).should_receive('execute_command').and_raise(OSError)
+    flexmock(module).should_receive('_record_check_times').never()
+
+    with pytest.raises(OSError):
+        module.check_archives(
+            verbosity=VERBOSITY_SOME,
+            repository='repo',
+            storage_config={},
+            consistency_config=consistency_config,
+        )
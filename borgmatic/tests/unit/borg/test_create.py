@@ -1,69 +1,75 @@
-import os
-
 from flexmock import flexmock
+import pytest
 
 from borgmatic.borg import create as module
 from borgmatic.verbosity import VERBOSITY_SOME, VERBOSITY_LOTS
 
 
-def test_initialize_with_passphrase_should_set_environment():
-    orig_environ = os.environ
-
-    try:
-        os.environ = {}
-        module.initialize({'encryption_passphrase': 'pass'})
-        assert os.environ.get('BORG_PASSPHRASE') == 'pass'
-    finally:
-        os.environ = orig_environ
-
-
-def test_initialize_without_passphrase_should_not_set_environment():
-    orig_environ = os.environ
+def test_write_exclude_file_does_not_raise():
+    module._exclude_files.clear()
+    temporary_file = flexmock(
+        name='filename',
+        write=lambda mode: None,
+        flush=lambda: None,
+    )
+    flexmock(module.tempfile).should_receive('NamedTemporaryFile').and_return(temporary_file)
 
     try:
-        os.environ = {}
-        module.initialize({})
-        assert os.environ.get('BORG_PASSPHRASE') == None
+        module._write_exclude_file(['exclude'])
     finally:
-        os.environ = orig_environ
+        module._exclude_files.clear()
 
 
-def test_expand_directory_with_basic_path_passes_it_through():
-    flexmock(module.os.path).should_receive('expanduser').and_return('foo')
-    flexmock(module.glob).should_receive('glob').and_return([])
-
-    paths = module._expand_directory('foo')
-
-    assert paths == ['foo']
-
-
-def test_expand_directory_with_glob_expands():
-    flexmock(module.os.path).should_receive('expanduser').and_return('foo*')
-    flexmock(module.glob).should_receive('glob').and_return(['foo', 'food'])
-
-    paths = module._expand_directory('foo*')
-
-    assert paths == ['foo', 'food']
-
-
-def test_write_exclude_file_does_not_raise():
+def test_write_exclude_file_with_same_exclude_patterns_reuses_file():
+    module._exclude_files.clear()
     temporary_file = flexmock(
         name='filename',
         write=lambda mode: None,
         flush=lambda: None,
     )
-    flexmock(module.tempfile).should_receive('NamedTemporaryFile').and_return(temporary_file)
+    flexmock(module.tempfile).should_receive('NamedTemporaryFile').and_return(
+        temporary_file
+    ).once()
 
-    module._write_exclude_file(['exclude'])
+    try:
+        assert module._write_exclude_file(['exclude']) is temporary_file
+        assert module._write_exclude_file(('exclude',)) is temporary_file
+    finally:
+        module._exclude_files.clear()
 
 
 def test_write_exclude_file_with_empty_exclude_patterns_does_not_raise():
     module._write_exclude_file([])
 
 
-def insert_subprocess_mock(check_call_command, **kwargs):
-    subprocess = flexmock(module.subprocess)
-    subprocess.should_receive('check_call').with_args(check_call_command, **kwargs).once()
+def insert_execute_command_mock(command, extra_environment={}, **kwargs):
+    '''
+    Mock running the given Borg create command with a Borg version that doesn't support --json.
+    '''
+    flexmock(module.version).should_receive('supports_json').and_return(False)
+    flexmock(module.execute).should_receive('execute_command').with_args(
+        command, extra_environment=extra_environment, **kwargs
+    ).once()
+
+
+def insert_execute_command_and_capture_output_mock(
+    command, output, extra_environment={}, handle_stderr_line=None
+):
+    '''
+    Mock running the given Borg create command with a Borg version that supports --json, returning
+    the given output.
+    '''
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.execute).should_receive('execute_command_and_capture_output').with_args(
+        command, extra_environment=extra_environment, handle_stderr_line=handle_stderr_line
+    ).and_return(output).once()
+    flexmock(module.estimate).should_receive('write_throughput')
+    flexmock(module.archives).should_receive('revalidate_archive_list').with_args(
+        'repo', {}, None
+    ).once()
+    flexmock(module.archives).should_receive('record_created_archive').with_args(
+        'repo', output
+    ).once()
 
 
 def test_make_exclude_flags_includes_exclude_patterns_filename_when_given():
@@ -141,10 +147,10 @@ CREATE_COMMAND = ('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'fo
 
 
 def test_create_archive_calls_borg_with_parameters():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(CREATE_COMMAND)
+    insert_execute_command_mock(CREATE_COMMAND)
 
     module.create_archive(
         verbosity=None,
@@ -160,10 +166,10 @@ def test_create_archive_calls_borg_with_parameters():
 
 def test_create_archive_with_exclude_patterns_calls_borg_with_excludes():
     exclude_flags = ('--exclude-from', 'excludes')
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(flexmock(name='/tmp/excludes'))
     flexmock(module).should_receive('_make_exclude_flags').and_return(exclude_flags)
-    insert_subprocess_mock(CREATE_COMMAND + exclude_flags)
+    insert_execute_command_mock(CREATE_COMMAND + exclude_flags)
 
     module.create_archive(
         verbosity=None,
@@ -178,10 +184,10 @@ def test_create_archive_with_exclude_patterns_calls_borg_with_excludes():
 
 
 def test_create_archive_with_verbosity_some_calls_borg_with_info_parameter():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(CREATE_COMMAND + ('--info', '--stats',))
+    insert_execute_command_mock(CREATE_COMMAND + ('--info', '--stats',))
 
     module.create_archive(
         verbosity=VERBOSITY_SOME,
@@ -196,10 +202,10 @@ def test_create_archive_with_verbosity_some_calls_borg_with_info_parameter():
 
 
 def test_create_archive_with_verbosity_lots_calls_borg_with_debug_parameter():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(CREATE_COMMAND + ('--debug', '--list', '--stats'))
+    insert_execute_command_mock(CREATE_COMMAND + ('--debug', '--list', '--stats'))
 
     module.create_archive(
         verbosity=VERBOSITY_LOTS,
@@ -214,10 +220,10 @@ def test_create_archive_with_verbosity_lots_calls_borg_with_debug_parameter():
 
 
 def test_create_archive_with_compression_calls_borg_with_compression_parameters():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(CREATE_COMMAND + ('--compression', 'rle'))
+    insert_execute_command_mock(CREATE_COMMAND + ('--compression', 'rle'))
 
     module.create_archive(
         verbosity=None,
@@ -232,10 +238,10 @@ def test_create_archive_with_compression_calls_borg_with_compression_parameters(
 
 
 def test_create_archive_with_one_file_system_calls_borg_with_one_file_system_parameters():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(CREATE_COMMAND + ('--one-file-system',))
+    insert_execute_command_mock(CREATE_COMMAND + ('--one-file-system',))
 
     module.create_archive(
         verbosity=None,
@@ -251,10 +257,10 @@ def test_create_archive_with_one_file_system_calls_borg_with_one_file_system_par
 
 
 def test_create_archive_with_remote_path_calls_borg_with_remote_path_parameters():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(CREATE_COMMAND + ('--remote-path', 'borg1'))
+    insert_execute_command_mock(CREATE_COMMAND + ('--remote-path', 'borg1'))
 
     module.create_archive(
         verbosity=None,
@@ -270,10 +276,10 @@ def test_create_archive_with_remote_path_calls_borg_with_remote_path_parameters(
 
 
 def test_create_archive_with_umask_calls_borg_with_umask_parameters():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(CREATE_COMMAND + ('--umask', '740'))
+    insert_execute_command_mock(CREATE_COMMAND + ('--umask', '740'))
 
     module.create_archive(
         verbosity=None,
@@ -287,12 +293,29 @@ def test_create_archive_with_umask_calls_borg_with_umask_parameters():
     )
 
 
+def test_create_archive_with_encryption_passphrase_calls_borg_with_passphrase_environment():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    insert_execute_command_mock(CREATE_COMMAND, extra_environment={'BORG_PASSPHRASE': 'pass'})
+
+    module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={
+            'source_directories': ['foo', 'bar'],
+            'repositories': ['repo'],
+            'exclude_patterns': None,
+        },
+        storage_config={'encryption_passphrase': 'pass'},
+    )
+
+
 def test_create_archive_with_source_directories_glob_expands():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo', 'food'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'food'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'foo', 'food'))
-    flexmock(module.glob).should_receive('glob').with_args('foo*').and_return(['foo', 'food'])
+    insert_execute_command_mock(('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'foo', 'food'))
 
     module.create_archive(
         verbosity=None,
@@ -307,11 +330,10 @@ def test_create_archive_with_source_directories_glob_expands():
 
 
 def test_create_archive_with_non_matching_source_directories_glob_passes_through():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo*'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo*',))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'foo*'))
-    flexmock(module.glob).should_receive('glob').with_args('foo*').and_return([])
+    insert_execute_command_mock(('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'foo*'))
 
     module.create_archive(
         verbosity=None,
@@ -326,10 +348,10 @@ def test_create_archive_with_non_matching_source_directories_glob_passes_through
 
 
 def test_create_archive_with_glob_calls_borg_with_expanded_directories():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo', 'food'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'food'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'foo', 'food'))
+    insert_execute_command_mock(('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'foo', 'food'))
 
     module.create_archive(
         verbosity=None,
@@ -343,11 +365,182 @@ def test_create_archive_with_glob_calls_borg_with_expanded_directories():
     )
 
 
+def test_create_archive_calls_borg_without_overlapping_source_directories():
+    flexmock(module.expand).should_receive('expand_directories').and_return(
+        ('foo', 'foo/bar', 'baz')
+    )
+    flexmock(module.expand).should_receive('deduplicate_directories').with_args(
+        ('foo', 'foo/bar', 'baz'), one_file_system=False
+    ).and_return((('foo', 'baz'), (('foo/bar', 'Already backed up as part of foo'),)))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    insert_execute_command_mock(('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'foo', 'baz'))
+    flexmock(module.execute).should_receive('write_output').never()
+
+    module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={
+            'source_directories': ['foo', 'foo/bar', 'baz'],
+            'repositories': ['repo'],
+            'exclude_patterns': None,
+        },
+        storage_config={},
+    )
+
+
+def test_create_archive_with_verbosity_some_displays_dropped_source_directories():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'foo/bar'))
+    flexmock(module.expand).should_receive('deduplicate_directories').with_args(
+        ('foo', 'foo/bar'), one_file_system=True
+    ).and_return((('foo',), (('foo/bar', 'Already backed up as part of foo'),)))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    insert_execute_command_mock(
+        ('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'foo', '--one-file-system', '--info', '--stats')
+    )
+    flexmock(module.execute).should_receive('write_output').with_args(
+        b'Skipping source foo/bar: Already backed up as part of foo\n'
+    ).once()
+
+    module.create_archive(
+        verbosity=VERBOSITY_SOME,
+        repository='repo',
+        location_config={
+            'source_directories': ['foo', 'foo/bar'],
+            'repositories': ['repo'],
+            'exclude_patterns': None,
+            'one_file_system': True,
+        },
+        storage_config={},
+    )
+
+
+def test_create_archive_calls_borg_without_excluded_source_directories():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module.exclude).should_receive('skip_excluded_directories').with_args(
+        ('foo', 'bar'), ('pp:/bar',), dict
+    ).and_return((('foo',), (('bar', 'Excluded by pattern bar'),)))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    insert_execute_command_mock(
+        ('borg', 'create', 'repo::{}'.format(DEFAULT_ARCHIVE_NAME), 'foo', '--info', '--stats')
+    )
+    flexmock(module.execute).should_receive('write_output').with_args(
+        b'Skipping source bar: Excluded by pattern bar\n'
+    ).once()
+
+    module.create_archive(
+        verbosity=VERBOSITY_SOME,
+        repository='repo',
+        location_config={
+            'source_directories': ['foo', 'bar'],
+            'repositories': ['repo'],
+            'exclude_patterns': ['bar'],
+        },
+        storage_config={},
+    )
+
+
+def test_create_archive_with_skip_unchanged_and_unchanged_sources_skips_borg():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module.scan).should_receive('scan_directories').and_return(())
+    flexmock(module.source_manifest).should_receive('make_key').and_return(b'key')
+    flexmock(module.source_manifest).should_receive('pack_statuses').and_return(b'body')
+    flexmock(module.source_manifest).should_receive('is_unchanged').with_args(
+        'repo', b'key', b'body', 7 * 24 * 60 * 60
+    ).and_return(True)
+    flexmock(module.execute).should_receive('execute_command').never()
+    flexmock(module.execute).should_receive('execute_command_and_capture_output').never()
+    flexmock(module.source_manifest).should_receive('write_manifest').never()
+
+    archive_stats = module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={
+            'source_directories': ['foo', 'bar'],
+            'repositories': ['repo'],
+            'skip_unchanged': True,
+            'skip_unchanged_max_age': '1 week',
+        },
+        storage_config={},
+    )
+
+    assert archive_stats is None
+
+
+def test_create_archive_with_skip_unchanged_and_changed_sources_calls_borg_and_writes_manifest():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    flexmock(module.scan).should_receive('scan_directories').and_return(())
+    flexmock(module.source_manifest).should_receive('make_key').and_return(b'key')
+    flexmock(module.source_manifest).should_receive('pack_statuses').and_return(b'body')
+    flexmock(module.source_manifest).should_receive('is_unchanged').with_args(
+        'repo', b'key', b'body', None
+    ).and_return(False)
+    insert_execute_command_mock(CREATE_COMMAND)
+    flexmock(module.source_manifest).should_receive('write_manifest').with_args(
+        'repo', b'key', b'body', float
+    ).once()
+
+    module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={
+            'source_directories': ['foo', 'bar'],
+            'repositories': ['repo'],
+            'skip_unchanged': True,
+        },
+        storage_config={},
+    )
+
+
+def test_create_archive_with_skip_unchanged_and_borg_error_does_not_write_manifest():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    flexmock(module.scan).should_receive('scan_directories').and_return(())
+    flexmock(module.source_manifest).should_receive('is_unchanged').and_return(False)
+    flexmock(module.version).should_receive('supports_json').and_return(False)
+    flexmock(module.execute).should_receive('execute_command').and_raise(OSError)
+    flexmock(module.source_manifest).should_receive('write_manifest').never()
+
+    with pytest.raises(OSError):
+        module.create_archive(
+            verbosity=None,
+            repository='repo',
+            location_config={
+                'source_directories': ['foo', 'bar'],
+                'repositories': ['repo'],
+                'skip_unchanged': True,
+            },
+            storage_config={},
+        )
+
+
+def test_create_archive_without_skip_unchanged_does_not_scan():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    flexmock(module.scan).should_receive('scan_directories').never()
+    flexmock(module.source_manifest).should_receive('write_manifest').never()
+    insert_execute_command_mock(CREATE_COMMAND)
+
+    module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={'source_directories': ['foo', 'bar'], 'repositories': ['repo']},
+        storage_config={},
+    )
+
+
 def test_create_archive_with_archive_name_format_calls_borg_with_archive_name():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(('borg', 'create', 'repo::ARCHIVE_NAME', 'foo', 'bar'))
+    insert_execute_command_mock(('borg', 'create', 'repo::ARCHIVE_NAME', 'foo', 'bar'))
 
     module.create_archive(
         verbosity=None,
@@ -364,10 +557,10 @@ def test_create_archive_with_archive_name_format_calls_borg_with_archive_name():
 
 
 def test_create_archive_with_archive_name_format_accepts_borg_placeholders():
-    flexmock(module).should_receive('_expand_directory').and_return(['foo']).and_return(['bar'])
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
     flexmock(module).should_receive('_write_exclude_file').and_return(None)
     flexmock(module).should_receive('_make_exclude_flags').and_return(())
-    insert_subprocess_mock(('borg', 'create', 'repo::Documents_{hostname}-{now}', 'foo', 'bar'))
+    insert_execute_command_mock(('borg', 'create', 'repo::Documents_{hostname}-{now}', 'foo', 'bar'))
 
     module.create_archive(
         verbosity=None,
@@ -381,3 +574,146 @@ def test_create_archive_with_archive_name_format_accepts_borg_placeholders():
             'archive_name_format': 'Documents_{hostname}-{now}',
         },
     )
+
+
+CREATE_JSON_OUTPUT = b'''{
+    "archive": {
+        "name": "host-2017-10-01",
+        "duration": 2.0,
+        "stats": {
+            "original_size": 2000,
+            "compressed_size": 1000,
+            "deduplicated_size": 500,
+            "nfiles": 10
+        }
+    }
+}'''
+
+
+def test_create_archive_with_json_support_calls_borg_with_json_parameter_and_returns_stats():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    insert_execute_command_and_capture_output_mock(CREATE_COMMAND + ('--json',), CREATE_JSON_OUTPUT)
+    flexmock(module.execute).should_receive('write_output').never()
+
+    archive_stats = module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={
+            'source_directories': ['foo', 'bar'],
+            'repositories': ['repo'],
+            'exclude_patterns': None,
+        },
+        storage_config={},
+    )
+
+    assert archive_stats.archive_name == 'host-2017-10-01'
+    assert archive_stats.original_size == 2000
+    assert archive_stats.compressed_size == 1000
+    assert archive_stats.deduplicated_size == 500
+    assert archive_stats.file_count == 10
+    assert archive_stats.duration == 2.0
+    assert archive_stats.throughput == 1000
+
+
+def test_create_archive_with_json_support_and_verbosity_some_displays_stats_without_stats_parameter():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    insert_execute_command_and_capture_output_mock(
+        CREATE_COMMAND + ('--info', '--json'), CREATE_JSON_OUTPUT
+    )
+    flexmock(module.execute).should_receive('write_output').once()
+
+    module.create_archive(
+        verbosity=VERBOSITY_SOME,
+        repository='repo',
+        location_config={
+            'source_directories': ['foo', 'bar'],
+            'repositories': ['repo'],
+            'exclude_patterns': None,
+        },
+        storage_config={},
+    )
+
+
+def test_create_archive_without_json_support_returns_none():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    insert_execute_command_mock(CREATE_COMMAND)
+
+    archive_stats = module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={
+            'source_directories': ['foo', 'bar'],
+            'repositories': ['repo'],
+            'exclude_patterns': None,
+        },
+        storage_config={},
+    )
+
+    assert archive_stats is None
+
+
+def test_create_archive_with_json_support_records_throughput():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    insert_execute_command_and_capture_output_mock(CREATE_COMMAND + ('--json',), CREATE_JSON_OUTPUT)
+    flexmock(module.estimate).should_receive('write_throughput').with_args(
+        'repo', module.stats.Archive_stats
+    ).once()
+
+    module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={'source_directories': ['foo', 'bar'], 'repositories': ['repo']},
+        storage_config={},
+    )
+
+
+def test_create_archive_with_progress_and_json_support_displays_estimate_and_handles_progress():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    flexmock(module.scan).should_receive('scan_directories').and_return(())
+    flexmock(module.estimate).should_receive('read_throughput').and_return(1000)
+    flexmock(module.estimate).should_receive('format_estimate').and_return('estimate\n')
+    flexmock(module.execute).should_receive('write_output').with_args(b'estimate\n').once()
+    handle_line = flexmock()
+    flexmock(module.estimate).should_receive('make_progress_handler').and_return(handle_line)
+    insert_execute_command_and_capture_output_mock(
+        CREATE_COMMAND + ('--progress', '--log-json', '--json'),
+        CREATE_JSON_OUTPUT,
+        handle_stderr_line=handle_line,
+    )
+
+    module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={'source_directories': ['foo', 'bar'], 'repositories': ['repo']},
+        storage_config={},
+        progress=True,
+    )
+
+
+def test_create_archive_with_progress_and_without_json_support_leaves_progress_to_borg():
+    flexmock(module.expand).should_receive('expand_directories').and_return(('foo', 'bar'))
+    flexmock(module).should_receive('_write_exclude_file').and_return(None)
+    flexmock(module).should_receive('_make_exclude_flags').and_return(())
+    flexmock(module.scan).should_receive('scan_directories').and_return(())
+    flexmock(module.estimate).should_receive('read_throughput').and_return(None)
+    flexmock(module.execute).should_receive('write_output').once()
+    flexmock(module.estimate).should_receive('make_progress_handler').never()
+    insert_execute_command_mock(CREATE_COMMAND + ('--progress',))
+
+    module.create_archive(
+        verbosity=None,
+        repository='repo',
+        location_config={'source_directories': ['foo', 'bar'], 'repositories': ['repo']},
+        storage_config={},
+        progress=True,
+    )
@@ -0,0 +1,13 @@
+from borgmatic.borg import environment as module
+
+
+def test_make_environment_with_passphrase_includes_borg_passphrase():
+    environment = module.make_environment({'encryption_passphrase': 'pass'})
+
+    assert environment == {'BORG_PASSPHRASE': 'pass'}
+
+
+def test_make_environment_without_passphrase_is_empty():
+    environment = module.make_environment({'compression': 'lz4'})
+
+    assert environment == {}
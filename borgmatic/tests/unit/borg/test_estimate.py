@@ -0,0 +1,146 @@
+import json
+import stat
+
+from flexmock import flexmock
+
+from borgmatic.borg import estimate as module
+from borgmatic.borg import scan, stats
+
+
+def make_status(path, size, mode=stat.S_IFREG | 0o644):
+    return scan.File_status(path, 1, size, 0, 0, mode)
+
+
+def test_estimate_size_counts_regular_files_only():
+    size_estimate = module.estimate_size(
+        (
+            make_status('/foo', 4096, stat.S_IFDIR | 0o755),
+            make_status('/foo/bar', 1000),
+            make_status('/foo/baz', 500),
+            make_status('/foo/link', 10, stat.S_IFLNK | 0o777),
+        )
+    )
+
+    assert size_estimate == module.Size_estimate(file_count=2, total_size=1500)
+
+
+def test_read_throughput_returns_recorded_throughput():
+    flexmock(module.cache).should_receive('read_json_cache_file').and_return(1000.5)
+
+    assert module.read_throughput('repo') == 1000.5
+
+
+def test_read_throughput_with_missing_or_invalid_record_returns_none():
+    for record in (None, 'fast', True, 0, -5, [1]):
+        flexmock(module.cache).should_receive('read_json_cache_file').and_return(record)
+
+        assert module.read_throughput('repo') is None
+
+
+def test_write_throughput_records_archive_throughput():
+    flexmock(module.cache).should_receive('write_json_cache_file').with_args(str, 1000.0).once()
+
+    module.write_throughput('repo', stats.Archive_stats('archive', 2000, 1000, 500, 10, 2.0))
+
+
+def test_write_throughput_without_duration_does_not_record():
+    flexmock(module.cache).should_receive('write_json_cache_file').never()
+
+    module.write_throughput('repo', stats.Archive_stats('archive', 2000, 1000, 500, 10, None))
+
+
+def test_format_duration_formats_seconds_minutes_and_hours():
+    assert module.format_duration(42.4) == '42s'
+    assert module.format_duration(200) == '3m 20s'
+    assert module.format_duration(3900) == '1h 05m'
+
+
+def test_format_estimate_with_throughput_includes_duration():
+    description = module.format_estimate(
+        'repo', module.Size_estimate(file_count=3, total_size=600 * 1000), 1000
+    )
+
+    assert description.startswith('repo: 3 files, ')
+    assert description.endswith('; estimated 10m 00s at {}/s\n'.format(stats.format_size(1000)))
+
+
+def test_format_estimate_without_throughput_says_so():
+    description = module.format_estimate(
+        'repo', module.Size_estimate(file_count=3, total_size=600), None
+    )
+
+    assert description.endswith('; no previous throughput to estimate the duration from\n')
+
+
+def test_format_progress_estimates_time_remaining():
+    line = module.format_progress(
+        module.Size_estimate(file_count=10, total_size=1000), 250, 3, 30
+    )
+
+    assert line.startswith('25%: 3 of 10 files, ')
+    assert line.endswith(', 1m 30s remaining\n')
+
+
+def test_format_progress_without_progress_omits_time_remaining():
+    line = module.format_progress(module.Size_estimate(file_count=10, total_size=1000), 0, 0, 30)
+
+    assert line.startswith('0%: 0 of 10 files, ')
+    assert 'remaining' not in line
+
+
+def test_format_progress_caps_fraction_at_estimate():
+    line = module.format_progress(module.Size_estimate(file_count=1, total_size=1000), 2000, 1, 30)
+
+    assert line.startswith('100%: ')
+    assert line.endswith(', 0s remaining\n')
+
+
+def test_format_progress_with_empty_estimate_omits_percentage():
+    line = module.format_progress(module.Size_estimate(file_count=0, total_size=0), 0, 2, 30)
+
+    assert line.startswith('2 files, ')
+
+
+def make_line(**message):
+    return json.dumps(message).encode('utf-8') + b'\n'
+
+
+def test_progress_handler_writes_progress_lines_at_most_once_per_interval():
+    output = []
+    flexmock(module.time).should_receive('monotonic').and_return(0).and_return(1).and_return(
+        2
+    ).and_return(7)
+    handle_line = module.make_progress_handler(
+        module.Size_estimate(file_count=10, total_size=1000), output.append, interval=5
+    )
+
+    for original_size in (100, 200, 300):
+        handle_line(make_line(type='archive_progress', original_size=original_size, nfiles=1))
+
+    assert len(output) == 2
+    assert output[0].startswith(b'10%: ')
+    assert output[1].startswith(b'30%: ')
+
+
+def test_progress_handler_skips_finished_progress_message():
+    output = []
+    handle_line = module.make_progress_handler(
+        module.Size_estimate(file_count=10, total_size=1000), output.append
+    )
+
+    handle_line(make_line(type='archive_progress', finished=True))
+
+    assert output == []
+
+
+def test_progress_handler_writes_other_messages_as_text():
+    output = []
+    handle_line = module.make_progress_handler(
+        module.Size_estimate(file_count=10, total_size=1000), output.append
+    )
+
+    handle_line(make_line(type='log_message', levelname='WARNING', message='foo: not found'))
+    handle_line(make_line(type='file_status', status='A', path='foo/bar'))
+    handle_line(b'Not JSON\n')
+
+    assert output == [b'foo: not found\n', b'A foo/bar\n', b'Not JSON\n']
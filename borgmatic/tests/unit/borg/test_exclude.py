@@ -0,0 +1,211 @@
+from io import StringIO
+import sys
+
+import pytest
+from flexmock import flexmock
+
+from borgmatic.borg import exclude as module
+
+
+@pytest.mark.parametrize(
+    'pattern,path,matches',
+    (
+        ('/var/cache', 'var/cache', True),
+        ('/var/cache', 'var/cache/foo', True),
+        ('/var/cache', 'var/cached', False),
+        ('/var', 'var/cache', True),
+        ('var/cache', 'var/cache', True),
+        ('/var/cache/', 'var/cache', False),
+        ('/home/*/.cache', 'home/user/.cache', True),
+        ('/home/*/.cache', 'home/user', False),
+        ('*.pyc', 'foo/bar.pyc', True),
+        ('fm:/var/*', 'var/cache', True),
+        ('pp:/var', 'var/cache', True),
+        ('pp:/var', 'variable', False),
+        ('pp:/var/', 'var', True),
+        ('pf:/var/cache', 'var/cache', True),
+        ('pf:/var', 'var/cache', False),
+        ('re:^var/c', 'var/cache', True),
+        ('re:cache$', 'var/cache', True),
+        ('re:^cache', 'var/cache', False),
+    ),
+)
+def test_compile_pattern_matches_like_borg(pattern, path, matches):
+    assert module.compile_pattern(pattern)(path) is matches
+
+
+def test_compile_pattern_with_unsupported_style_returns_none():
+    assert module.compile_pattern('sh:/var/**') is None
+
+
+def test_compile_pattern_with_invalid_regex_returns_none():
+    assert module.compile_pattern('re:[') is None
+
+
+def test_compile_pattern_with_empty_pattern_returns_none():
+    assert module.compile_pattern('pp:') is None
+
+
+def test_normalize_path_strips_leading_separator():
+    assert module.normalize_path('/var//cache/') == 'var/cache'
+
+
+def test_read_exclude_patterns_without_patterns_returns_empty_list():
+    assert module.read_exclude_patterns({}) == ([], ())
+
+
+def test_read_exclude_patterns_combines_patterns_and_files_skipping_comments():
+    builtins = flexmock(sys.modules['builtins'])
+    builtins.should_receive('open').with_args('excludes').and_return(
+        StringIO('/foo\n\n# comment\n  /bar  \n')
+    )
+
+    patterns = module.read_exclude_patterns(
+        {'exclude_patterns': ['/baz'], 'exclude_from': ['excludes']}
+    )
+
+    assert patterns == (['/baz', '/foo', '/bar'], ())
+
+
+def test_read_exclude_patterns_returns_unreadable_file_separately():
+    builtins = flexmock(sys.modules['builtins'])
+    builtins.should_receive('open').with_args('excludes').and_raise(OSError)
+
+    assert module.read_exclude_patterns({'exclude_from': ['excludes']}) == ([], ('excludes',))
+
+
+@pytest.mark.parametrize(
+    'pattern,canonical_pattern',
+    (
+        ('/var/cache', ('pp', '/var/cache')),
+        ('var//cache/', ('fm', '/var/cache/')),
+        ('fm:/var/cache', ('pp', '/var/cache')),
+        ('pp:var/cache/', ('pp', '/var/cache')),
+        ('pf:/var/./cache', ('pf', '/var/cache')),
+        ('*.pyc', ('fm', '/*.pyc')),
+        ('sh:/home/**/.cache', ('sh', '/home/**/.cache')),
+        ('re:^var/', ('re', '^var/')),
+        ('/', ('fm', '/')),
+    ),
+)
+def test_canonicalize_pattern_returns_style_and_normalized_body(pattern, canonical_pattern):
+    assert module._canonicalize_pattern(pattern) == canonical_pattern
+
+
+@pytest.mark.parametrize(
+    'style,body,directory',
+    (
+        ('pp', '/var/cache', '/var/cache'),
+        ('pf', '/var/cache', '/var/cache'),
+        ('fm', '/home/*/.cache', '/home'),
+        ('fm', '/home/user*', '/home'),
+        ('fm', '/var/cache/', '/var/cache'),
+        ('fm', '/*.pyc', None),
+        ('sh', '/home/**/.cache', '/home'),
+        ('re', '^var/', None),
+    ),
+)
+def test_literal_directory_returns_directory_containing_all_matches(style, body, directory):
+    assert module._literal_directory(style, body) == directory
+
+
+def test_compile_exclude_patterns_removes_duplicates():
+    assert module._compile_exclude_patterns(('/var', 'fm:/var/', '/var', 'var', 'pp:/var')) == (
+        ('pp:/var',),
+        ('/var', 'var', 'pp:/var', 'fm:/var/'),
+    )
+
+
+def test_compile_exclude_patterns_removes_patterns_within_path_prefixes():
+    assert module._compile_exclude_patterns(
+        ('/home/*/.cache', '/home/user/.cache', 'pf:/home/user', '/home', '/homeless/*', '*.pyc')
+    ) == (
+        ('pp:/home', 'fm:/homeless/*', 'fm:/*.pyc'),
+        ('/home/*/.cache', '/home/user/.cache', 'pf:/home/user'),
+    )
+
+
+def test_compile_exclude_patterns_orders_cheapest_patterns_first():
+    assert module._compile_exclude_patterns(
+        ('re:foo', 'sh:/bar/**', '*.pyc', '/baz', 'pf:/quux')
+    ) == (('pf:/quux', 'pp:/baz', 'fm:/*.pyc', 'sh:/bar/**', 're:foo'), ())
+
+
+def test_compile_exclude_patterns_caches_by_content():
+    flexmock(module).should_receive('_compile_exclude_patterns').and_return(
+        (('pp:/unique-for-test',), ())
+    ).once()
+
+    assert module.compile_exclude_patterns(['/unique-for-test']) == (('pp:/unique-for-test',), ())
+    assert module.compile_exclude_patterns(('/unique-for-test',)) == (('pp:/unique-for-test',), ())
+
+
+def test_skip_excluded_directories_without_excludes_keeps_all_directories():
+    flexmock(module).should_receive('_exclusion_reason').never()
+
+    assert module.skip_excluded_directories(('foo', 'bar'), (), {}) == (('foo', 'bar'), ())
+
+
+def test_skip_excluded_directories_drops_directories_with_reasons():
+    flexmock(module).should_receive('_exclusion_reason').with_args(
+        'foo', tuple, dict
+    ).and_return(None)
+    flexmock(module).should_receive('_exclusion_reason').with_args(
+        'bar', tuple, dict
+    ).and_return('Excluded by pattern bar')
+
+    assert module.skip_excluded_directories(('foo', 'bar'), ('bar',), {}) == (
+        ('foo',),
+        (('bar', 'Excluded by pattern bar'),),
+    )
+
+
+def test_skip_excluded_directories_with_every_directory_excluded_keeps_all_directories():
+    flexmock(module).should_receive('_exclusion_reason').and_return('Excluded by pattern *')
+
+    assert module.skip_excluded_directories(('foo', 'bar'), ('*',), {}) == (
+        ('foo', 'bar'),
+        (),
+    )
+
+
+def test_exclusion_reason_with_matching_pattern_returns_pattern():
+    matchers = (('/foo', lambda path: False), ('/bar', lambda path: path == 'bar'))
+
+    assert module._exclusion_reason('/bar', matchers, {}) == 'Excluded by pattern /bar'
+
+
+def test_exclusion_reason_with_exclude_if_present_file_returns_it():
+    flexmock(module.os.path).should_receive('islink').and_return(False)
+    flexmock(module.os.path).should_receive('isdir').and_return(True)
+    flexmock(module.os.path).should_receive('lexists').with_args('/foo/.nobackup').and_return(True)
+
+    assert (
+        module._exclusion_reason('/foo', (), {'exclude_if_present': '.nobackup'})
+        == 'Contains .nobackup'
+    )
+
+
+def test_exclusion_reason_with_symlink_does_not_check_exclude_if_present():
+    flexmock(module.os.path).should_receive('islink').and_return(True)
+    flexmock(module.os.path).should_receive('lexists').never()
+
+    assert module._exclusion_reason('/foo', (), {'exclude_if_present': '.nobackup'}) is None
+
+
+def test_exclusion_reason_with_cache_directory_and_exclude_caches_returns_tag():
+    flexmock(module.os.path).should_receive('islink').and_return(False)
+    flexmock(module.os.path).should_receive('isdir').and_return(True)
+    flexmock(module).should_receive('is_cache_directory').and_return(True)
+
+    assert (
+        module._exclusion_reason('/foo', (), {'exclude_caches': True}) == 'Contains CACHEDIR.TAG'
+    )
+
+
+def test_exclusion_reason_with_cache_directory_and_without_exclude_caches_returns_none():
+    flexmock(module.os.path).should_receive('islink').and_return(False)
+    flexmock(module.os.path).should_receive('isdir').and_return(True)
+    flexmock(module).should_receive('is_cache_directory').never()
+
+    assert module._exclusion_reason('/foo', (), {}) is None
@@ -0,0 +1,155 @@
+from flexmock import flexmock
+
+from borgmatic.borg import expand as module
+
+
+def test_expand_directory_with_basic_path_passes_it_through():
+    flexmock(module.os.path).should_receive('expanduser').and_return('foo')
+    flexmock(module).should_receive('_expand_pattern').never()
+
+    paths = module.expand_directory('foo')
+
+    assert paths == ['foo']
+
+
+def test_expand_directory_with_glob_expands():
+    flexmock(module.os.path).should_receive('expanduser').and_return('foo*')
+    flexmock(module).should_receive('_expand_pattern').and_return(['foo', 'food'])
+
+    paths = module.expand_directory('foo*')
+
+    assert paths == ['foo', 'food']
+
+
+def test_expand_directory_with_non_matching_glob_passes_it_through():
+    flexmock(module.os.path).should_receive('expanduser').and_return('foo*')
+    flexmock(module).should_receive('_expand_pattern').and_return([])
+
+    paths = module.expand_directory('foo*')
+
+    assert paths == ['foo*']
+
+
+def test_deduplicate_directories_without_overlap_keeps_all_directories():
+    flexmock(module).should_receive('_canonical_path').replace_with(lambda path: '/' + path)
+
+    assert module.deduplicate_directories(('foo', 'bar', 'foobar')) == (
+        ('foo', 'bar', 'foobar'),
+        (),
+    )
+
+
+def test_canonical_path_resolves_symlinks_in_parent_directories_only():
+    flexmock(module.os.path).should_receive('abspath').with_args('link/data').and_return(
+        '/srv/link/data'
+    )
+    flexmock(module.os.path).should_receive('realpath').with_args('/srv/link').and_return(
+        '/srv/target'
+    )
+
+    assert module._canonical_path('link/data') == '/srv/target/data'
+
+
+def test_canonical_path_with_root_returns_root():
+    assert module._canonical_path('/') == '/'
+
+
+def test_deduplicate_directories_drops_duplicate_real_paths():
+    flexmock(module).should_receive('_canonical_path').with_args('foo/data').and_return('/foo/data')
+    flexmock(module).should_receive('_canonical_path').with_args('bar').and_return('/bar')
+    flexmock(module).should_receive('_canonical_path').with_args('link/data').and_return(
+        '/foo/data'
+    )
+
+    assert module.deduplicate_directories(('foo/data', 'bar', 'link/data')) == (
+        ('foo/data', 'bar'),
+        (('link/data', 'Already backed up as part of foo/data'),),
+    )
+
+
+def test_deduplicate_directories_drops_nested_directories_listed_before_parent():
+    flexmock(module).should_receive('_canonical_path').replace_with(lambda path: '/' + path)
+
+    assert module.deduplicate_directories(('foo/bar', 'foo-bar', 'foo/bar/baz', 'foo')) == (
+        ('foo-bar', 'foo'),
+        (
+            ('foo/bar', 'Already backed up as part of foo'),
+            ('foo/bar/baz', 'Already backed up as part of foo'),
+        ),
+    )
+
+
+def test_deduplicate_directories_with_root_drops_everything_else():
+    flexmock(module).should_receive('_canonical_path').replace_with(lambda path: path)
+
+    assert module.deduplicate_directories(('/etc', '/')) == (
+        ('/',),
+        (('/etc', 'Already backed up as part of /'),),
+    )
+
+
+def test_deduplicate_directories_with_one_file_system_keeps_nested_directory_on_other_device():
+    flexmock(module).should_receive('_canonical_path').replace_with(lambda path: path)
+    flexmock(module).should_receive('_device').with_args('/home').and_return(1)
+    flexmock(module).should_receive('_device').with_args('/home/mount').and_return(2)
+    flexmock(module).should_receive('_device').with_args('/home/user').and_return(1)
+
+    assert module.deduplicate_directories(
+        ('/home', '/home/mount', '/home/user'), one_file_system=True
+    ) == (('/home', '/home/mount'), (('/home/user', 'Already backed up as part of /home'),))
+
+
+def test_deduplicate_directories_without_one_file_system_ignores_devices():
+    flexmock(module).should_receive('_canonical_path').replace_with(lambda path: path)
+    flexmock(module).should_receive('_device').never()
+
+    assert module.deduplicate_directories(('/home', '/home/mount')) == (
+        ('/home',),
+        (('/home/mount', 'Already backed up as part of /home'),),
+    )
+
+
+def test_expand_directories_flattens_expanded_directories_in_order():
+    module.clear_cache()
+    flexmock(module).should_receive('expand_directory').with_args('foo*').and_return(
+        ['foo', 'food']
+    )
+    flexmock(module).should_receive('expand_directory').with_args('bar').and_return(['bar'])
+    flexmock(module).should_receive('expand_directory').with_args('baz*').and_return(['baz'])
+
+    paths = module.expand_directories(('foo*', 'bar', 'baz*'))
+
+    assert paths == ('foo', 'food', 'bar', 'baz')
+
+
+def test_expand_directories_only_expands_same_directories_once():
+    module.clear_cache()
+    flexmock(module).should_receive('expand_directory').with_args('foo*').and_return(
+        ['foo', 'food']
+    ).once()
+
+    assert module.expand_directories(['foo*']) == ('foo', 'food')
+    assert module.expand_directories(['foo*']) == ('foo', 'food')
+
+
+def test_expand_directories_expands_different_directories_separately():
+    module.clear_cache()
+    flexmock(module).should_receive('expand_directory').with_args('foo*').and_return(['foo'])
+    flexmock(module).should_receive('expand_directory').with_args('bar*').and_return(['bar'])
+
+    assert module.expand_directories(['foo*']) == ('foo',)
+    assert module.expand_directories(['bar*']) == ('bar',)
+
+
+def test_expand_directories_with_error_does_not_cache_it():
+    module.clear_cache()
+    flexmock(module).should_receive('_expand_directories').and_raise(OSError).and_return(
+        ('foo',)
+    )
+
+    try:
+        module.expand_directories(['foo*'])
+    except OSError:
+        pass
+
+    assert module.expand_directories(['foo*']) == ('foo',)
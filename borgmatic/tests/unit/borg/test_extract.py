@@ -1,100 +1,98 @@
-import sys
-
 from flexmock import flexmock
 
 from borgmatic.borg import extract as module
 from borgmatic.verbosity import VERBOSITY_SOME, VERBOSITY_LOTS
 
 
-def insert_subprocess_mock(check_call_command, **kwargs):
-    subprocess = flexmock(module.subprocess)
-    subprocess.should_receive('check_call').with_args(check_call_command, **kwargs).once()
+def insert_execute_command_mock(command, extra_environment={}, **kwargs):
+    flexmock(module.execute).should_receive('execute_command').with_args(
+        command, extra_environment=extra_environment, **kwargs
+    ).once()
 
 
-def insert_subprocess_never():
-    subprocess = flexmock(module.subprocess)
-    subprocess.should_receive('check_call').never()
+def insert_execute_command_never():
+    flexmock(module.execute).should_receive('execute_command').never()
 
 
-def insert_subprocess_check_output_mock(check_output_command, result, **kwargs):
-    subprocess = flexmock(module.subprocess)
-    subprocess.should_receive('check_output').with_args(check_output_command, **kwargs).and_return(result).once()
+def insert_newest_archive_mock(archive_name, remote_path=None, prefix=None):
+    flexmock(module.archives).should_receive('newest_archive').with_args(
+        'repo', {}, remote_path, prefix
+    ).and_return(module.archives.Archive(archive_name, None, None) if archive_name else None).once()
 
 
 def test_extract_last_archive_dry_run_should_call_borg_with_last_archive():
-    flexmock(sys.stdout).encoding = 'utf-8'
-    insert_subprocess_check_output_mock(
-        ('borg', 'list', '--short', 'repo'),
-        result='archive1\narchive2\n'.encode('utf-8'),
-    )
-    insert_subprocess_mock(
+    insert_newest_archive_mock('archive2')
+    insert_execute_command_mock(
         ('borg', 'extract', '--dry-run', 'repo::archive2'),
     )
 
     module.extract_last_archive_dry_run(
         verbosity=None,
         repository='repo',
+        storage_config={},
     )
 
 
 def test_extract_last_archive_dry_run_without_any_archives_should_bail():
-    flexmock(sys.stdout).encoding = 'utf-8'
-    insert_subprocess_check_output_mock(
-        ('borg', 'list', '--short', 'repo'),
-        result='\n'.encode('utf-8'),
-    )
-    insert_subprocess_never()
+    insert_newest_archive_mock(None)
+    insert_execute_command_never()
 
     module.extract_last_archive_dry_run(
         verbosity=None,
         repository='repo',
+        storage_config={},
     )
 
 
 def test_extract_last_archive_dry_run_with_verbosity_some_should_call_borg_with_info_parameter():
-    flexmock(sys.stdout).encoding = 'utf-8'
-    insert_subprocess_check_output_mock(
-        ('borg', 'list', '--short', 'repo', '--info'),
-        result='archive1\narchive2\n'.encode('utf-8'),
-    )
-    insert_subprocess_mock(
+    insert_newest_archive_mock('archive2')
+    insert_execute_command_mock(
         ('borg', 'extract', '--dry-run', 'repo::archive2', '--info'),
     )
 
     module.extract_last_archive_dry_run(
         verbosity=VERBOSITY_SOME,
         repository='repo',
+        storage_config={},
     )
 
 
 def test_extract_last_archive_dry_run_with_verbosity_lots_should_call_borg_with_debug_parameter():
-    flexmock(sys.stdout).encoding = 'utf-8'
-    insert_subprocess_check_output_mock(
-        ('borg', 'list', '--short', 'repo', '--debug'),
-        result='archive1\narchive2\n'.encode('utf-8'),
-    )
-    insert_subprocess_mock(
+    insert_newest_archive_mock('archive2')
+    insert_execute_command_mock(
         ('borg', 'extract', '--dry-run', 'repo::archive2', '--debug', '--list'),
     )
 
     module.extract_last_archive_dry_run(
         verbosity=VERBOSITY_LOTS,
         repository='repo',
+        storage_config={},
     )
 
 
 def test_extract_last_archive_dry_run_should_call_borg_with_remote_path_parameters():
-    flexmock(sys.stdout).encoding = 'utf-8'
-    insert_subprocess_check_output_mock(
-        ('borg', 'list', '--short', 'repo', '--remote-path', 'borg1'),
-        result='archive1\narchive2\n'.encode('utf-8'),
-    )
-    insert_subprocess_mock(
+    insert_newest_archive_mock('archive2', remote_path='borg1')
+    insert_execute_command_mock(
         ('borg', 'extract', '--dry-run', 'repo::archive2', '--remote-path', 'borg1'),
     )
 
     module.extract_last_archive_dry_run(
         verbosity=None,
         repository='repo',
+        storage_config={},
         remote_path='borg1',
     )
+
+
+def test_extract_last_archive_dry_run_with_prefix_should_call_borg_with_last_matching_archive():
+    insert_newest_archive_mock('host-archive2', prefix='{hostname}-')
+    insert_execute_command_mock(
+        ('borg', 'extract', '--dry-run', 'repo::host-archive2'),
+    )
+
+    module.extract_last_archive_dry_run(
+        verbosity=None,
+        repository='repo',
+        storage_config={},
+        prefix='{hostname}-',
+    )
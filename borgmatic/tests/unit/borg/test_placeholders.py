@@ -0,0 +1,123 @@
+from flexmock import flexmock
+
+from borgmatic.borg import placeholders as module
+
+
+def insert_hostname_mock(hostname='host'):
+    flexmock(module.socket).should_receive('gethostname').and_return(hostname)
+
+
+def test_expand_placeholders_expands_stable_placeholders():
+    insert_hostname_mock()
+
+    assert module.expand_placeholders('{hostname}-') == 'host-'
+
+
+def test_expand_placeholders_expands_user_from_uid():
+    flexmock(module.os).should_receive('getuid').and_return(0)
+    flexmock(module.pwd).should_receive('getpwuid').with_args(0).and_return(
+        flexmock(pw_name='root')
+    )
+
+    assert module.expand_placeholders('{user}-') == 'root-'
+
+
+def test_expand_placeholders_without_placeholders_returns_text_as_is():
+    assert module.expand_placeholders('Documents_') == 'Documents_'
+
+
+def test_expand_placeholders_with_unstable_placeholder_returns_none():
+    insert_hostname_mock()
+
+    assert module.expand_placeholders('{hostname}-{now}') is None
+
+
+def test_expand_placeholders_with_format_spec_returns_none():
+    assert module.expand_placeholders('{hostname:.3}-') is None
+
+
+def test_expand_placeholders_with_malformed_text_returns_none():
+    assert module.expand_placeholders('{hostname-') is None
+
+
+def test_derive_prefix_keeps_stable_placeholders_and_separator():
+    insert_hostname_mock()
+
+    assert module.derive_prefix('{hostname}-{now}') == 'host-'
+
+
+def test_derive_prefix_keeps_literal_text_through_last_separator():
+    insert_hostname_mock()
+
+    assert module.derive_prefix('{hostname}-documents-{now:%Y-%m-%d}') == 'host-documents-'
+
+
+def test_derive_prefix_cuts_back_to_last_separator():
+    insert_hostname_mock()
+
+    assert module.derive_prefix('{hostname}_docs{now}') == 'host_'
+
+
+def test_derive_prefix_without_separator_returns_none():
+    insert_hostname_mock()
+
+    assert module.derive_prefix('{hostname}{now}') is None
+
+
+def test_derive_prefix_without_separator_after_placeholder_returns_none():
+    insert_hostname_mock('web-1')
+
+    assert module.derive_prefix('{hostname}{now}') is None
+
+
+def test_derive_prefix_without_separator_after_placeholder_in_literal_text_returns_none():
+    insert_hostname_mock('web-1')
+
+    assert module.derive_prefix('{hostname}docs{now}') is None
+
+
+def test_derive_prefix_without_placeholders_cuts_back_literal_text_to_last_separator():
+    assert module.derive_prefix('backup-docs{now}') == 'backup-'
+
+
+def test_derive_prefix_with_unstable_placeholder_first_returns_none():
+    assert module.derive_prefix('{now}-{hostname}') is None
+
+
+def test_derive_prefix_with_literal_format_returns_it_whole():
+    assert module.derive_prefix('backup') == 'backup'
+
+
+def test_derive_prefix_with_expanded_braces_returns_none():
+    insert_hostname_mock('{host}')
+
+    assert module.derive_prefix('{hostname}-{now}') is None
+
+
+def test_derive_prefix_with_malformed_format_returns_none():
+    assert module.derive_prefix('{hostname-{now}') is None
+
+
+def test_archive_prefix_with_configured_prefix_returns_it():
+    assert (
+        module.archive_prefix({'archive_name_format': '{hostname}-{now}'}, 'Documents_')
+        == 'Documents_'
+    )
+
+
+def test_archive_prefix_with_empty_configured_prefix_returns_none():
+    assert module.archive_prefix({'archive_name_format': '{hostname}-{now}'}, '') is None
+
+
+def test_archive_prefix_without_configured_prefix_derives_it_from_archive_name_format():
+    flexmock(module).should_receive('derive_prefix').with_args('{hostname}-{now}').and_return(
+        'host-'
+    )
+
+    assert module.archive_prefix({'archive_name_format': '{hostname}-{now}'}) == 'host-'
+
+
+def test_archive_prefix_without_archive_name_format_returns_none():
+    flexmock(module).should_receive('derive_prefix').never()
+
+    assert module.archive_prefix({}) is None
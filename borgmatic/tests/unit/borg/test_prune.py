@@ -6,9 +6,14 @@ from borgmatic.borg import prune as module
 from borgmatic.verbosity import VERBOSITY_SOME, VERBOSITY_LOTS
 
 
-def insert_subprocess_mock(check_call_command, **kwargs):
-    subprocess = flexmock(module.subprocess)
-    subprocess.should_receive('check_call').with_args(check_call_command, **kwargs).once()
+def insert_execute_command_mock(command, extra_environment={}, forget_archive_list=True):
+    flexmock(module.version).should_receive('supports_json').and_return(False)
+    flexmock(module.execute).should_receive('output_is_buffered').and_return(False)
+    flexmock(module.execute).should_receive('execute_command').with_args(
+        command, extra_environment=extra_environment
+    ).once()
+    if forget_archive_list:
+        flexmock(module.archives).should_receive('forget_archive_list').with_args('repo').once()
 
 
 BASE_PRUNE_FLAGS = (
@@ -53,60 +58,341 @@ def test_make_prune_flags_accepts_prefix_with_placeholders():
 PRUNE_COMMAND = (
     'borg', 'prune', 'repo', '--keep-daily', '1', '--keep-weekly', '2', '--keep-monthly', '3',
 )
+LIST_FLAG = ('--list',)
 
 
 def test_prune_archives_should_call_borg_with_parameters():
-    retention_config = flexmock()
+    retention_config = {}
     flexmock(module).should_receive('_make_prune_flags').with_args(retention_config).and_return(
         BASE_PRUNE_FLAGS,
     )
-    insert_subprocess_mock(PRUNE_COMMAND)
+    insert_execute_command_mock(PRUNE_COMMAND)
 
     module.prune_archives(
         verbosity=None,
         repository='repo',
+        storage_config={},
         retention_config=retention_config,
     )
 
 
 def test_prune_archives_with_verbosity_some_should_call_borg_with_info_parameter():
-    retention_config = flexmock()
+    retention_config = {}
     flexmock(module).should_receive('_make_prune_flags').with_args(retention_config).and_return(
         BASE_PRUNE_FLAGS,
     )
-    insert_subprocess_mock(PRUNE_COMMAND + ('--info', '--stats',))
+    insert_execute_command_mock(PRUNE_COMMAND + ('--info', '--stats'))
 
     module.prune_archives(
         repository='repo',
+        storage_config={},
         verbosity=VERBOSITY_SOME,
         retention_config=retention_config,
     )
 
 
 def test_prune_archives_with_verbosity_lots_should_call_borg_with_debug_parameter():
-    retention_config = flexmock()
+    retention_config = {}
     flexmock(module).should_receive('_make_prune_flags').with_args(retention_config).and_return(
         BASE_PRUNE_FLAGS,
     )
-    insert_subprocess_mock(PRUNE_COMMAND + ('--debug', '--stats', '--list'))
+    insert_execute_command_mock(PRUNE_COMMAND + ('--debug', '--stats') + LIST_FLAG)
 
     module.prune_archives(
         repository='repo',
+        storage_config={},
         verbosity=VERBOSITY_LOTS,
         retention_config=retention_config,
     )
 
 
 def test_prune_archives_with_remote_path_should_call_borg_with_remote_path_parameters():
-    retention_config = flexmock()
+    retention_config = {}
     flexmock(module).should_receive('_make_prune_flags').with_args(retention_config).and_return(
         BASE_PRUNE_FLAGS,
     )
-    insert_subprocess_mock(PRUNE_COMMAND + ('--remote-path', 'borg1'))
+    insert_execute_command_mock(PRUNE_COMMAND + ('--remote-path', 'borg1'))
 
     module.prune_archives(
         verbosity=None,
         repository='repo',
+        storage_config={},
         retention_config=retention_config,
         remote_path='borg1',
     )
+
+
+def test_prune_archives_with_encryption_passphrase_calls_borg_with_passphrase_environment():
+    retention_config = {}
+    flexmock(module).should_receive('_make_prune_flags').with_args(retention_config).and_return(
+        BASE_PRUNE_FLAGS,
+    )
+    insert_execute_command_mock(PRUNE_COMMAND, extra_environment={'BORG_PASSPHRASE': 'pass'})
+
+    module.prune_archives(
+        verbosity=None,
+        repository='repo',
+        storage_config={'encryption_passphrase': 'pass'},
+        retention_config=retention_config,
+    )
+
+
+KEEP_LINE = (
+    b'Keeping archive: host-2018-01-02                     Tue, 2018-01-02 03:04:05 ['
+    + b'a' * 64
+    + b']\n'
+)
+PRUNE_LINE = (
+    b'Pruning archive: host-2018-01-01                     Mon, 2018-01-01 03:04:05 ['
+    + b'b' * 64
+    + b']\n'
+)
+
+
+def test_list_handler_collects_archives_without_displaying_them():
+    kept_archives = []
+    pruned_archives = []
+    flexmock(module.execute).should_receive('write_output').with_args(b'other\n').once()
+    handle_line = module._make_list_handler(False, kept_archives, pruned_archives)
+
+    for line in (KEEP_LINE, PRUNE_LINE, b'other\n'):
+        handle_line(line)
+
+    assert [archive.name for archive in kept_archives] == ['host-2018-01-02']
+    assert [archive.name for archive in pruned_archives] == ['host-2018-01-01']
+
+
+def test_list_handler_with_display_list_displays_archives():
+    flexmock(module.execute).should_receive('write_output').twice()
+    handle_line = module._make_list_handler(True, [], [])
+
+    for line in (KEEP_LINE, PRUNE_LINE):
+        handle_line(line)
+
+
+def test_prune_archives_with_buffered_output_records_kept_and_pruned_archives():
+    retention_config = {'keep_daily': 1, 'prefix': 'host-'}
+    flexmock(module.version).should_receive('supports_json').and_return(False)
+    flexmock(module.execute).should_receive('output_is_buffered').and_return(True)
+
+    def run_prune(command, extra_environment, handle_stderr_line):
+        handle_stderr_line(KEEP_LINE)
+        handle_stderr_line(PRUNE_LINE)
+
+    flexmock(module.execute).should_receive('execute_command_and_capture_output').replace_with(
+        run_prune
+    )
+    flexmock(module.archives).should_receive('record_pruned_archives').with_args(
+        'repo', list, list, 'host-'
+    ).replace_with(
+        lambda repository, kept_archives, pruned_archives, prefix: recorded.extend(
+            (kept_archives, pruned_archives)
+        )
+    )
+    recorded = []
+
+    module.prune_archives(
+        verbosity=None, repository='repo', storage_config={}, retention_config=retention_config
+    )
+
+    assert [[archive.name for archive in archives] for archives in recorded] == [
+        ['host-2018-01-02'],
+        ['host-2018-01-01'],
+    ]
+
+
+ARCHIVE = module.archives.Archive('host-1', '2018-01-01T03:04:05', 'a' * 64)
+
+
+def test_prune_archives_with_nothing_to_prune_skips_borg():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.archives).should_receive('list_archives').and_return((ARCHIVE,))
+    flexmock(module.retention).should_receive('simulate_prune').with_args(
+        (ARCHIVE,), {'keep_daily': 1}
+    ).and_return(((ARCHIVE,), ()))
+    flexmock(module.execute).should_receive('execute_command').never()
+    flexmock(module.execute).should_receive('write_output').never()
+
+    module.prune_archives(
+        verbosity=None, repository='repo', storage_config={}, retention_config={'keep_daily': 1}
+    )
+
+
+def test_prune_archives_with_nothing_to_prune_and_verbosity_says_so():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.archives).should_receive('list_archives').and_return((ARCHIVE,))
+    flexmock(module.retention).should_receive('simulate_prune').and_return(((ARCHIVE,), ()))
+    flexmock(module.execute).should_receive('execute_command').never()
+    flexmock(module.execute).should_receive('write_output').with_args(
+        b'repo: No archives to prune; skipping\n'
+    ).once()
+
+    module.prune_archives(
+        verbosity=VERBOSITY_SOME,
+        repository='repo',
+        storage_config={},
+        retention_config={'keep_daily': 1},
+    )
+
+
+def test_prune_archives_with_archive_name_format_prunes_derived_prefix_only():
+    storage_config = {'archive_name_format': '{hostname}-{now}'}
+    insert_execute_command_mock(
+        ('borg', 'prune', 'repo', '--keep-daily', '1', '--prefix', '{hostname}-'),
+        forget_archive_list=False,
+    )
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.placeholders).should_receive('archive_prefix').with_args(
+        storage_config, None
+    ).and_return('{hostname}-')
+    flexmock(module.placeholders).should_receive('expand_placeholders').with_args(
+        '{hostname}-'
+    ).and_return('host-')
+    flexmock(module.archives).should_receive('list_archives').and_return((ARCHIVE,))
+    flexmock(module.retention).should_receive('simulate_prune').with_args(
+        (ARCHIVE,), {'keep_daily': 1, 'prefix': 'host-'}
+    ).and_return(((), (ARCHIVE,))).once()
+    flexmock(module.archives).should_receive('record_simulated_prune').with_args(
+        'repo', storage_config, None, (ARCHIVE,)
+    ).once()
+
+    module.prune_archives(
+        verbosity=None,
+        repository='repo',
+        storage_config=storage_config,
+        retention_config={'keep_daily': 1},
+    )
+
+
+def test_prune_archives_with_empty_prefix_prunes_all_archives():
+    storage_config = {'archive_name_format': '{hostname}-{now}'}
+    insert_execute_command_mock(('borg', 'prune', 'repo', '--keep-daily', '1'))
+
+    module.prune_archives(
+        verbosity=None,
+        repository='repo',
+        storage_config=storage_config,
+        retention_config={'keep_daily': 1, 'prefix': ''},
+    )
+
+
+def test_prune_archives_with_unexpandable_prefix_leaves_prune_to_borg():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.archives).should_receive('list_archives').never()
+    flexmock(module.retention).should_receive('simulate_prune').never()
+    flexmock(module.execute).should_receive('output_is_buffered').and_return(False)
+    flexmock(module.execute).should_receive('execute_command').once()
+    flexmock(module.archives).should_receive('forget_archive_list').once()
+
+    module.prune_archives(
+        verbosity=None,
+        repository='repo',
+        storage_config={},
+        retention_config={'keep_daily': 1, 'prefix': '{now}'},
+    )
+
+
+def test_prune_archives_with_archives_to_prune_calls_borg():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.archives).should_receive('list_archives').and_return((ARCHIVE,))
+    flexmock(module.retention).should_receive('simulate_prune').and_return(((), (ARCHIVE,)))
+    flexmock(module).should_receive('_make_prune_flags').and_return(BASE_PRUNE_FLAGS)
+    flexmock(module.execute).should_receive('output_is_buffered').and_return(False)
+    flexmock(module.execute).should_receive('execute_command').with_args(
+        PRUNE_COMMAND, extra_environment={}
+    ).once()
+    flexmock(module.archives).should_receive('record_simulated_prune').with_args(
+        'repo', {}, None, (ARCHIVE,)
+    ).once()
+    flexmock(module.archives).should_receive('forget_archive_list').never()
+
+    module.prune_archives(
+        verbosity=None, repository='repo', storage_config={}, retention_config={'keep_daily': 1}
+    )
+
+
+def test_prune_archives_with_archives_to_prune_and_buffered_output_records_simulated_prune():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.archives).should_receive('list_archives').and_return((ARCHIVE,))
+    flexmock(module.retention).should_receive('simulate_prune').and_return(((), (ARCHIVE,)))
+    flexmock(module.execute).should_receive('output_is_buffered').and_return(True)
+    flexmock(module.execute).should_receive('execute_command_and_capture_output').once()
+    flexmock(module.archives).should_receive('record_simulated_prune').with_args(
+        'repo', {}, None, (ARCHIVE,)
+    ).once()
+    flexmock(module.archives).should_receive('record_pruned_archives').never()
+
+    module.prune_archives(
+        verbosity=None, repository='repo', storage_config={}, retention_config={'keep_daily': 1}
+    )
+
+
+def test_prune_archives_without_simulation_calls_borg():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.archives).should_receive('list_archives').and_return((ARCHIVE,))
+    flexmock(module.retention).should_receive('simulate_prune').and_return(None)
+    flexmock(module).should_receive('_make_prune_flags').and_return(BASE_PRUNE_FLAGS)
+    flexmock(module.execute).should_receive('output_is_buffered').and_return(False)
+    flexmock(module.execute).should_receive('execute_command').once()
+    flexmock(module.archives).should_receive('forget_archive_list').once()
+
+    module.prune_archives(
+        verbosity=None, repository='repo', storage_config={}, retention_config={'keep_daily': 1}
+    )
+
+
+def test_prune_archives_with_dry_run_displays_simulation_without_calling_borg():
+    flexmock(module.version).should_receive('supports_json').and_return(True)
+    flexmock(module.archives).should_receive('list_archives').and_return((ARCHIVE,))
+    flexmock(module.retention).should_receive('simulate_prune').and_return(((), (ARCHIVE,)))
+    flexmock(module.retention).should_receive('format_simulation').with_args(
+        (), (ARCHIVE,)
+    ).and_return('Would prune: host-1\n')
+    flexmock(module.execute).should_receive('write_output').with_args(
+        b'Would prune: host-1\n'
+    ).once()
+    flexmock(module.execute).should_receive('execute_command').never()
+
+    module.prune_archives(
+        verbosity=None,
+        repository='repo',
+        storage_config={},
+        retention_config={'keep_daily': 1},
+        dry_run=True,
+    )
+
+
+def test_prune_archives_with_dry_run_and_without_simulation_calls_borg_with_dry_run_parameter():
+    flexmock(module.version).should_receive('supports_json').and_return(False)
+    flexmock(module).should_receive('_make_prune_flags').and_return(BASE_PRUNE_FLAGS)
+    flexmock(module.execute).should_receive('output_is_buffered').and_return(False)
+    flexmock(module.execute).should_receive('execute_command').with_args(
+        PRUNE_COMMAND + LIST_FLAG + ('--dry-run',), extra_environment={}
+    ).once()
+    flexmock(module.archives).should_receive('forget_archive_list').never()
+
+    module.prune_archives(
+        verbosity=None,
+        repository='repo',
+        storage_config={},
+        retention_config={'keep_daily': 1},
+        dry_run=True,
+    )
+
+
+def test_prune_archives_with_buffered_output_and_dry_run_does_not_record_archives():
+    flexmock(module.version).should_receive('supports_json').and_return(False)
+    flexmock(module).should_receive('_make_prune_flags').and_return(BASE_PRUNE_FLAGS)
+    flexmock(module.execute).should_receive('output_is_buffered').and_return(True)
+    flexmock(module.execute).should_receive('execute_command_and_capture_output').with_args(
+        PRUNE_COMMAND + LIST_FLAG + ('--dry-run',), extra_environment={}, handle_stderr_line=object
+    ).once()
+    flexmock(module.archives).should_receive('record_pruned_archives').never()
+
+    module.prune_archives(
+        verbosity=None,
+        repository='repo',
+        storage_config={},
+        retention_config={'keep_daily': 1},
+        dry_run=True,
+    )
@@ -0,0 +1,241 @@
+import datetime
+
+import pytest
+
+from borgmatic.borg import archives
+from borgmatic.borg import retention as module
+
+
+NOW = datetime.datetime(2018, 3, 1, 0, 0, 0)
+
+
+def make_archive(time, name=None):
+    return archives.Archive(name or 'host-{}'.format(time), time, None)
+
+
+def names(archives):
+    return [archive.name for archive in archives]
+
+
+def daily_archives(start, days, hour=12):
+    return [
+        make_archive((start + datetime.timedelta(days=day, hours=hour)).strftime(module.TIME_FORMAT))
+        for day in range(days)
+    ]
+
+
+def test_parse_within_parses_borg_intervals():
+    assert module._parse_within('3H') == datetime.timedelta(hours=3)
+    assert module._parse_within('2d') == datetime.timedelta(days=2)
+    assert module._parse_within('1w') == datetime.timedelta(days=7)
+    assert module._parse_within('1m') == datetime.timedelta(days=31)
+    assert module._parse_within('1y') == datetime.timedelta(days=365)
+
+
+@pytest.mark.parametrize('interval', ('3', 'H', '3x', '0d', '-1d', 'threed'))
+def test_parse_within_with_invalid_interval_returns_none(interval):
+    assert module._parse_within(interval) is None
+
+
+def test_simulate_prune_with_keep_daily_keeps_newest_archive_of_each_recent_day():
+    archive_list = [
+        make_archive('2018-02-26T08:00:00'),
+        make_archive('2018-02-26T20:00:00'),
+        make_archive('2018-02-27T08:00:00'),
+        make_archive('2018-02-28T08:00:00'),
+        make_archive('2018-02-28T20:00:00'),
+    ]
+
+    (kept, pruned) = module.simulate_prune(archive_list, {'keep_daily': 2}, now=NOW)
+
+    assert names(kept) == ['host-2018-02-28T20:00:00', 'host-2018-02-27T08:00:00']
+    assert names(pruned) == [
+        'host-2018-02-28T08:00:00',
+        'host-2018-02-26T20:00:00',
+        'host-2018-02-26T08:00:00',
+    ]
+
+
+def test_simulate_prune_with_daily_and_weekly_rules_keeps_additional_end_of_week_archives():
+    # As per Borg's documentation, "--keep-daily 7 --keep-weekly 4" keeps 7 end of day archives and
+    # 4 additional end of week archives.
+    archive_list = daily_archives(datetime.datetime(2018, 1, 1), 59)
+
+    (kept, pruned) = module.simulate_prune(
+        archive_list, {'keep_daily': 7, 'keep_weekly': 4}, now=NOW
+    )
+
+    assert [archive.time[:10] for archive in kept] == [
+        '2018-02-28',
+        '2018-02-27',
+        '2018-02-26',
+        '2018-02-25',
+        '2018-02-24',
+        '2018-02-23',
+        '2018-02-22',
+        '2018-02-18',
+        '2018-02-11',
+        '2018-02-04',
+        '2018-01-28',
+    ]
+    assert len(pruned) == 59 - 11
+
+
+def test_simulate_prune_with_keep_weekly_uses_iso_weeks():
+    archive_list = [
+        make_archive('2017-12-30T12:00:00'),
+        make_archive('2017-12-31T12:00:00'),
+        make_archive('2018-01-01T12:00:00'),
+    ]
+
+    (kept, pruned) = module.simulate_prune(archive_list, {'keep_weekly': 5}, now=NOW)
+
+    assert names(kept) == ['host-2018-01-01T12:00:00', 'host-2017-12-31T12:00:00']
+    assert names(pruned) == ['host-2017-12-30T12:00:00']
+
+
+def test_simulate_prune_with_monthly_and_yearly_rules():
+    archive_list = [
+        make_archive('2016-06-01T00:00:00'),
+        make_archive('2016-12-31T00:00:00'),
+        make_archive('2017-11-15T00:00:00'),
+        make_archive('2017-12-01T00:00:00'),
+        make_archive('2018-01-01T00:00:00'),
+        make_archive('2018-01-31T00:00:00'),
+    ]
+
+    (kept, pruned) = module.simulate_prune(
+        archive_list, {'keep_monthly': 2, 'keep_yearly': 2}, now=NOW
+    )
+
+    assert names(kept) == [
+        'host-2018-01-31T00:00:00',
+        'host-2017-12-01T00:00:00',
+        'host-2016-12-31T00:00:00',
+    ]
+
+
+def test_simulate_prune_with_keep_hourly_keeps_newest_archive_of_each_hour():
+    archive_list = [
+        make_archive('2018-02-28T10:00:00'),
+        make_archive('2018-02-28T10:30:00'),
+        make_archive('2018-02-28T11:15:00'),
+    ]
+
+    (kept, pruned) = module.simulate_prune(archive_list, {'keep_hourly': 24}, now=NOW)
+
+    assert names(kept) == ['host-2018-02-28T11:15:00', 'host-2018-02-28T10:30:00']
+    assert names(pruned) == ['host-2018-02-28T10:00:00']
+
+
+def test_simulate_prune_with_negative_count_keeps_every_period():
+    archive_list = daily_archives(datetime.datetime(2018, 1, 1), 30)
+
+    (kept, pruned) = module.simulate_prune(archive_list, {'keep_daily': -1}, now=NOW)
+
+    assert len(kept) == 30
+    assert pruned == ()
+
+
+def test_simulate_prune_with_keep_within_keeps_recent_archives_and_skips_them_for_other_rules():
+    archive_list = [
+        make_archive('2018-02-25T12:00:00'),
+        make_archive('2018-02-26T12:00:00'),
+        make_archive('2018-02-28T08:00:00'),
+        make_archive('2018-02-28T20:00:00'),
+    ]
+
+    (kept, pruned) = module.simulate_prune(
+        archive_list, {'keep_within': '1d', 'keep_daily': 1}, now=NOW
+    )
+
+    # Both archives within the last day are kept. The one on 2018-02-28 doesn't count towards the
+    # daily rule, so that keeps the newest archive from an earlier day.
+    assert names(kept) == [
+        'host-2018-02-28T20:00:00',
+        'host-2018-02-28T08:00:00',
+        'host-2018-02-26T12:00:00',
+    ]
+    assert names(pruned) == ['host-2018-02-25T12:00:00']
+
+
+def test_simulate_prune_with_nothing_to_prune_returns_no_pruned_archives():
+    archive_list = daily_archives(datetime.datetime(2018, 2, 25), 4)
+
+    (kept, pruned) = module.simulate_prune(archive_list, {'keep_daily': 7}, now=NOW)
+
+    assert len(kept) == 4
+    assert pruned == ()
+
+
+def test_simulate_prune_with_prefix_only_considers_matching_archives():
+    archive_list = [
+        make_archive('2018-02-27T12:00:00', name='other-1'),
+        make_archive('2018-02-27T12:00:00', name='host-1'),
+        make_archive('2018-02-28T12:00:00', name='host-2'),
+    ]
+
+    (kept, pruned) = module.simulate_prune(
+        archive_list, {'keep_daily': 1, 'prefix': 'host-'}, now=NOW
+    )
+
+    assert names(kept) == ['host-2']
+    assert names(pruned) == ['host-1']
+
+
+def test_simulate_prune_prunes_checkpoints_except_for_most_recent_archive():
+    archive_list = [
+        make_archive('2018-02-26T12:00:00', name='host-1.checkpoint'),
+        make_archive('2018-02-27T12:00:00', name='host-2'),
+        make_archive('2018-02-28T12:00:00', name='host-3.checkpoint.1'),
+    ]
+
+    (kept, pruned) = module.simulate_prune(archive_list, {'keep_daily': 7}, now=NOW)
+
+    assert names(kept) == ['host-3.checkpoint.1', 'host-2']
+    assert names(pruned) == ['host-1.checkpoint']
+
+
+def test_simulate_prune_prunes_checkpoint_older_than_most_recent_archive():
+    archive_list = [
+        make_archive('2018-02-27T12:00:00', name='host-1.checkpoint'),
+        make_archive('2018-02-28T12:00:00', name='host-2'),
+    ]
+
+    (kept, pruned) = module.simulate_prune(archive_list, {'keep_daily': 7}, now=NOW)
+
+    assert names(kept) == ['host-2']
+    assert names(pruned) == ['host-1.checkpoint']
+
+
+@pytest.mark.parametrize(
+    'retention_config',
+    (
+        {},
+        {'prefix': 'host-'},
+        {'keep_daily': 1, 'prefix': '{hostname}-'},
+        {'keep_within': 'soon'},
+        {'keep_daily': 1, 'keep_secondly': 1},
+    ),
+)
+def test_simulate_prune_with_unsimulated_retention_config_returns_none(retention_config):
+    assert module.simulate_prune([make_archive('2018-02-28T12:00:00')], retention_config) is None
+
+
+def test_simulate_prune_with_unknown_archive_time_returns_none():
+    assert (
+        module.simulate_prune([archives.Archive('host-1', None, None)], {'keep_daily': 1}) is None
+    )
+
+
+def test_format_simulation_lists_archives_like_borg():
+    kept = archives.Archive('host-2', '2018-02-28T12:00:00', 'b' * 64)
+    pruned = archives.Archive('host-1', '2018-02-27T12:00:00', None)
+
+    listing = module.format_simulation((kept,), (pruned,))
+
+    assert listing.splitlines() == [
+        'Keeping archive: host-2{} Wed, 2018-02-28 12:00:00 [{}]'.format(' ' * 30, 'b' * 64),
+        'Would prune:     host-1{} Tue, 2018-02-27 12:00:00'.format(' ' * 30),
+    ]
+    assert archives.parse_prune_line(listing.splitlines()[0]) == (True, kept)
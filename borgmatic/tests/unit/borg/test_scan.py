@@ -0,0 +1,49 @@
+from flexmock import flexmock
+
+from borgmatic.borg import scan as module
+
+
+def test_excludes_path_matches_normalized_path():
+    matchers = (lambda path: path == 'var/cache',)
+
+    assert module._excludes_path(matchers, '/var/cache/')
+    assert not module._excludes_path(matchers, '/var/lib')
+
+
+def test_is_tagged_with_exclude_if_present_file_returns_true():
+    assert module._is_tagged('/foo', {'.nobackup', 'bar'}, {'exclude_if_present': '.nobackup'})
+
+
+def test_is_tagged_without_exclude_if_present_file_returns_false():
+    assert not module._is_tagged('/foo', {'bar'}, {'exclude_if_present': '.nobackup'})
+
+
+def test_is_tagged_with_cache_directory_and_exclude_caches_returns_true():
+    flexmock(module.exclude).should_receive('is_cache_directory').with_args('/foo').and_return(
+        True
+    )
+
+    assert module._is_tagged('/foo', {'CACHEDIR.TAG'}, {'exclude_caches': True})
+
+
+def test_is_tagged_with_cache_directory_and_without_exclude_caches_returns_false():
+    flexmock(module.exclude).should_receive('is_cache_directory').never()
+
+    assert not module._is_tagged('/foo', {'CACHEDIR.TAG'}, {})
+
+
+def test_scan_directories_only_scans_same_directories_once():
+    module.clear_cache()
+    status = module.File_status('/foo', 1, 2, 3, 4, 5)
+    flexmock(module).should_receive('_scan_directories').and_return([status]).once()
+
+    assert module.scan_directories(('/foo',), (), {}) == (status,)
+    assert module.scan_directories(['/foo'], [], {'repositories': ['repo']}) == (status,)
+
+
+def test_scan_directories_with_different_options_scans_again():
+    module.clear_cache()
+    flexmock(module).should_receive('_scan_directories').and_return([]).twice()
+
+    module.scan_directories(('/foo',), (), {})
+    module.scan_directories(('/foo',), (), {'one_file_system': True})
@@ -0,0 +1,89 @@
+from flexmock import flexmock
+
+from borgmatic.borg import scan
+from borgmatic.borg import source_manifest as module
+
+
+def test_make_key_ignores_options_that_do_not_affect_backed_up_paths():
+    key = module.make_key(('/foo',), ('pp:/bar',), {'one_file_system': True}, {})
+
+    assert key == module.make_key(
+        ['/foo'],
+        ['pp:/bar'],
+        {'one_file_system': True, 'repositories': ['repo'], 'skip_unchanged_max_age': '1 week'},
+        {'encryption_passphrase': 'secret'},
+    )
+
+
+def test_make_key_differs_for_different_configurations():
+    key = module.make_key(('/foo',), (), {}, {})
+
+    assert key != module.make_key(('/foo', '/bar'), (), {}, {})
+    assert key != module.make_key(('/foo',), ('pp:/bar',), {}, {})
+    assert key != module.make_key(('/foo',), (), {'exclude_caches': True}, {})
+
+
+def test_pack_statuses_differs_for_changed_statuses():
+    status = scan.File_status('/foo', 1, 2, 3, 4, 0o100644)
+    body = module.pack_statuses((status,))
+
+    assert body == module.pack_statuses([status])
+    assert body != module.pack_statuses((status._replace(mtime_ns=5),))
+    assert body != module.pack_statuses((status._replace(path='/bar'),))
+    assert body != module.pack_statuses((status, status._replace(path='/foo/bar')))
+
+
+def test_read_manifest_without_manifest_returns_none():
+    flexmock(module.cache).should_receive('read_cache_file').and_return(None)
+
+    assert module.read_manifest('repo', b'k' * 32) is None
+
+
+def test_read_manifest_with_wrong_version_returns_none():
+    flexmock(module.cache).should_receive('read_cache_file').and_return(
+        module.HEADER.pack(module.MANIFEST_MAGIC, module.MANIFEST_VERSION + 1, 1.0, b'k' * 32)
+    )
+
+    assert module.read_manifest('repo', b'k' * 32) is None
+
+
+def test_read_manifest_with_truncated_data_returns_none():
+    flexmock(module.cache).should_receive('read_cache_file').and_return(b'BMSM')
+
+    assert module.read_manifest('repo', b'k' * 32) is None
+
+
+def test_is_unchanged_with_same_key_and_body_returns_true():
+    flexmock(module).should_receive('read_manifest').and_return((100.0, b'key', b'body'))
+
+    assert module.is_unchanged('repo', b'key', b'body', now=200.0)
+
+
+def test_is_unchanged_with_different_body_returns_false():
+    flexmock(module).should_receive('read_manifest').and_return((100.0, b'key', b'body'))
+
+    assert not module.is_unchanged('repo', b'key', b'other', now=200.0)
+
+
+def test_is_unchanged_with_different_key_returns_false():
+    flexmock(module).should_receive('read_manifest').and_return((100.0, b'key', b'body'))
+
+    assert not module.is_unchanged('repo', b'other', b'body', now=200.0)
+
+
+def test_is_unchanged_without_manifest_returns_false():
+    flexmock(module).should_receive('read_manifest').and_return(None)
+
+    assert not module.is_unchanged('repo', b'key', b'body')
+
+
+def test_is_unchanged_with_archive_older_than_max_age_returns_false():
+    flexmock(module).should_receive('read_manifest').and_return((100.0, b'key', b'body'))
+
+    assert not module.is_unchanged('repo', b'key', b'body', max_age=100, now=200.0)
+
+
+def test_is_unchanged_with_archive_younger_than_max_age_returns_true():
+    flexmock(module).should_receive('read_manifest').and_return((100.0, b'key', b'body'))
+
+    assert module.is_unchanged('repo', b'key', b'body', max_age=101, now=200.0)
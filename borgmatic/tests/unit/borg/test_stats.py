@@ -0,0 +1,51 @@
+from borgmatic.borg import stats as module
+
+
+ARCHIVE = {
+    'name': 'archive',
+    'duration': 4.0,
+    'stats': {
+        'original_size': 4000,
+        'compressed_size': 2000,
+        'deduplicated_size': 100,
+        'nfiles': 7,
+    },
+}
+
+
+def test_parse_archive_stats_returns_stats():
+    archive_stats = module.parse_archive_stats(ARCHIVE)
+
+    assert archive_stats == module.Archive_stats(
+        archive_name='archive',
+        original_size=4000,
+        compressed_size=2000,
+        deduplicated_size=100,
+        file_count=7,
+        duration=4.0,
+    )
+
+
+def test_throughput_divides_original_size_by_duration():
+    assert module.parse_archive_stats(ARCHIVE).throughput == 1000
+
+
+def test_throughput_without_duration_returns_none():
+    archive_stats = module.parse_archive_stats(dict(ARCHIVE, duration=None))
+
+    assert archive_stats.throughput is None
+
+
+def test_format_size_uses_human_readable_units():
+    assert module.format_size(999) == '999 B'
+    assert module.format_size(1500) == '1.50 kB'
+    assert module.format_size(2500000) == '2.50 MB'
+
+
+def test_format_archive_stats_includes_all_stats():
+    formatted = module.format_archive_stats(module.parse_archive_stats(ARCHIVE))
+
+    assert 'Archive name: archive' in formatted
+    assert 'Number of files: 7' in formatted
+    assert 'Deduplicated size: 100 B' in formatted
+    assert 'Throughput: 1.00 kB/s' in formatted
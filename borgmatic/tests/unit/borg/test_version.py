@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from flexmock import flexmock
+
+from borgmatic.borg import version as module
+
+
+def test_parse_version_returns_version_tuple():
+    assert module._parse_version('borg 1.1.2\n') == (1, 1, 2)
+
+
+def test_parse_version_ignores_pre_release_suffix():
+    assert module._parse_version('borg 1.1.0b3') == (1, 1, 0)
+
+
+def test_parse_version_with_unparseable_output_returns_empty_tuple():
+    assert module._parse_version('oops') == ()
+
+
+def test_local_borg_version_calls_borg_once():
+    module._cached_local_borg_version.cache_clear()
+    flexmock(module.execute).should_receive('execute_command_and_capture_output').with_args(
+        ('borg', '--version')
+    ).and_return(b'borg 1.0.10\n').once()
+
+    try:
+        assert module.local_borg_version() == (1, 0, 10)
+        assert module.local_borg_version() == (1, 0, 10)
+    finally:
+        module._cached_local_borg_version.cache_clear()
+
+
+def test_local_borg_version_called_concurrently_calls_borg_once():
+    def slow_borg_version(full_command):
+        time.sleep(0.05)
+        return b'borg 1.0.10\n'
+
+    module._cached_local_borg_version.cache_clear()
+    flexmock(module.execute).should_receive('execute_command_and_capture_output').replace_with(
+        slow_borg_version
+    ).once()
+
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            versions = list(executor.map(lambda _: module.local_borg_version(), range(4)))
+
+        assert versions == [(1, 0, 10)] * 4
+    finally:
+        module._cached_local_borg_version.cache_clear()
+
+
+def test_supports_json_with_new_version_returns_true():
+    flexmock(module).should_receive('local_borg_version').and_return((1, 1, 0))
+
+    assert module.supports_json() is True
+
+
+def test_supports_json_with_old_version_returns_false():
+    flexmock(module).should_receive('local_borg_version').and_return((1, 0, 11))
+
+    assert module.supports_json() is False
+
+
+def test_supports_archive_filters_with_new_version_returns_true():
+    flexmock(module).should_receive('local_borg_version').and_return((1, 1, 2))
+
+    assert module.supports_archive_filters() is True
+
+
+def test_supports_archive_filters_with_old_version_returns_false():
+    flexmock(module).should_receive('local_borg_version').and_return((1, 0, 11))
+
+    assert module.supports_archive_filters() is False
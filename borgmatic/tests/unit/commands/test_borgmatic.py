@@ -0,0 +1,159 @@
+import collections
+
+from flexmock import flexmock
+
+from borgmatic.commands import borgmatic as module
+
+
+def test_make_actions_makes_requested_actions_for_each_repository():
+    args = flexmock(prune=True, create=True, check=True, verbosity=None, progress=False, dry_run=False)
+
+    actions = module._make_actions(args, {'repositories': ['repo1', 'repo2']}, {}, {}, {})
+
+    assert [(action.name, action.lock) for action in actions] == [
+        ('create', 'repo1'),
+        ('prune', 'repo1'),
+        ('check', 'repo1'),
+        ('create', 'repo2'),
+        ('prune', 'repo2'),
+        ('check', 'repo2'),
+    ]
+
+
+def test_make_actions_skips_unrequested_actions():
+    args = flexmock(prune=False, create=True, check=False, verbosity=None, progress=False, dry_run=False)
+
+    actions = module._make_actions(args, {'repositories': ['repo']}, {}, {}, {})
+
+    assert [(action.name, action.lock) for action in actions] == [('create', 'repo')]
+
+
+def test_make_actions_passes_storage_config_to_actions():
+    args = flexmock(prune=True, create=False, check=True, verbosity=None, dry_run=False)
+    storage = {'encryption_passphrase': 'pass'}
+    flexmock(module.prune).should_receive('prune_archives').with_args(
+        None, 'repo', storage, {}, remote_path=None, dry_run=False
+    ).once()
+    flexmock(module.check).should_receive('check_archives').with_args(
+        None, 'repo', storage, {}, remote_path=None
+    ).once()
+
+    for action in module._make_actions(args, {'repositories': ['repo']}, storage, {}, {}):
+        action.function()
+
+
+def test_make_actions_passes_progress_argument_to_create_action():
+    args = flexmock(prune=False, create=True, check=False, verbosity=None, progress=True)
+    location = {'repositories': ['repo']}
+    flexmock(module.create).should_receive('create_archive').with_args(
+        None, 'repo', location, {}, progress=True
+    ).once()
+
+    for action in module._make_actions(args, location, {}, {}, {}):
+        action.function()
+
+
+def test_make_actions_passes_dry_run_argument_to_prune_action():
+    args = flexmock(prune=True, create=False, check=False, verbosity=None, dry_run=True)
+    flexmock(module.prune).should_receive('prune_archives').with_args(
+        None, 'repo', {}, {}, remote_path=None, dry_run=True
+    ).once()
+
+    for action in module._make_actions(args, {'repositories': ['repo']}, {}, {}, {}):
+        action.function()
+
+
+def test_run_configuration_runs_actions_with_repository_jobs_from_config():
+    args = flexmock(repository_jobs=None)
+    config = {'location': {'repositories': ['repo1', 'repo2'], 'repository_jobs': 2}}
+    flexmock(module).should_receive('_make_actions').and_return([])
+    flexmock(module.scheduler).should_receive('run_actions').with_args([], 2).once()
+
+    module.run_configuration('config.yaml', config, args)
+
+
+def test_run_configuration_with_repository_jobs_argument_overrides_config():
+    args = flexmock(repository_jobs=3)
+    config = {'location': {'repositories': ['repo1', 'repo2'], 'repository_jobs': 2}}
+    flexmock(module).should_receive('_make_actions').and_return([])
+    flexmock(module.scheduler).should_receive('run_actions').with_args([], 3).once()
+
+    module.run_configuration('config.yaml', config, args)
+
+
+def test_run_configuration_profiles_actions():
+    args = flexmock(repository_jobs=None)
+    config = {'location': {'repositories': ['repo']}}
+    function = flexmock()
+    profiled_function = flexmock()
+    flexmock(module).should_receive('_make_actions').and_return(
+        [module.scheduler.Action('create', 'repo', function)]
+    )
+    flexmock(module.profiling).should_receive('wrap').with_args(
+        function, 'create', 'config.yaml', 'repo'
+    ).and_return(profiled_function)
+    flexmock(module.scheduler).should_receive('run_actions').with_args(
+        [module.scheduler.Action('create', 'repo', profiled_function)], 1
+    ).once()
+
+    module.run_configuration('config.yaml', config, args)
+
+
+def test_parse_configurations_with_cache_config_argument_uses_config_cache():
+    args = flexmock(jobs=None, cache_config=True)
+    flexmock(module.validate).should_receive('parse_configurations').with_args(
+        ('config.yaml',), str, int, use_cache=True
+    ).and_return(({}, {})).once()
+
+    module.parse_configurations(('config.yaml',), args)
+
+
+def test_parse_configurations_with_jobs_argument_uses_that_many_jobs():
+    args = flexmock(jobs=3, cache_config=False)
+    flexmock(module.validate).should_receive('parse_configurations').with_args(
+        ('config.yaml',), str, 3, use_cache=False
+    ).and_return(({}, {})).once()
+
+    module.parse_configurations(('config.yaml',), args)
+
+
+def test_display_validation_status_displays_each_file_status(capsys):
+    module.display_validation_status(
+        ('bad.yaml', 'good.yaml'),
+        {'bad.yaml': module.validate.Validation_error('bad.yaml', ('oops',))},
+    )
+
+    (stdout, stderr) = capsys.readouterr()
+    assert stdout == 'bad.yaml: invalid\ngood.yaml: valid\n'
+    assert 'bad.yaml' in stderr
+    assert 'oops' in stderr
+
+
+def test_run_configurations_runs_configuration_files_with_jobs_argument():
+    args = flexmock(jobs=4)
+    flexmock(module.scheduler).should_receive('run_actions').with_args(list, 4).once()
+
+    module.run_configurations({'foo.yaml': {}, 'bar.yaml': {}}, args)
+
+
+def test_run_configurations_locks_configuration_files_on_their_repositories():
+    args = flexmock(jobs=2)
+    flexmock(module.scheduler).should_receive('run_actions').replace_with(
+        lambda actions, jobs: actions_run.extend(actions)
+    )
+    actions_run = []
+
+    module.run_configurations(
+        collections.OrderedDict(
+            (
+                ('foo.yaml', {'location': {'repositories': ['repo1', 'repo2']}}),
+                ('bar.yaml', {'location': {'repositories': ['repo2']}}),
+            )
+        ),
+        args,
+    )
+
+    assert [(action.lock, action.shared_locks) for action in actions_run] == [
+        ('foo.yaml', ('repo1', 'repo2')),
+        ('bar.yaml', ('repo2',)),
+    ]
@@ -3,6 +3,18 @@ from flexmock import flexmock
 from borgmatic.config import collect as module
 
 
+def make_entry(directory, name, is_dir=False, is_symlink=False):
+    '''
+    Return a mock os.DirEntry for the given name within the given directory.
+    '''
+    return flexmock(
+        name=name,
+        path='{}/{}'.format(directory, name),
+        is_dir=lambda: is_dir,
+        is_symlink=lambda: is_symlink,
+    )
+
+
 def test_collect_config_filenames_collects_given_files():
     config_paths = ('config.yaml', 'other.yaml')
     flexmock(module.os.path).should_receive('isdir').and_return(False)
@@ -18,19 +30,87 @@ def test_collect_config_filenames_collects_files_from_given_directories_and_igno
     mock_path.should_receive('exists').and_return(True)
     mock_path.should_receive('isdir').with_args('config.yaml').and_return(False)
     mock_path.should_receive('isdir').with_args('/etc/borgmatic.d').and_return(True)
-    mock_path.should_receive('isdir').with_args('/etc/borgmatic.d/foo.yaml').and_return(False)
-    mock_path.should_receive('isdir').with_args('/etc/borgmatic.d/bar').and_return(True)
-    mock_path.should_receive('isdir').with_args('/etc/borgmatic.d/baz.yaml').and_return(False)
-    flexmock(module.os).should_receive('listdir').and_return(['foo.yaml', 'bar', 'baz.yaml'])
+    flexmock(module.os).should_receive('scandir').with_args('/etc/borgmatic.d').and_return(
+        [
+            make_entry('/etc/borgmatic.d', 'foo.yaml'),
+            make_entry('/etc/borgmatic.d', 'bar', is_dir=True),
+            make_entry('/etc/borgmatic.d', 'baz.yaml'),
+        ]
+    )
 
     config_filenames = tuple(module.collect_config_filenames(config_paths))
 
     assert config_filenames == (
         'config.yaml',
-        '/etc/borgmatic.d/foo.yaml',
         '/etc/borgmatic.d/baz.yaml',
+        '/etc/borgmatic.d/foo.yaml',
+    )
+
+
+def test_collect_config_filenames_with_recursive_collects_files_from_sub_directories():
+    mock_path = flexmock(module.os.path)
+    mock_path.should_receive('exists').and_return(True)
+    mock_path.should_receive('isdir').and_return(True)
+    flexmock(module.os).should_receive('scandir').with_args('/etc/borgmatic.d').and_return(
+        [
+            make_entry('/etc/borgmatic.d', 'foo.yaml'),
+            make_entry('/etc/borgmatic.d', 'bar', is_dir=True),
+            make_entry('/etc/borgmatic.d', 'link', is_dir=True, is_symlink=True),
+        ]
+    )
+    flexmock(module.os).should_receive('scandir').with_args('/etc/borgmatic.d/bar').and_return(
+        [make_entry('/etc/borgmatic.d/bar', 'baz.yaml')]
+    )
+
+    config_filenames = tuple(
+        module.collect_config_filenames(('/etc/borgmatic.d',), recursive=True)
+    )
+
+    assert config_filenames == ('/etc/borgmatic.d/bar/baz.yaml', '/etc/borgmatic.d/foo.yaml')
+
+
+def test_collect_config_filenames_with_include_patterns_collects_only_matching_files():
+    mock_path = flexmock(module.os.path)
+    mock_path.should_receive('exists').and_return(True)
+    mock_path.should_receive('isdir').with_args('/etc/borgmatic.d').and_return(True)
+    mock_path.should_receive('isdir').with_args('other.txt').and_return(False)
+    flexmock(module.os).should_receive('scandir').with_args('/etc/borgmatic.d').and_return(
+        [
+            make_entry('/etc/borgmatic.d', 'foo.yaml'),
+            make_entry('/etc/borgmatic.d', 'foo.yaml.bak'),
+            make_entry('/etc/borgmatic.d', 'bar.yml'),
+        ]
+    )
+
+    config_filenames = tuple(
+        module.collect_config_filenames(
+            ('/etc/borgmatic.d', 'other.txt'), include_patterns=('*.yaml', '*.yml')
+        )
+    )
+
+    assert config_filenames == ('/etc/borgmatic.d/bar.yml', '/etc/borgmatic.d/foo.yaml', 'other.txt')
+
+
+def test_collect_config_filenames_with_exclude_patterns_skips_matching_files_and_directories():
+    mock_path = flexmock(module.os.path)
+    mock_path.should_receive('exists').and_return(True)
+    mock_path.should_receive('isdir').and_return(True)
+    flexmock(module.os).should_receive('scandir').with_args('/etc/borgmatic.d').and_return(
+        [
+            make_entry('/etc/borgmatic.d', 'foo.yaml'),
+            make_entry('/etc/borgmatic.d', 'foo.yaml~'),
+            make_entry('/etc/borgmatic.d', 'old', is_dir=True),
+        ]
+    )
+
+    config_filenames = tuple(
+        module.collect_config_filenames(
+            ('/etc/borgmatic.d',), recursive=True, exclude_patterns=('*~', 'old')
+        )
     )
 
+    assert config_filenames == ('/etc/borgmatic.d/foo.yaml',)
+
 
 def test_collect_config_filenames_skips_etc_borgmatic_config_dot_yaml_if_it_does_not_exist():
     config_paths = ('config.yaml', '/etc/borgmatic/config.yaml')
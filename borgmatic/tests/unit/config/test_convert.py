@@ -3,6 +3,7 @@ import os
 
 from flexmock import flexmock
 import pytest
+from ruamel import yaml
 
 from borgmatic.config import convert as module
 
@@ -11,7 +12,7 @@ Parsed_config = namedtuple('Parsed_config', ('location', 'storage', 'retention',
 
 
 def test_convert_section_generates_integer_value_for_integer_type_in_schema():
-    flexmock(module.yaml.comments).should_receive('CommentedMap').replace_with(OrderedDict)
+    flexmock(yaml.comments).should_receive('CommentedMap').replace_with(OrderedDict)
     source_section_config = OrderedDict([('check_last', '3')])
     section_schema = {'map': {'check_last': {'type': 'int'}}}
 
@@ -21,7 +22,7 @@ def test_convert_section_generates_integer_value_for_integer_type_in_schema():
 
 
 def test_convert_legacy_parsed_config_transforms_source_config_to_mapping():
-    flexmock(module.yaml.comments).should_receive('CommentedMap').replace_with(OrderedDict)
+    flexmock(yaml.comments).should_receive('CommentedMap').replace_with(OrderedDict)
     source_config = Parsed_config(
         location=OrderedDict([('source_directories', '/home'), ('repository', 'hostname.borg')]),
         storage=OrderedDict([('encryption_passphrase', 'supersecret')]),
@@ -49,7 +50,7 @@ def test_convert_legacy_parsed_config_transforms_source_config_to_mapping():
 
 
 def test_convert_legacy_parsed_config_splits_space_separated_values():
-    flexmock(module.yaml.comments).should_receive('CommentedMap').replace_with(OrderedDict)
+    flexmock(yaml.comments).should_receive('CommentedMap').replace_with(OrderedDict)
     source_config = Parsed_config(
         location=OrderedDict([('source_directories', '/home /etc'), ('repository', 'hostname.borg')]),
         storage=OrderedDict(),
@@ -0,0 +1,147 @@
+import pytest
+
+from borgmatic.config import validator as module
+
+
+def test_compile_schema_with_valid_config_returns_no_errors():
+    validate = module.compile_schema(
+        {
+            'map': {
+                'section': {
+                    'required': True,
+                    'map': {
+                        'names': {'seq': [{'type': 'scalar'}]},
+                        'count': {'type': 'int'},
+                        'enabled': {'type': 'bool'},
+                    },
+                }
+            }
+        }
+    )
+
+    assert validate({'section': {'names': ['foo', 3], 'count': 5, 'enabled': False}}) == []
+
+
+def test_compile_schema_with_non_dict_config_errors():
+    validate = module.compile_schema({'map': {'section': {'map': {}}}})
+
+    assert validate(None) == ["Value 'None' is not a dict. Value path: ''"]
+
+
+def test_compile_schema_with_missing_required_key_errors():
+    validate = module.compile_schema({'map': {'foo': {'required': True}, 'bar': {'required': True}}})
+
+    assert validate({}) == [
+        "Cannot find required key 'foo'. Path: ''",
+        "Cannot find required key 'bar'. Path: ''",
+    ]
+
+
+def test_compile_schema_with_required_key_without_value_errors():
+    validate = module.compile_schema({'map': {'foo': {'required': True, 'map': {}}}})
+
+    assert validate({'foo': None}) == ["required.novalue : '/foo'"]
+
+
+def test_compile_schema_with_undefined_key_errors():
+    validate = module.compile_schema({'map': {'section': {'map': {'foo': {'type': 'int'}}}}})
+
+    assert validate({'section': {'bar': 1}}) == ["Key 'bar' was not defined. Path: '/section'"]
+
+
+def test_compile_schema_with_non_list_value_for_sequence_errors():
+    validate = module.compile_schema({'map': {'foo': {'seq': [{'type': 'str'}]}}})
+
+    assert validate({'foo': 'bar'}) == ["Value 'bar' is not a list. Value path: '/foo'"]
+
+
+def test_compile_schema_with_missing_optional_value_does_not_error():
+    validate = module.compile_schema({'map': {'foo': {'seq': [{'type': 'str'}]}, 'bar': {}}})
+
+    assert validate({'foo': None, 'bar': None}) == []
+
+
+@pytest.mark.parametrize(
+    'type_name,value',
+    (
+        ('int', True),
+        ('int', '1'),
+        ('int', 1.5),
+        ('bool', 1),
+        ('bool', 'yes'),
+        ('str', 1),
+        ('scalar', [1]),
+        ('scalar', {'a': 1}),
+        ('float', 'abc'),
+    ),
+)
+def test_compile_schema_with_wrong_type_errors(type_name, value):
+    validate = module.compile_schema({'map': {'foo': {'type': type_name}}})
+
+    assert validate({'foo': value}) == [
+        "Value '{}' is not of type '{}'. Path: '/foo'".format(value, type_name)
+    ]
+
+
+@pytest.mark.parametrize(
+    'type_name,value',
+    (
+        ('int', 1),
+        ('bool', True),
+        ('str', 'a'),
+        ('scalar', 'a'),
+        ('scalar', 1.5),
+        ('float', '1e-06'),
+        ('number', 2),
+        ('text', 3),
+        ('any', [1]),
+    ),
+)
+def test_compile_schema_with_right_type_does_not_error(type_name, value):
+    validate = module.compile_schema({'map': {'foo': {'type': type_name}}})
+
+    assert validate({'foo': value}) == []
+
+
+def test_compile_schema_with_value_not_in_enum_errors():
+    validate = module.compile_schema(
+        {'map': {'foo': {'seq': [{'type': 'str', 'enum': ['a', 'b']}]}}}
+    )
+
+    assert validate({'foo': ['a', 'c', 5]}) == [
+        "Enum 'c' does not exist. Path: '/foo/1'",
+        "Enum '5' does not exist. Path: '/foo/2'",
+        "Value '5' is not of type 'str'. Path: '/foo/2'",
+    ]
+
+
+def test_compile_schema_with_duplicate_unique_values_errors():
+    validate = module.compile_schema({'map': {'foo': {'seq': [{'type': 'str', 'unique': True}]}}})
+
+    assert validate({'foo': ['a', 'b', 'a', 'a']}) == [
+        "Value 'a' is not unique. Previous path: '/foo/0'. Path: '/foo/2'",
+        "Value 'a' is not unique. Previous path: '/foo/0'. Path: '/foo/3'",
+    ]
+
+
+def test_compile_schema_ignores_documentation_keys():
+    validate = module.compile_schema(
+        {'name': 'schema', 'version': 1, 'map': {'foo': {'desc': 'Foo.', 'example': 'bar'}}}
+    )
+
+    assert validate({'foo': 'bar'}) == []
+
+
+def test_compile_schema_with_unsupported_key_raises():
+    with pytest.raises(module.Unsupported_schema_error):
+        module.compile_schema({'map': {'foo': {'type': 'str', 'pattern': '^a$'}}})
+
+
+def test_compile_schema_with_unsupported_type_raises():
+    with pytest.raises(module.Unsupported_schema_error):
+        module.compile_schema({'map': {'foo': {'type': 'timestamp'}}})
+
+
+def test_compile_schema_with_multiple_sequence_rules_raises():
+    with pytest.raises(module.Unsupported_schema_error):
+        module.compile_schema({'map': {'foo': {'seq': [{'type': 'str'}, {'type': 'int'}]}}})
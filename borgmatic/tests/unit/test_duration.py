@@ -0,0 +1,29 @@
+import pytest
+
+from borgmatic import duration as module
+
+
+@pytest.mark.parametrize(
+    'duration,seconds',
+    (
+        ('1 second', 1),
+        ('30 seconds', 30),
+        ('5 minutes', 5 * 60),
+        ('12h', 12 * 60 * 60),
+        ('1 day', 24 * 60 * 60),
+        ('3d', 3 * 24 * 60 * 60),
+        ('2 weeks', 14 * 24 * 60 * 60),
+        ('2W', 14 * 24 * 60 * 60),
+        ('1 month', 30 * 24 * 60 * 60),
+        (' 1 year ', 365 * 24 * 60 * 60),
+        (90, 90),
+    ),
+)
+def test_parse_duration_returns_seconds(duration, seconds):
+    assert module.parse_duration(duration) == seconds
+
+
+@pytest.mark.parametrize('duration', ('', 'week', '1', '1 fortnight', '-1 day', '1.5 days', True))
+def test_parse_duration_with_invalid_duration_raises(duration):
+    with pytest.raises(ValueError):
+        module.parse_duration(duration)
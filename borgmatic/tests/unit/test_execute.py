@@ -0,0 +1,221 @@
+from flexmock import flexmock
+import pytest
+
+from borgmatic import execute as module
+
+
+def test_execute_command_calls_full_command():
+    full_command = ['foo', 'bar']
+    process = flexmock()
+    flexmock(module).should_receive('_start_process').with_args(full_command, env=None).and_return(
+        process
+    ).once()
+    flexmock(module).should_receive('supervise_processes').with_args({process: {}}, None).once()
+
+    module.execute_command(full_command)
+
+
+def test_execute_command_with_extra_environment_passes_combined_environment():
+    full_command = ['foo', 'bar']
+    process = flexmock()
+    flexmock(module.os).should_receive('environ').and_return({'PATH': '/bin'})
+    flexmock(module).should_receive('_start_process').with_args(
+        full_command, env={'PATH': '/bin', 'BORG_PASSPHRASE': 'pass'}
+    ).and_return(process).once()
+    flexmock(module).should_receive('supervise_processes')
+
+    module.execute_command(full_command, extra_environment={'BORG_PASSPHRASE': 'pass'})
+
+
+def test_execute_command_with_output_file_sends_output_there():
+    full_command = ['foo', 'bar']
+    output_file = flexmock()
+    process = flexmock()
+    flexmock(module).should_receive('_start_process').with_args(
+        full_command, stdout=output_file, stderr=module.subprocess.STDOUT, env=None
+    ).and_return(process).once()
+    flexmock(module).should_receive('supervise_processes').with_args({process: {}}, None).once()
+
+    module.execute_command(full_command, output_file=output_file)
+
+
+def test_execute_command_with_buffered_output_streams_output_into_buffer():
+    full_command = ['foo', 'bar']
+    process = flexmock(stdout=flexmock())
+    flexmock(module).should_receive('_start_process').with_args(
+        full_command, stdout=module.subprocess.PIPE, stderr=module.subprocess.STDOUT, env=None
+    ).and_return(process).once()
+    flexmock(module).should_receive('supervise_processes').with_args(
+        {process: {process.stdout: module.write_output}}, None
+    ).once()
+
+    with module.buffered_output():
+        module.execute_command(full_command)
+
+
+def test_execute_command_with_timeout_passes_it_through():
+    process = flexmock()
+    flexmock(module).should_receive('_start_process').and_return(process)
+    flexmock(module).should_receive('supervise_processes').with_args({process: {}}, 30).once()
+
+    module.execute_command(['foo', 'bar'], timeout=30)
+
+
+def test_execute_command_and_capture_output_returns_stdout():
+    full_command = ['foo', 'bar']
+    process = flexmock(stdout=flexmock())
+    flexmock(module).should_receive('_start_process').with_args(
+        full_command, stdout=module.subprocess.PIPE, stderr=None, env=None
+    ).and_return(process).once()
+
+    def supervise(process_handlers, timeout):
+        process_handlers[process][process.stdout](b'line1\n')
+        process_handlers[process][process.stdout](b'line2\n')
+
+    flexmock(module).should_receive('supervise_processes').replace_with(supervise)
+
+    output = module.execute_command_and_capture_output(full_command)
+
+    assert output == b'line1\nline2\n'
+
+
+def test_execute_command_and_capture_output_with_buffered_output_streams_stderr_into_buffer():
+    full_command = ['foo', 'bar']
+    process = flexmock(stdout=flexmock(), stderr=flexmock())
+    flexmock(module).should_receive('_start_process').with_args(
+        full_command, stdout=module.subprocess.PIPE, stderr=module.subprocess.PIPE, env=None
+    ).and_return(process).once()
+
+    def supervise(process_handlers, timeout):
+        process_handlers[process][process.stdout](b'output\n')
+        process_handlers[process][process.stderr](b'error\n')
+
+    flexmock(module).should_receive('supervise_processes').replace_with(supervise)
+
+    with module.buffered_output() as output_buffer:
+        output = module.execute_command_and_capture_output(full_command)
+
+    assert output == b'output\n'
+    assert output_buffer.read() == b'error\n'
+
+
+def test_read_lines_passes_complete_lines_to_handler_and_keeps_partial_line():
+    lines = []
+    key = flexmock(fileobj='pipe', fd=3, data=lines.append)
+    flexmock(module.os).should_receive('read').and_return(b'two\nthree\nfo')
+    partial_lines = {'pipe': b'one '}
+
+    module._read_lines(flexmock(), key, partial_lines)
+
+    assert lines == [b'one two\n', b'three\n']
+    assert partial_lines == {'pipe': b'fo'}
+
+
+def test_read_lines_hands_off_overlong_partial_line():
+    lines = []
+    key = flexmock(fileobj='pipe', fd=3, data=lines.append)
+    flexmock(module.os).should_receive('read').and_return(b'x' * (module.READ_SIZE + 1))
+    partial_lines = {}
+
+    module._read_lines(flexmock(), key, partial_lines)
+
+    assert lines == [b'x' * (module.READ_SIZE + 1)]
+    assert partial_lines == {}
+
+
+def test_read_lines_at_end_of_file_flushes_partial_line_and_unregisters_pipe():
+    lines = []
+    pipe = flexmock()
+    pipe.should_receive('close').once()
+    key = flexmock(fileobj=pipe, fd=3, data=lines.append)
+    flexmock(module.os).should_receive('read').and_return(b'')
+    selector = flexmock()
+    selector.should_receive('unregister').with_args(pipe).once()
+
+    module._read_lines(selector, key, {pipe: b'last'})
+
+    assert lines == [b'last']
+
+
+def test_hand_off_stale_partial_lines_passes_stale_partial_line_to_handler():
+    lines = []
+    selector = flexmock()
+    selector.should_receive('get_key').with_args('pipe').and_return(flexmock(data=lines.append))
+    flexmock(module.time).should_receive('monotonic').and_return(100.0)
+    partial_lines = {'pipe': b'Continue? '}
+    partial_line_times = {'pipe': 100.0 - module.PARTIAL_LINE_SECONDS}
+
+    next_due = module._hand_off_stale_partial_lines(selector, partial_lines, partial_line_times)
+
+    assert lines == [b'Continue? ']
+    assert partial_lines == {}
+    assert partial_line_times == {}
+    assert next_due is None
+
+
+def test_hand_off_stale_partial_lines_keeps_recent_partial_line_and_returns_when_due():
+    selector = flexmock()
+    selector.should_receive('get_key').never()
+    flexmock(module.time).should_receive('monotonic').and_return(0.0)
+    partial_lines = {'pipe': b'fo'}
+    partial_line_times = {'pipe': 0.0}
+
+    next_due = module._hand_off_stale_partial_lines(selector, partial_lines, partial_line_times)
+
+    assert partial_lines == {'pipe': b'fo'}
+    assert next_due == module.PARTIAL_LINE_SECONDS
+
+
+def test_buffered_output_restores_previous_buffer():
+    with module.buffered_output() as outer_buffer:
+        with module.buffered_output() as inner_buffer:
+            module.write_output(b'inner')
+
+        module.write_output(b'outer')
+
+    assert module._output_buffer() is None
+    assert inner_buffer.read() == b'inner'
+    assert outer_buffer.read() == b'outer'
+
+
+def test_copy_output_copies_into_current_buffer():
+    with module.buffered_output() as inner_buffer:
+        module.write_output(b'output')
+
+    with module.buffered_output() as outer_buffer:
+        module.copy_output(inner_buffer)
+
+    assert outer_buffer.read() == b'output'
+
+
+def test_output_is_buffered_only_within_buffered_output():
+    assert not module.output_is_buffered()
+
+    with module.buffered_output():
+        assert module.output_is_buffered()
+
+    assert not module.output_is_buffered()
+
+
+def test_write_output_without_buffered_output_writes_to_stdout():
+    stdout = flexmock(flush=lambda: None, buffer=flexmock(flush=lambda: None))
+    stdout.buffer.should_receive('write').with_args(b'output').once()
+    flexmock(module.sys).stdout = stdout
+
+    module.write_output(b'output')
+
+
+def test_terminate_children_signals_running_children_and_refuses_new_ones():
+    process = flexmock()
+    process.should_receive('send_signal').with_args(module.signal.SIGTERM).once()
+    flexmock(module.subprocess).should_receive('Popen').never()
+    module._children.add(process)
+
+    try:
+        module.terminate_children()
+
+        with pytest.raises(OSError):
+            module.execute_command(['foo', 'bar'])
+    finally:
+        module._children.discard(process)
+        module._terminating = False
@@ -0,0 +1,124 @@
+from flexmock import flexmock
+
+from borgmatic import profiling as module
+
+
+def setup_function(function):
+    module._records[:] = []
+
+
+def teardown_function(function):
+    module._enabled = False
+    module._records[:] = []
+
+
+def test_phase_when_not_enabled_records_nothing():
+    with module.phase('create'):
+        pass
+
+    assert module._records == []
+
+
+def test_phase_records_wall_and_cpu_time():
+    module._enabled = True
+
+    with module.phase('create', 'config.yaml', 'repo'):
+        pass
+
+    (record,) = module._records
+    assert record['phase'] == 'create'
+    assert record['config_filename'] == 'config.yaml'
+    assert record['repository'] == 'repo'
+    assert record['wall_seconds'] >= 0
+    assert record['cpu_seconds'] >= 0
+
+
+def test_phase_inherits_labels_from_enclosing_phase():
+    module._enabled = True
+
+    with module.phase('create', 'config.yaml', 'repo'):
+        with module.phase('expand'):
+            pass
+
+    assert module._records[0]['phase'] == 'expand'
+    assert module._records[0]['config_filename'] == 'config.yaml'
+    assert module._records[0]['repository'] == 'repo'
+
+
+def test_record_phase_records_given_timings():
+    module._enabled = True
+
+    module.record_phase('parse', 1.5, 0.5, 'config.yaml')
+
+    (record,) = module._records
+    assert record['phase'] == 'parse'
+    assert record['config_filename'] == 'config.yaml'
+    assert record['repository'] is None
+    assert record['wall_seconds'] == 1.5
+    assert record['cpu_seconds'] == 0.5
+
+
+def test_record_phase_when_not_enabled_records_nothing():
+    module.record_phase('parse', 1.5, 0.5, 'config.yaml')
+
+    assert module._records == []
+
+def test_record_child_usage_adds_to_active_phases():
+    module._enabled = True
+
+    rusage = flexmock(ru_utime=1.5, ru_stime=0.5, ru_maxrss=1024)
+
+    with module.phase('create', 'config.yaml', 'repo'):
+        module.record_child_usage(rusage)
+        module.record_child_usage(rusage)
+
+    (record,) = module._records
+    assert record['child_user_seconds'] == 3.0
+    assert record['child_system_seconds'] == 1.0
+    assert record['child_max_rss_kilobytes'] == 1024
+
+
+def test_record_child_usage_outside_of_phase_does_not_raise():
+    module.record_child_usage(flexmock(ru_utime=1.5, ru_stime=0.5, ru_maxrss=1024))
+
+
+def test_wrap_records_calls_as_phase_and_returns_result():
+    module._enabled = True
+
+    function = module.wrap(lambda value: value * 2, 'check', 'config.yaml', 'repo')
+
+    assert function(3) == 6
+    assert module._records[0]['phase'] == 'check'
+
+
+def test_summarize_without_python_profiling_returns_phases():
+    module._enabled = True
+
+    with module.phase('create', 'config.yaml', 'repo'):
+        pass
+
+    summary = module.summarize('profile.json')
+
+    assert len(summary['phases']) == 1
+    assert summary['python'] is None
+
+
+def test_format_table_includes_heading_and_phases():
+    summary = {
+        'phases': [
+            {
+                'phase': 'create',
+                'config_filename': 'config.yaml',
+                'repository': None,
+                'wall_seconds': 1.5,
+                'cpu_seconds': 0.25,
+                'child_user_seconds': 1.0,
+                'child_system_seconds': 0.5,
+            }
+        ]
+    }
+
+    table = module.format_table(summary).split('\n')
+
+    assert table[0].split() == ['Phase', 'Configuration', 'Repository', 'Wall', 'CPU', 'Child', 'user', 'Child', 'sys']
+    assert table[1].split() == ['create', 'config.yaml', '-', '1.500s', '0.250s', '1.000s', '0.500s']
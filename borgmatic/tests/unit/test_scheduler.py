@@ -0,0 +1,207 @@
+from subprocess import CalledProcessError
+import threading
+import time
+
+from flexmock import flexmock
+import pytest
+
+from borgmatic import scheduler as module
+
+
+def make_action(name, lock, calls, error=None, output=None, shared_locks=()):
+    def function():
+        calls.append((name, lock))
+        if output:
+            module.execute._output_buffer().write(output)
+        if error:
+            raise error
+
+    return module.Action(name, lock, function, shared_locks)
+
+
+def test_make_dependencies_chains_actions_with_same_lock():
+    actions = (
+        module.Action('create', 'repo1', None),
+        module.Action('prune', 'repo1', None),
+        module.Action('create', 'repo2', None),
+        module.Action('check', 'repo1', None),
+    )
+
+    dependencies = module._make_dependencies(actions)
+
+    assert dependencies == {0: (), 1: (0,), 2: (), 3: (1,)}
+
+
+def test_make_dependencies_chains_actions_with_same_shared_lock():
+    actions = (
+        module.Action('configuration', 'a.yaml', None, shared_locks=('repo1', 'repo2')),
+        module.Action('configuration', 'b.yaml', None, shared_locks=('repo3',)),
+        module.Action('configuration', 'c.yaml', None, shared_locks=('repo2', 'repo3')),
+        module.Action('configuration', 'd.yaml', None, shared_locks=('repo4',)),
+    )
+
+    dependencies = module._make_dependencies(actions)
+
+    assert dependencies == {0: (), 1: (), 2: (0, 1), 3: ()}
+
+
+def test_order_ready_sorts_by_priority_and_then_original_order():
+    actions = (
+        module.Action('check', 'repo1', None),
+        module.Action('prune', 'repo2', None),
+        module.Action('create', 'repo3', None),
+        module.Action('create', 'repo4', None),
+    )
+
+    assert module._order_ready([0, 1, 2, 3], actions) == [2, 3, 1, 0]
+
+
+def test_run_actions_with_single_job_runs_creates_for_all_locks_first():
+    calls = []
+    actions = [
+        make_action('create', 'repo1', calls),
+        make_action('prune', 'repo1', calls),
+        make_action('create', 'repo2', calls),
+        make_action('prune', 'repo2', calls),
+    ]
+    flexmock(module).should_receive('ThreadPoolExecutor').never()
+
+    module.run_actions(actions, jobs=1)
+
+    assert calls == [
+        ('create', 'repo1'),
+        ('create', 'repo2'),
+        ('prune', 'repo1'),
+        ('prune', 'repo2'),
+    ]
+
+
+def test_run_actions_with_single_job_and_error_raises_immediately():
+    calls = []
+    actions = [
+        make_action('create', 'repo1', calls, error=CalledProcessError(1, 'borg')),
+        make_action('create', 'repo2', calls),
+    ]
+
+    with pytest.raises(CalledProcessError):
+        module.run_actions(actions, jobs=1)
+
+    assert calls == [('create', 'repo1')]
+
+
+def test_run_actions_with_multiple_jobs_runs_independent_actions_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    actions = [
+        module.Action('create', 'repo1', barrier.wait),
+        module.Action('create', 'repo2', barrier.wait),
+    ]
+
+    module.run_actions(actions, jobs=2)
+
+
+def test_run_actions_with_multiple_jobs_runs_actions_with_same_lock_in_order():
+    calls = []
+    actions = [
+        make_action('create', 'repo1', calls),
+        make_action('prune', 'repo1', calls),
+        make_action('check', 'repo1', calls),
+    ]
+
+    module.run_actions(actions, jobs=3)
+
+    assert calls == [('create', 'repo1'), ('prune', 'repo1'), ('check', 'repo1')]
+
+
+def test_run_actions_with_multiple_jobs_writes_output_grouped_by_lock():
+    calls = []
+    actions = [
+        make_action('create', 'repo1', calls, output=b'create1 '),
+        make_action('prune', 'repo1', calls, output=b'prune1 '),
+    ]
+
+    with module.execute.buffered_output() as output_buffer:
+        module.run_actions(actions, jobs=2)
+
+    assert output_buffer.read() == b'create1 prune1 '
+
+
+def test_run_actions_with_multiple_jobs_writes_output_in_lock_order():
+    second_finished = threading.Event()
+
+    def first():
+        second_finished.wait(timeout=5)
+        module.execute.write_output(b'repo1 ')
+
+    def second():
+        module.execute.write_output(b'repo2 ')
+        second_finished.set()
+
+    actions = [module.Action('create', 'repo1', first), module.Action('create', 'repo2', second)]
+
+    with module.execute.buffered_output() as output_buffer:
+        module.run_actions(actions, jobs=2)
+
+    assert second_finished.is_set()
+    assert output_buffer.read() == b'repo1 repo2 '
+
+
+def test_run_actions_with_multiple_jobs_and_error_skips_dependents_and_runs_others():
+    calls = []
+    actions = [
+        make_action('create', 'repo1', calls, error=CalledProcessError(1, 'borg')),
+        make_action('prune', 'repo1', calls),
+        make_action('create', 'repo2', calls),
+        make_action('prune', 'repo2', calls),
+    ]
+
+    with pytest.raises(ValueError) as error:
+        module.run_actions(actions, jobs=2)
+
+    assert sorted(calls) == [('create', 'repo1'), ('create', 'repo2'), ('prune', 'repo2')]
+    assert 'create for repo1' in str(error.value)
+    assert 'prune for repo1' not in str(error.value)
+
+
+def test_run_actions_with_multiple_jobs_runs_actions_with_same_shared_lock_one_at_a_time():
+    running = []
+    overlaps = []
+
+    def make_function(name):
+        def function():
+            if running:
+                overlaps.append((running[0], name))
+            running.append(name)
+            time.sleep(0.05)
+            running.remove(name)
+
+        return function
+
+    actions = [
+        module.Action('configuration', 'a.yaml', make_function('a.yaml'), shared_locks=('repo',)),
+        module.Action('configuration', 'b.yaml', make_function('b.yaml'), shared_locks=('repo',)),
+    ]
+
+    module.run_actions(actions, jobs=2)
+
+    assert overlaps == []
+
+
+def test_run_actions_with_multiple_jobs_and_error_skips_dependents_on_shared_lock():
+    calls = []
+    actions = [
+        make_action(
+            'configuration',
+            'a.yaml',
+            calls,
+            error=CalledProcessError(1, 'borg'),
+            shared_locks=('repo',),
+        ),
+        make_action('configuration', 'b.yaml', calls, shared_locks=('repo',)),
+        make_action('configuration', 'c.yaml', calls, shared_locks=('repo', 'other')),
+    ]
+
+    with pytest.raises(ValueError) as error:
+        module.run_actions(actions, jobs=2)
+
+    assert calls == [('configuration', 'a.yaml')]
+    assert 'configuration for a.yaml' in str(error.value)
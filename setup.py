@@ -22,6 +22,7 @@ setup(
         'Topic :: System :: Archiving :: Backup',
     ),
     packages=find_packages(),
+    python_requires='>=3.5',
     entry_points={
         'console_scripts': [
             'borgmatic = borgmatic.commands.borgmatic:main',
@@ -33,10 +34,13 @@ setup(
         'atticmatic',
     ],
     install_requires=(
-        'pykwalify',
         'ruamel.yaml<=0.15',
         'setuptools',
     ),
+    extras_require={
+        # Only needed to validate against a schema using features that borgmatic can't compile.
+        'pykwalify': ('pykwalify',),
+    },
     tests_require=(
         'flexmock',
         'pytest',